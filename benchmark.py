@@ -0,0 +1,265 @@
+"""
+Benchmark of the solver stages, no OpenGL context needed.
+
+Times every stage of a step separately over a sweep of grid sizes, solver
+iterations, solvers, backends, velocity layouts and numba thread counts. The first steps of
+each case are run untimed, so JIT compilation is not part of the results.
+
+Usage:
+    python benchmark.py --sizes 64 256 1024 --iterations 25 50 --solvers jacobi multigrid --json results.json
+    python benchmark.py --json new.json --compare results.json
+
+Tolerances are set to 0, so every iterative solve runs all its iterations
+and the work per step only depends on the case. With --compare the median
+of each stage is checked against the baseline and the exit code is 1 when
+one of them is slower than --threshold times the baseline.
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+
+from modules import backends
+from modules.config import SolverConfig
+from modules.layout import LAYOUTS, aos_view
+from modules.simulation import Simulation
+
+
+# stages in the order of Backend.solve_fields
+STAGES = ["difuse_vel_step", "project_1", "advect_vel", "project_2", "difuse_step", "advect"]
+FUSED_STAGES = ["difuse_vel_step", "project_1", "difuse_step", "advect_fused", "project_2"]
+
+# settings of each solver on top of SolverConfig defaults
+SOLVERS = {
+    "jacobi": {},
+    "gauss": {"solver_gauss": True},
+    "sor": {"solver_gauss": True, "sor_omega": 1.7},
+    "multigrid": {"solver_multigrid": True},
+    "cg": {"solver_cg": True},
+    "mic": {"solver_cg": True, "cg_preconditioner": "mic"},
+    "spectral": {"solver_spectral": True},
+    "direct": {"solver_direct": True},
+}
+
+# a case is identified by these, used to match results with a baseline
+KEYS = ["backend", "solver", "size", "iterations", "threads", "fused", "tiles", "blocking", "layout", "stage"]
+
+
+def make_config(solver, iterations, fused=False, layout="aos", tiles=False, blocking=False):
+    settings = dict(
+        SOLVERS[solver], n_iter=iterations, cg_max_iter=iterations, tolerance_abs=0.0, tolerance_rel=0.0,
+        fused_advection=fused, layout=layout, active_tiles=tiles, temporal_blocking=blocking
+    )
+    return SolverConfig(**settings)
+
+
+def make_scene(sim, seed=0):
+    """Same smoke and swirl for every case, scaled with the grid"""
+
+    rng = np.random.default_rng(seed)
+    n = sim.cell_count
+    block = slice(n//2 - n//8, n//2 + n//8)
+
+    sim.density_field[block, block] = 1.0
+    velocity = aos_view(sim.velocity_field)
+    shape = velocity[block, block].shape
+    velocity[block, block] = rng.normal(scale=200.0, size=shape)
+
+
+def timed_step(sim, dt):
+    """One step as Backend.solve_fields, returns the seconds of each stage"""
+
+    backend = sim.backend
+    pressure = sim.pressure_field if sim.warm_start else None
+    args = (dt, sim.dx, sim.dy, sim.width, sim.height)
+    stages = {
+        "difuse_vel_step": lambda: backend.diffuse(dt, sim.velocity_field, 1.0),
+        "project_1": lambda: backend.project(sim.dx, sim.dy, sim.velocity_field, pressure),
+        "advect_vel": lambda: backend.advect(*args, sim.velocity_field, sim.velocity_field),
+        "project_2": lambda: backend.project(sim.dx, sim.dy, sim.velocity_field, pressure),
+        "difuse_step": lambda: backend.diffuse(dt, sim.density_field, 2.0),
+        "advect": lambda: backend.advect(*args, sim.density_field, sim.velocity_field),
+        "advect_fused": lambda: backend.advect_fused(*args, sim.density_field, sim.velocity_field),
+        "active_tiles": lambda: backend.track_active(dt, sim.dx, sim.dy, sim.density_field, sim.velocity_field),
+    }
+
+    names = FUSED_STAGES if sim.config.fused_advection else STAGES
+    if sim.config.active_tiles:
+        names = ["active_tiles"] + names
+
+    times = {}
+    for name in names:
+        start = time.perf_counter()
+        stages[name]()
+        times[name] = time.perf_counter() - start
+    return times
+
+
+def run_case(backend, solver, size, iterations, threads, fused, tiles, blocking, layout, steps, warmup, dt):
+    """Results of one case, one row per stage plus the total"""
+
+    if threads is not None:
+        import numba
+        previous_threads = numba.get_num_threads()
+        numba.set_num_threads(threads)
+
+    sim = None
+    try:
+        sim = Simulation(900, 900, size, backend, make_config(solver, iterations, fused, layout, tiles, blocking))
+        make_scene(sim)
+
+        # compiles the kernels for these argument types
+        for _ in range(warmup):
+            timed_step(sim, dt)
+
+        samples = {}
+        for _ in range(steps):
+            times = timed_step(sim, dt)
+            times["total"] = sum(times.values())
+            for name, seconds in times.items():
+                samples.setdefault(name, []).append(seconds)
+    finally:
+        # the next case starts from the same thread count, and strips
+        # frees its worker processes and shared memory
+        if sim is not None:
+            sim.backend.close()
+        if threads is not None:
+            numba.set_num_threads(previous_threads)
+
+    rows = []
+    for name, values in samples.items():
+        values = np.array(values)*1000
+        rows.append({
+            "backend": backend,
+            "solver": solver,
+            "size": size,
+            "iterations": iterations,
+            "threads": threads,
+            "fused": fused,
+            "tiles": tiles,
+            "blocking": blocking,
+            "layout": layout,
+            "stage": name,
+            "steps": steps,
+            "mean_ms": float(values.mean()),
+            "median_ms": float(np.median(values)),
+            "min_ms": float(values.min()),
+            "p95_ms": float(np.percentile(values, 95)),
+        })
+    return rows
+
+
+def compare(rows, baseline, threshold):
+    """Median of each stage against the baseline, returns the regressions"""
+
+    reference = {tuple(row.get(k) for k in KEYS): row for row in baseline}
+
+    regressions = []
+    for row in rows:
+        base = reference.get(tuple(row[k] for k in KEYS))
+        if base is None:
+            continue
+
+        ratio = row["median_ms"] / base["median_ms"] if base["median_ms"] > 0 else float("inf")
+        row["baseline_ms"] = base["median_ms"]
+        row["ratio"] = ratio
+        if ratio > threshold:
+            regressions.append(row)
+    return regressions
+
+
+def write_json(path, rows):
+    meta = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    with open(path, "w") as f:
+        json.dump({"meta": meta, "results": rows}, f, indent=2)
+
+
+def write_csv(path, rows):
+    fields = list(dict.fromkeys(k for row in rows for k in row))
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Time each solver stage over a sweep of cases.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 128, 256, 512], help="cells on each side")
+    parser.add_argument("--iterations", type=int, nargs="+", default=[25], help="iterations of each solve")
+    parser.add_argument("--solvers", nargs="+", default=["jacobi"], choices=list(SOLVERS), help="solvers")
+    parser.add_argument("--backends", nargs="+", default=["numba"], choices=backends.available(), help="backends")
+    parser.add_argument("--threads", type=int, nargs="+", default=None, help="numba thread counts, default all cores")
+    parser.add_argument("--fused", action="store_true", help="fused advection of density and velocity")
+    parser.add_argument("--active-tiles", action="store_true", help="only sweep the tiles with smoke")
+    parser.add_argument("--blocking", action="store_true", help="temporally blocked jacobi sweeps")
+    parser.add_argument("--layouts", nargs="+", default=["aos"], choices=LAYOUTS, help="velocity layouts")
+    parser.add_argument("--steps", type=int, default=20, help="timed steps of each case")
+    parser.add_argument("--warmup", type=int, default=3, help="untimed steps before, JIT compilation included")
+    parser.add_argument("--dt", type=float, default=1/60, help="time step")
+    parser.add_argument("--json", default=None, help="write the results as json")
+    parser.add_argument("--csv", default=None, help="write the results as csv")
+    parser.add_argument("--compare", default=None, help="json of a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=1.1, help="slowdown ratio counted as a regression")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    rows = []
+    sweep = itertools.product(args.backends, args.solvers, args.sizes, args.iterations, args.layouts)
+    for backend, solver, size, iterations, layout in sweep:
+        # thread counts only apply to numba
+        threads = args.threads if backend == "numba" and args.threads else [None]
+        for n_threads in threads:
+            label = f"{backend:>6} {solver:>9} {size:>5}^2 {iterations:>4} it {layout} {n_threads or 'all':>3} threads"
+            try:
+                case = run_case(
+                    backend, solver, size, iterations, n_threads, args.fused, args.active_tiles, args.blocking, layout,
+                    args.steps, args.warmup, args.dt
+                )
+            except ValueError as e:
+                # a solver the backend does not have, or too many threads
+                print(f"{label}: skipped, {e}")
+                continue
+
+            rows.extend(case)
+            print(f"{label}: {case[-1]['median_ms']:9.3f} ms/step")
+
+    regressions = []
+    if args.compare:
+        regressions = compare(rows, load_results(args.compare), args.threshold)
+        for row in regressions:
+            print(
+                f"regression {row['backend']} {row['solver']} {row['size']}^2 {row['iterations']} it {row['layout']} "
+                f"{row['threads'] or 'all'} threads {row['stage']}: "
+                f"{row['median_ms']:.3f} ms vs {row['baseline_ms']:.3f} ms ({row['ratio']:.2f}x)"
+            )
+
+    if args.json:
+        write_json(args.json, rows)
+    if args.csv:
+        write_csv(args.csv, rows)
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
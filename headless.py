@@ -0,0 +1,184 @@
+"""
+Headless batch runner, no OpenGL context needed.
+
+Runs the solver as fast as possible and streams density frames to disk.
+
+Usage:
+    python headless.py --cells 256 --dt 0.016 --frames 600 --schedule scene.json --output frames/
+
+--backend picks the solver implementation, numba (default), taichi, numpy or
+strips (--strip-workers processes).
+
+The schedule is a json list of events, each one active on frames [start, end):
+    [
+        {"type": "density", "start": 0, "end": 120, "row": 100, "col": 64, "radius": 3, "value": 1.0},
+        {"type": "force", "start": 0, "end": 120, "row": 100, "col": 64, "radius": 2, "force": [0, -500]}
+    ]
+
+"density" sets the density on the square, "force" adds force*dt to the velocity.
+
+With --checkpoint-dir the state is saved every --checkpoint-every frames
+from a background thread, --resume continues a run from a checkpoint file
+or the last one of a directory. The run must use the options it was saved
+with (grid, backend, solver and integrator), a checkpoint of other ones is
+refused.
+
+With --record the frames go to one compressed recording instead of a .npy
+file each, quantized to --record-format (and the velocity with
+--record-velocity), encoded by a pool of threads (modules/recorder.py).
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from modules import backends, checkpoint, recorder
+from modules.config import SolverConfig
+from modules.integrator import TimeIntegrator
+from modules.layout import LAYOUTS
+from modules.simulation import Simulation
+
+
+def load_schedule(path):
+    if path is None:
+        return []
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def apply_schedule(sim, schedule, frame, dt):
+    """Apply every event active on this frame"""
+
+    for event in schedule:
+        if not event.get("start", 0) <= frame < event.get("end", frame+1):
+            continue
+
+        if event["type"] == "density":
+            sim.add_density(event["row"], event["col"], event.get("radius", 3), event.get("value", 1.0))
+        elif event["type"] == "force":
+            fx, fy = event["force"]
+            sim.add_velocity(event["row"], event["col"], event.get("radius", 2), fx*dt, fy*dt)
+        else:
+            raise ValueError(f"Unknown event type: {event['type']}")
+
+
+def print_profile(profiler):
+    """Rolling stats of the last frames, in milliseconds"""
+
+    print(f"{'stage':<16} {'mean':>8} {'p95':>8} {'max':>8}")
+    for name, stats in profiler.stats().items():
+        print(f"{name:<16} {stats['mean']:8.3f} {stats['p95']:8.3f} {stats['max']:8.3f}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the smoke simulation without a window.")
+    parser.add_argument("--cells", type=int, default=128, help="cells on each side of the grid")
+    parser.add_argument("--width", type=float, default=900, help="domain width")
+    parser.add_argument("--height", type=float, default=900, help="domain height")
+    parser.add_argument("--dt", type=float, default=1/60, help="time step of each frame")
+    parser.add_argument("--frames", type=int, default=300, help="number of frames to simulate")
+    parser.add_argument("--schedule", default=None, help="json file with sources and forces")
+    parser.add_argument("--output", default="frames", help="directory for the density frames")
+    parser.add_argument("--backend", default="numba", choices=backends.available(), help="solver backend")
+    parser.add_argument("--layout", default="aos", choices=LAYOUTS, help="memory layout of the velocity field")
+    parser.add_argument("--active-tiles", action="store_true", help="only sweep the tiles with smoke (numba)")
+    parser.add_argument("--integrator", default="none", choices=["none", "cfl", "fixed"], help="substeps of each frame")
+    parser.add_argument("--max-substeps", type=int, default=4, help="solves allowed per frame by the integrator")
+    parser.add_argument("--threads", type=int, default=None, help="numba threads, default is all cores")
+    parser.add_argument("--strip-workers", type=int, default=0, help="processes of the strips backend, default is all cores")
+    parser.add_argument("--checkpoint-dir", default=None, help="directory for periodic checkpoints")
+    parser.add_argument("--checkpoint-every", type=int, default=100, help="frames between checkpoints")
+    parser.add_argument("--resume", default=None, help="checkpoint file, or directory of checkpoints, to continue from")
+    parser.add_argument("--record", default=None, help="compressed recording to write instead of the .npy frames")
+    parser.add_argument("--record-format", default="uint16", choices=recorder.DENSITY_FORMATS, help="density format of the recording")
+    parser.add_argument("--record-velocity", default=None, choices=recorder.VELOCITY_FORMATS, help="also record the velocity in this format")
+    parser.add_argument("--record-workers", type=int, default=2, help="threads compressing the recording")
+    parser.add_argument("--stats", action="store_true", help="print iterations and residual of each solve")
+    parser.add_argument("--profile", action="store_true", help="print the time of each stage at the end")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if args.threads is not None:
+        import numba
+        numba.set_num_threads(args.threads)
+
+    if args.record is None:
+        os.makedirs(args.output, exist_ok=True)
+
+    schedule = load_schedule(args.schedule)
+    sim = Simulation(args.width, args.height, args.cells, args.backend, SolverConfig(
+        layout=args.layout, active_tiles=args.active_tiles, strip_workers=args.strip_workers
+    ))
+    sim.integrator = TimeIntegrator(
+        None if args.integrator == "none" else args.integrator, fixed_dt=args.dt, max_substeps=args.max_substeps
+    )
+
+    first = 0
+    if args.resume is not None:
+        path = checkpoint.latest(args.resume) if os.path.isdir(args.resume) else args.resume
+        if path is None:
+            raise ValueError(f"No checkpoint in {args.resume}")
+        first = checkpoint.restore(sim, path)["frame"] + 1
+        print(f"resumed from {path}, frame {first}")
+
+    checkpointer = None
+    if args.checkpoint_dir is not None:
+        checkpointer = checkpoint.Checkpointer(args.checkpoint_dir, args.checkpoint_every)
+
+    recording = None
+    if args.record is not None:
+        recording = recorder.Recorder(
+            args.record, args.record_format, args.record_velocity, workers=args.record_workers
+        )
+
+    # JIT compilation is not part of the timings
+    sim.warm_up()
+
+    start = time.perf_counter()
+    for frame in range(first, args.frames):
+        apply_schedule(sim, schedule, frame, args.dt)
+        sim.advance(args.dt)
+
+        if args.stats:
+            steps = ", ".join(f"{name} {it} it {res:.2e}" for name, (it, res) in sim.solve_stats.items())
+            print(f"frame {frame}: {steps}")
+
+        if recording is not None:
+            recording.record(sim, frame)
+        else:
+            # without ghost cells
+            np.save(os.path.join(args.output, f"density_{frame:05d}.npy"), sim.density_field[1:-1, 1:-1])
+
+        if checkpointer is not None:
+            checkpointer.update(sim, frame)
+
+    elapsed = time.perf_counter() - start
+    frames = args.frames - first
+    print(f"{frames} frames in {elapsed:.2f}s ({frames/elapsed:.1f} fps)")
+
+    if recording is not None:
+        recording.close()
+        stats = recording.stats()
+        print(
+            f"{stats['written']} frames recorded to {args.record}, {stats['bytes']/2**20:.1f} MiB "
+            f"({stats['ratio']:.1f}x), {stats['stalls']} stalls for {stats['stall_seconds']:.2f}s, "
+            f"{stats['max_in_flight']} frames in flight at most"
+        )
+
+    if checkpointer is not None:
+        checkpointer.close()
+        print(f"{checkpointer.written} checkpoints written, {checkpointer.skipped} skipped while writing")
+
+    if args.profile:
+        print_profile(sim.profiler)
+
+
+if __name__ == "__main__":
+    main()
@@ -18,6 +18,12 @@ WIDTH = 900
 HEIGHT = 900
 CELLS = 128
 
+# solve on a background thread, overlapping with rendering
+THREADED = False
+
+# texture format of the density, float32, uint16 or uint8
+DENSITY_FORMAT = "float32"
+
 # create window with openGL context
 window = app.Window(WIDTH, HEIGHT)
 
@@ -28,7 +34,12 @@ imgui_renderer = PygletProgrammablePipelineRenderer(window.native_window) # pass
 fps_display = pyglet.window.FPSDisplay(window=window.native_window)
 
 # main object
-smoke_grid = fluid.Fluid(WIDTH, HEIGHT, CELLS)
+smoke_grid = fluid.Fluid(WIDTH, HEIGHT, CELLS, density_format=DENSITY_FORMAT)
+
+# compile (or load the cached) solver kernels before the first frame
+smoke_grid.warm_up()
+if THREADED:
+    smoke_grid.start_thread()
 
 # draw only lines, no rasterization, good for tests
 # gl.glPolygonMode(gl.GL_FRONT_AND_BACK, gl.GL_LINE)
@@ -40,7 +51,8 @@ def on_draw(dt=0):
     window.clear()
 
     smoke_grid.update_fields()
-    smoke_grid.solve_fields(dt)
+    # substeps of the frame time, see modules/integrator.py
+    smoke_grid.advance(dt)
 
     # draw smoke first
     smoke_grid.draw()
@@ -55,6 +67,13 @@ def on_draw(dt=0):
     _, smoke_grid.show_grid = imgui.checkbox("Show Grid", smoke_grid.show_grid)
     _, smoke_grid.show_vectors = imgui.checkbox("Show Vectors", smoke_grid.show_vectors)
     _, smoke_grid.show_fps = imgui.checkbox("Show FPS", smoke_grid.show_fps)
+    _, smoke_grid.show_timings = imgui.checkbox("Show Timings", smoke_grid.show_timings)
+
+    # mean, p95 and max of each stage over the last frames
+    if smoke_grid.show_timings:
+        imgui.text(f"{'stage':<16}{'mean':>8}{'p95':>8}{'max':>8} ms")
+        for name, stats in smoke_grid.profiler.stats().items():
+            imgui.text(f"{name:<16}{stats['mean']:8.2f}{stats['p95']:8.2f}{stats['max']:8.2f}")
 
     changed, smoke_grid.smoke_color = imgui.color_edit3("Smoke Color", *smoke_grid.smoke_color)
 
@@ -85,53 +104,23 @@ def on_mouse_drag(x, y, dx, dy, buttons):
 
     # Case was right mouse button
     if buttons == 4:
-        radius = 3
-        
         # will be inverted in opengl
         idrow = CELLS - (int(y/smoke_grid.dx) + 1)
         idcol = int(x/smoke_grid.dy) + 1
 
-        if idrow-radius < 0:
-            idrow = radius
-        elif idrow+radius > CELLS-1:
-            idrow = CELLS-1-radius
-        
-        if idcol-radius < 0:
-            idcol = radius
-        elif idcol+radius > CELLS-1:
-            idcol = CELLS-1-radius
-        
-        for i in range(-radius, radius):
-            idx = idrow + i
-            for j in range(-radius, radius):
-                idy = idcol + j
-                smoke_grid.density_field[idx, idy] = 1
+        smoke_grid.add_density(idrow, idcol, radius=3)
 
     # Case was left mouse button
     if buttons == 1:
-        radius = 2
-    
         idrow = CELLS - (int(y/smoke_grid.dx))
         idcol = int(x/smoke_grid.dy)
 
-        if idrow-radius < 0:
-            idrow = radius
-        elif idrow+radius > CELLS-1:
-            idrow = CELLS-1-radius
-        
-        if idcol-radius < 0:
-            idcol = radius
-        elif idcol+radius > CELLS-1:
-            idcol = CELLS-1-radius
-
-        for i in range(-radius, radius):
-            idx = idrow + i
-            for j in range(-radius, radius):
-                idy = idcol + j
-                speed = 1000
-                smoke_grid.velocity_field[idx, idy] += [
-                    speed*dx, speed*dy
-                ]
+        speed = 1000
+        smoke_grid.add_velocity(idrow, idcol, 2, speed*dx, speed*dy)
+
+@window.event
+def on_close():
+    smoke_grid.stop_thread()
 
 @window.event
 def on_show():
@@ -0,0 +1,144 @@
+"""
+Solver backends and the registry to pick one by name.
+
+A backend implements the four stages of a step (advect, diffuse, project
+and boundaries) on numpy fields with ghost cells, and Backend.solve_fields
+chains them in the order of Stam's solver. With config.active_tiles the
+step starts with track_active, backends without tiles sweep every cell. advect_fused moves both fields
+in one call, backends override it with a single pass. Backends are imported when
+first created, so taichi is only loaded when it is asked for.
+
+Registered backends:
+    numba   modules.solvers, every solver of SolverConfig
+    taichi  modules.fluid_taichi, ti.cpu, jacobi only
+    numpy   modules.fluid_numpy, vectorized numpy, jacobi only, no JIT
+    strips  modules.strips, numba on strips of rows in worker processes, jacobi only
+"""
+
+import importlib
+
+from modules.config import SolverConfig
+from modules.profiler import Profiler
+
+
+# name -> "module:class", loaded by create
+_registry = {}
+
+
+class Backend:
+    """Base class of the backends, shape is the density field with ghost cells"""
+
+    name = None
+
+    def __init__(self, shape, config=None) -> None:
+        self.shape = tuple(shape)
+        self.config = config if config is not None else SolverConfig()
+
+        # wall time of each stage, named as the keys of the solve stats
+        self.profiler = Profiler()
+
+    def solve_fields(self, dt, dx, dy, width, height, density_field, velocity_field, pressure_field=None):
+        """
+        One step of the simulation in place, returns the (iterations, final rms
+        residual) of each linear solve.
+
+        pressure_field, when given, is the initial guess of both projections
+        and receives the solution.
+        """
+
+        stats = {}
+        timed = self.profiler.timed
+        grid = (dt, dx, dy, width, height)
+
+        if self.config.active_tiles:
+            timed("active_tiles", self.track_active, dt, dx, dy, density_field, velocity_field)
+
+        if self.config.fused_advection:
+            # both fields advected in one pass between the projections
+            stats["difuse_vel_step"] = timed("difuse_vel_step", self.diffuse, dt, velocity_field, 1.0)
+            stats["project_1"] = timed("project_1", self.project, dx, dy, velocity_field, pressure_field)
+            stats["difuse_step"] = timed("difuse_step", self.diffuse, dt, density_field, 2.0)
+            timed("advect_fused", self.advect_fused, *grid, density_field, velocity_field)
+            stats["project_2"] = timed("project_2", self.project, dx, dy, velocity_field, pressure_field)
+            return stats
+
+        # two projections increase stability
+        stats["difuse_vel_step"] = timed("difuse_vel_step", self.diffuse, dt, velocity_field, 1.0)
+        stats["project_1"] = timed("project_1", self.project, dx, dy, velocity_field, pressure_field)
+        timed("advect_vel", self.advect, *grid, velocity_field, velocity_field)
+        stats["project_2"] = timed("project_2", self.project, dx, dy, velocity_field, pressure_field)
+
+        stats["difuse_step"] = timed("difuse_step", self.diffuse, dt, density_field, 2.0)
+        timed("advect", self.advect, *grid, density_field, velocity_field)
+        return stats
+
+    def advect(self, dt, dx, dy, width, height, field, velocity_field):
+        """Move field along velocity_field, which may be field itself"""
+
+        raise NotImplementedError
+
+    def advect_fused(self, dt, dx, dy, width, height, density_field, velocity_field):
+        """Move density and velocity along velocity_field as it is before the call"""
+
+        # density first, it reads the velocity before it is moved
+        self.advect(dt, dx, dy, width, height, density_field, velocity_field)
+        self.advect(dt, dx, dy, width, height, velocity_field, velocity_field)
+
+    def diffuse(self, dt, field, a_mod):
+        """Implicit diffusion with a = dt*a_mod, returns (iterations, residual)"""
+
+        raise NotImplementedError
+
+    def project(self, dx, dy, velocity_field, pressure_field=None):
+        """Make velocity_field divergence free, returns (iterations, residual)"""
+
+        raise NotImplementedError
+
+    def boundaries(self, field):
+        """Fill the ghost cells, velocity fields (N+2, N+2, 2) reflect"""
+
+        raise NotImplementedError
+
+    def track_active(self, dt, dx, dy, density_field, velocity_field):
+        """Find the tiles the stages of the next step of dt sweep, all of them by default"""
+
+    def close(self):
+        """Free what the backend holds outside this process, nothing by default"""
+
+    def require_jacobi(self):
+        """For backends that only implement the jacobi solver"""
+
+        solvers = {self.config.projection_solver(), self.config.diffusion_solver()}
+        if solvers != {"jacobi"}:
+            raise ValueError(f"The {self.name} backend only has the jacobi solver, config asks for {solvers}")
+
+
+##### Registry #####
+def register(name, path):
+    """Register a backend class given as "module:class" """
+
+    _registry[name] = path
+
+
+def available():
+    return sorted(_registry)
+
+
+def get(name):
+    """Backend class registered as name"""
+
+    if name not in _registry:
+        raise ValueError(f"Unknown backend: {name}, available: {', '.join(available())}")
+
+    module, cls = _registry[name].split(":")
+    return getattr(importlib.import_module(module), cls)
+
+
+def create(name, shape, config=None):
+    return get(name)(shape, config)
+
+
+register("numba", "modules.solvers:NumbaBackend")
+register("taichi", "modules.fluid_taichi:Solver")
+register("numpy", "modules.fluid_numpy:Solver")
+register("strips", "modules.strips:StripBackend")
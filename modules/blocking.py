@@ -0,0 +1,299 @@
+"""
+Temporally blocked jacobi sweeps.
+
+solvers.jacobi and solvers.jacobi_project stream the whole field through
+memory once per iteration, above about 512x512 cells the field no longer
+fits in cache and every iteration is bound by memory bandwidth. Here the
+interior is split into blocks of block x block cells and each block runs
+steps iterations in a small local buffer before the next one is loaded.
+
+The local buffer is the block plus a halo of steps cells (clamped to the
+grid). Each iteration the cells that can still be computed from valid
+neighbours shrink by one cell on every side that is not a wall, so after
+steps iterations the block itself holds exactly the values of steps
+untiled sweeps. Neighbouring blocks recompute their overlap, which is the
+price for touching memory once per steps iterations. On the walls the ghost
+cells are refreshed after every local iteration as update_bnd does.
+
+The squared updates of each iteration are summed separately, so the
+convergence test runs after every iteration as in the untiled solvers.
+When a solve converges inside a pass, the pass is run again from its start
+with fewer steps, so the fields and the iteration count are the same as
+the untiled versions.
+
+The block list and the local buffers (one set per thread, sized for the
+largest block) come from allocate_buffers and are kept in the workspace,
+the sweeps do not allocate.
+"""
+
+import functools
+import glob
+import os
+
+import numba
+import numpy as np
+from numba import njit, prange
+
+
+def block_size(config, channels=1, itemsize=4):
+    """Cells on each side of a block, config.block_size or sized to fit in half the L2 cache"""
+
+    if config.block_size > 0:
+        return config.block_size
+
+    # two local buffers and the right hand side of a block with its halo
+    cells = l2_cache_bytes()/2 / (3*channels*itemsize)
+    size = int(np.sqrt(cells)) - 2*config.block_steps
+    return max(size//8*8, 8)
+
+
+@functools.lru_cache(maxsize=None)
+def l2_cache_bytes():
+    # linux only, 256 KiB elsewhere
+    for index in glob.glob("/sys/devices/system/cpu/cpu0/cache/index*"):
+        try:
+            with open(os.path.join(index, "level")) as f:
+                level = int(f.read())
+            with open(os.path.join(index, "size")) as f:
+                size = f.read().strip()
+        except (OSError, ValueError):
+            continue
+        if level == 2:
+            units = {"K": 1024, "M": 1024**2}
+            return int(size[:-1])*units[size[-1]] if size[-1] in units else int(size)
+    return 256*1024
+
+
+def allocate_buffers(shape, channels, block, steps, dtype=np.float32):
+    """
+    Blocks of a grid of shape (ghost cells included) with channels
+    components per cell, the squared updates of each block in each step of
+    a pass, and the local buffers of each thread.
+    """
+
+    blocks = blocks_of(shape[0], shape[1], block)
+    totals = np.zeros((blocks.shape[0], steps))
+
+    # current and next iterate and right hand side of the largest block
+    # with its halo, for as many threads as numba can run, flat so each
+    # block takes a contiguous (rows, cols) view of it
+    rows = min(block + 2*steps, shape[0])
+    cols = min(block + 2*steps, shape[1])
+    scratch = np.empty((numba.config.NUMBA_NUM_THREADS, 3, rows*cols*channels), dtype=dtype)
+    return blocks, totals, scratch
+
+
+##### Solvers #####
+# same arguments and results as solvers.jacobi and solvers.jacobi_project,
+# plus the buffers of allocate_buffers, which set the blocks and the
+# iterations of each pass
+def jacobi(field_vector, x0, tmp, dt, a_mod, max_iter, tol_abs, tol_rel, buffers):
+    # fields with the components on the last axis
+    channels = field_vector.shape[2]
+    return jacobi_blocked(
+        rows(field_vector), rows(x0), rows(tmp), channels, dt*a_mod, False, max_iter, tol_abs, tol_rel,
+        *buffers, slots(buffers)
+    )
+
+
+def jacobi_project(p, div, tmp, max_iter, tol_abs, tol_rel, buffers):
+    return jacobi_blocked(p, div, tmp, 1, 0.0, True, max_iter, tol_abs, tol_rel, *buffers, slots(buffers))
+
+
+def slots(buffers):
+    # threads running blocks, numba.get_num_threads in a kernel is not cached
+    blocks, _, scratch = buffers
+    return min(numba.get_num_threads(), scratch.shape[0], blocks.shape[0])
+
+
+def rows(field_vector):
+    """(N+2, (N+2)*c) view of a contiguous field, the components of a cell next to each other"""
+
+    view = field_vector.view()
+    # raises instead of copying when the field is not contiguous
+    view.shape = (field_vector.shape[0], -1)
+    return view
+
+
+@njit(nogil=True, cache=True)
+def jacobi_blocked(field, x0, tmp, C, a, pressure, max_iter, tol_abs, tol_rel, blocks, totals, scratch, slots):
+    # fields as rows of C components per cell, with pressure x0 is the
+    # divergence, otherwise x0 receives the field as the right hand side
+    s = field.shape
+    n = (s[0]-2)*(s[1]-2*C)
+    if pressure:
+        scale = 4.0
+    else:
+        scale = 1+a
+        x0[:] = field
+
+    total = 0.0
+    for i in range(1, s[0]-1):
+        for q in range(C, s[1]-C):
+            total += x0[i, q]**2
+    b_rms = np.sqrt(total / n)
+    steps = totals.shape[1]
+
+    src = field
+    dst = tmp
+    it = 0
+    res = 0.0
+    done = False
+    swapped = False
+    while it < max_iter and not done:
+        count = min(steps, max_iter - it)
+        sweep_blocks(src, dst, x0, C, a, pressure, count, blocks, totals, scratch, slots)
+
+        # convergence test of each iteration of the pass
+        for k in range(count):
+            res = scale * np.sqrt(totals[:, k].sum()/n)
+            if res <= tol_abs or res <= tol_rel*b_rms:
+                done = True
+                if k+1 < count:
+                    # redone up to the iteration that converged
+                    count = k+1
+                    sweep_blocks(src, dst, x0, C, a, pressure, count, blocks, totals, scratch, slots)
+                break
+
+        it += count
+        src, dst = dst, src
+        swapped = not swapped
+
+    # odd number of passes, last one went to tmp
+    if swapped:
+        field[:] = tmp
+    return it, res
+
+
+@njit(nogil=True, cache=True)
+def blocks_of(height, width, block):
+    """(first row, end row, first col, end col) of the blocks of the interior, in cells"""
+
+    rows = -(-(height-2) // block)
+    cols = -(-(width-2) // block)
+    blocks = np.empty((rows*cols, 4), dtype=np.int64)
+    for bi in range(rows):
+        for bj in range(cols):
+            b = bi*cols + bj
+            blocks[b, 0] = 1 + bi*block
+            blocks[b, 1] = min(1 + (bi+1)*block, height-1)
+            blocks[b, 2] = 1 + bj*block
+            blocks[b, 3] = min(1 + (bj+1)*block, width-1)
+    return blocks
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def sweep_blocks(src, dst, rhs, C, a, pressure, steps, blocks, totals, scratch, slots):
+    # steps jacobi iterations from src, the blocks of dst receive the last one
+    # and totals[b, k] the squared updates of block b in iteration k
+    # each of the slots threads runs every slots-th block in its own scratch
+    height = src.shape[0]
+    width = src.shape[1]//C
+    for t in prange(slots):
+        for b in range(t, blocks.shape[0], slots):
+            i0, i1, j0, j1 = blocks[b, 0], blocks[b, 1], blocks[b, 2], blocks[b, 3]
+
+            # block and halo, ghost cells included on the walls
+            r0 = max(i0 - steps, 0)
+            r1 = min(i1 + steps, height)
+            c0 = max(j0 - steps, 0)
+            c1 = min(j1 + steps, width)
+            local = (r1-r0, (c1-c0)*C)
+            cur = scratch[t, 0, :local[0]*local[1]].reshape(local)
+            nxt = scratch[t, 1, :local[0]*local[1]].reshape(local)
+            b0 = scratch[t, 2, :local[0]*local[1]].reshape(local)
+            for i in range(r0, r1):
+                copy_span(src[i], c0*C, cur[i-r0], 0, (c1-c0)*C)
+                copy_span(rhs[i], c0*C, b0[i-r0], 0, (c1-c0)*C)
+
+            # block cols in the local rows
+            q0 = (j0-c0)*C
+            q1 = (j1-c0)*C
+            for k in range(steps):
+                # cells with valid neighbours, the walls stay put
+                lo_i = 1 if r0 == 0 else r0 + k+1
+                hi_i = height-1 if r1 == height else r1 - (k+1)
+                lo = (1 - c0 if c0 == 0 else k+1)*C
+                hi = (width-1 - c0 if c1 == width else c1-c0 - (k+1))*C
+
+                total = 0.0
+                for i in range(lo_i, hi_i):
+                    li = i - r0
+                    if i0 <= i < i1:
+                        # only the cells of the block count for the residual
+                        sweep_row(cur, nxt, b0, a, pressure, li, lo, q0, C)
+                        total += sweep_row(cur, nxt, b0, a, pressure, li, q0, q1, C)
+                        sweep_row(cur, nxt, b0, a, pressure, li, q1, hi, C)
+                    else:
+                        sweep_row(cur, nxt, b0, a, pressure, li, lo, hi, C)
+                totals[b, k] = total
+
+                # ghost cells next to the valid cells, as update_bnd
+                if r0 == 0:
+                    copy_span(nxt[1], lo, nxt[0], lo, hi-lo)
+                if r1 == height:
+                    copy_span(nxt[height-2-r0], lo, nxt[height-1-r0], lo, hi-lo)
+                for i in range(lo_i, hi_i):
+                    for c in range(C):
+                        if c0 == 0:
+                            nxt[i-r0, c] = nxt[i-r0, C + c]
+                        if c1 == width:
+                            nxt[i-r0, (width-1-c0)*C + c] = nxt[i-r0, (width-2-c0)*C + c]
+                cur, nxt = nxt, cur
+
+            for i in range(i0, i1):
+                copy_span(cur[i-r0], q0, dst[i], j0*C, q1-q0)
+
+    update_bnd_rows(dst, C)
+
+
+@njit(nogil=True, cache=True, inline="always")
+def sweep_row(cur, nxt, b0, a, pressure, li, q0, q1, C):
+    # cells q0 up to q1 (excluded) of local row li, returns the squared updates
+    # the expressions of solvers.jacobi_project and solvers.jacobi
+    # unsigned cols, numba skips the negative index checks for them
+    C = np.uint64(C)
+    total = 0.0
+    if pressure:
+        for q in range(np.uint64(q0), np.uint64(q1)):
+            v = (
+                cur[li-1, q] +
+                cur[li+1, q] +
+                cur[li, q-C] +
+                cur[li, q+C] +
+                b0[li, q]
+            ) / 4.0
+            total += (v - cur[li, q])**2
+            nxt[li, q] = v
+    else:
+        for q in range(np.uint64(q0), np.uint64(q1)):
+            v = (
+                b0[li, q] + a *
+                (
+                    (cur[li-1, q] + cur[li+1, q] + cur[li, q-C] + cur[li, q+C])/(4.0)
+                )
+            ) / (1+a)
+            total += (v - cur[li, q])**2
+            nxt[li, q] = v
+    return total
+
+
+@njit(nogil=True, cache=True)
+def copy_span(src, start, dst, dst_start, count):
+    # slice assignments check for overlap and may copy twice
+    start = np.uint64(start)
+    dst_start = np.uint64(dst_start)
+    for q in range(np.uint64(count)):
+        dst[dst_start + q] = src[start + q]
+
+
+@njit(nogil=True, cache=True)
+def update_bnd_rows(field, C):
+    # update_bnd on rows of C components per cell
+    s = field.shape
+    field[0] = field[1]
+    field[s[0]-1] = field[s[0]-2]
+    for i in range(s[0]):
+        for c in range(C):
+            field[i, c] = field[i, C + c]
+            field[i, s[1]-C + c] = field[i, s[1]-2*C + c]
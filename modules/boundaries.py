@@ -0,0 +1,44 @@
+"""
+Boundary conditions on the ghost cells.
+"""
+
+from numba import njit, prange
+
+
+##### Boundaries funcs #####
+# ghost rows and cols only read the first interior row or col, so the field
+# is updated in place, corners end up with the value of the diagonal cell
+# (whole col slices would overlap in memory and numba would copy them first)
+@njit(nogil=True, cache=True)
+def update_bnd(original_field):
+    s = original_field.shape
+    
+    # rows
+    for i in range(s[1]):
+        original_field[0, i] = original_field[1, i]
+        original_field[s[0]-1, i] = original_field[s[0]-2, i]
+    
+    # cols
+    for i in range(s[0]):
+        original_field[i, 0] = original_field[i, 1]
+        original_field[i, s[1]-1] = original_field[i, s[1]-2]
+
+# velocity as its u and v planes, so the same kernel runs on both layouts
+# u is reflected on the walls of the cols, v on the walls of the rows
+@njit(parallel=True, nogil=True, cache=True)
+def update_bnd_vel(u, v):
+    s = u.shape
+    
+    # rows
+    for i in prange(s[1]):
+        u[0, i] = u[1, i]
+        v[0, i] = -v[1, i]
+        u[s[0]-1, i] = u[s[0]-2, i]
+        v[s[0]-1, i] = -v[s[0]-2, i]
+    
+    # cols
+    for i in prange(s[0]):
+        u[i, 0] = -u[i, 1]
+        v[i, 0] = v[i, 1]
+        u[i, s[1]-1] = -u[i, s[1]-2]
+        v[i, s[1]-1] = v[i, s[1]-2]
@@ -0,0 +1,298 @@
+"""
+Checkpoint and restart of a simulation.
+
+A checkpoint is one file, a header and the raw fields:
+
+    magic     b"SMOKECKP"
+    version   uint32, FORMAT_VERSION
+    length    uint32, bytes of the header
+    header    json: grid, solver config, integrator state, frame and the
+              dtype, shape and offset of each array
+    arrays    C ordered, each at a 64 byte aligned offset after the header
+
+so a restore maps the arrays from the file (np.memmap) instead of reading
+them. By default the mapping is copy on write: pages are read when the
+solver first touches them and copied when it writes them, the file stays
+as it was saved.
+
+Files are written under a temporary name and renamed over the final one,
+a crash while writing leaves the previous checkpoint intact. Checkpointer
+saves every few frames from a background thread, the simulation thread
+only copies the fields.
+"""
+
+import glob
+import json
+import os
+import queue
+import struct
+import threading
+
+import numpy as np
+
+from modules.config import SolverConfig
+
+
+MAGIC = b"SMOKECKP"
+FORMAT_VERSION = 1
+
+# arrays of a checkpoint, attributes of the simulation
+FIELDS = ("density_field", "velocity_field", "pressure_field")
+
+# integrator attributes kept, the others only describe the last frame
+INTEGRATOR = ("mode", "cfl", "fixed_dt", "max_substeps", "max_dt", "accumulator")
+
+# header entries a restored simulation must have been built with
+SETTINGS = ("width", "height", "cell_count", "backend", "warm_start")
+
+ALIGN = 64
+PREFIX = struct.Struct("<8sII")
+
+
+# ---------- Save ----------
+def save(simulation, path, frame=0):
+    """Write the state of simulation to path, returns path"""
+
+    write(path, describe(simulation, frame), {name: getattr(simulation, name) for name in FIELDS})
+    return path
+
+
+def describe(simulation, frame=0):
+    """Header of a checkpoint of simulation, without the arrays"""
+
+    integrator = simulation.integrator
+    return {
+        "frame": frame,
+        "width": simulation.width,
+        "height": simulation.height,
+        "cell_count": simulation.cell_count,
+        "backend": simulation.backend.name,
+        "warm_start": simulation.warm_start,
+        "config": vars(simulation.config),
+        "integrator": {name: getattr(integrator, name) for name in INTEGRATOR},
+    }
+
+
+def write(path, header, arrays):
+    # offsets are from the end of the header, which is padded to ALIGN
+    header = dict(header, arrays={})
+    offset = 0
+    for name, array in arrays.items():
+        header["arrays"][name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset = aligned(offset + array.nbytes)
+    encoded = json.dumps(header).encode()
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(PREFIX.pack(MAGIC, FORMAT_VERSION, len(encoded)))
+        f.write(encoded)
+        start = aligned(PREFIX.size + len(encoded))
+        for name, array in arrays.items():
+            f.seek(start + header["arrays"][name]["offset"])
+            f.write(np.ascontiguousarray(array).data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def aligned(offset):
+    return -(-offset // ALIGN)*ALIGN
+
+
+# ---------- Restore ----------
+def read_header(path):
+    """Header of the checkpoint at path, raises ValueError when it is not one"""
+
+    with open(path, "rb") as f:
+        prefix = f.read(PREFIX.size)
+        if len(prefix) < PREFIX.size:
+            raise ValueError(f"Not a checkpoint: {path}")
+        magic, version, length = PREFIX.unpack(prefix)
+        if magic != MAGIC:
+            raise ValueError(f"Not a checkpoint: {path}")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Checkpoint format {version} of {path} is not supported, expected {FORMAT_VERSION}")
+        header = json.loads(f.read(length))
+
+    header["data_offset"] = aligned(PREFIX.size + length)
+    return header
+
+
+def restore(simulation, path, mode="c"):
+    """
+    Map the fields of the checkpoint at path into simulation, returns the header.
+
+    Only the fields and the time left in the integrator are restored.
+    simulation must have been built with the settings of the checkpoint:
+    grid, backend, warm_start, solver config and integrator settings, else
+    ValueError is raised, nothing is changed behind the backend it built.
+    load builds a new simulation from the checkpoint instead.
+    mode is the np.memmap mode: "c" copy on write, "r+" the simulation
+    writes to the file, "r" read only (no steps possible).
+    """
+
+    header = read_header(path)
+
+    saved = settings(header)
+    current = describe(simulation)
+    mismatched = [
+        f"{name} {saved[name]!r} (simulation {current[name]!r})"
+        for name in SETTINGS if saved[name] != current[name]
+    ]
+    for group in ("config", "integrator"):
+        mismatched += [
+            f"{group}.{name} {value!r} (simulation {current[group][name]!r})"
+            for name, value in saved[group].items() if value != current[group][name]
+        ]
+    if mismatched:
+        raise ValueError(f"Checkpoint {path} was saved with other settings: " + ", ".join(mismatched))
+
+    attach(simulation, header, path, mode)
+    return header
+
+
+def load(path, backend=None, mode="c"):
+    """New Simulation with the state of the checkpoint at path, on its backend or the given one"""
+
+    # imported here, simulation imports the backends
+    from modules.integrator import TimeIntegrator
+    from modules.simulation import Simulation
+
+    header = read_header(path)
+    saved = settings(header)
+
+    simulation = Simulation(
+        saved["width"], saved["height"], saved["cell_count"], backend or saved["backend"],
+        SolverConfig(**saved["config"])
+    )
+    simulation.warm_start = saved["warm_start"]
+    simulation.integrator = TimeIntegrator(**saved["integrator"])
+    attach(simulation, header, path, mode)
+    return simulation
+
+
+def settings(header):
+    """Settings the checkpoint was saved with, in the form of describe"""
+
+    # settings added after the checkpoint was written had their defaults
+    known = vars(SolverConfig())
+    config = SolverConfig(**{name: value for name, value in header["config"].items() if name in known})
+
+    saved = {name: header[name] for name in SETTINGS}
+    saved["config"] = vars(config)
+    saved["integrator"] = {name: value for name, value in header["integrator"].items() if name != "accumulator"}
+    return saved
+
+
+def attach(simulation, header, path, mode):
+    # the saved fields mapped in place of the ones of simulation
+    for name in FIELDS:
+        spec = header["arrays"][name]
+        field = np.memmap(
+            path, dtype=np.dtype(spec["dtype"]), mode=mode, offset=header["data_offset"] + spec["offset"],
+            shape=tuple(spec["shape"])
+        )
+        setattr(simulation, name, field)
+    simulation.integrator.accumulator = header["integrator"]["accumulator"]
+
+
+def latest(directory):
+    """Path of the checkpoint of the last frame in directory, None when there is none"""
+
+    paths = sorted(glob.glob(os.path.join(directory, "checkpoint_*.ckpt")))
+    return paths[-1] if paths else None
+
+
+# ---------- Periodic checkpoints ----------
+class Checkpointer:
+    """Saves a simulation to directory every few frames from a background thread"""
+
+    def __init__(self, directory, every=100, keep=3) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        # frames between checkpoints and checkpoints kept on disk
+        self.every = every
+        self.keep = keep
+
+        # copies of the fields of the checkpoint being written
+        self._snapshot = None
+        self._idle = threading.Event()
+        self._idle.set()
+        self._jobs = queue.SimpleQueue()
+
+        # checkpoints written, and due ones skipped while the previous one
+        # was still being written
+        self.written = 0
+        self.skipped = 0
+
+        # error of the writer thread, raised by the next update
+        self.error = None
+
+        self._thread = threading.Thread(target=self.run, name="checkpoint", daemon=True)
+        self._thread.start()
+
+    def update(self, simulation, frame):
+        """Called after each frame, returns True when a checkpoint of frame was started"""
+
+        if self.error is not None:
+            raise self.error
+        if frame % self.every != 0:
+            return False
+        if not self._idle.is_set():
+            self.skipped += 1
+            return False
+
+        # only the copy runs on the simulation thread
+        if self._snapshot is None or any(
+            self._snapshot[name].shape != getattr(simulation, name).shape for name in FIELDS
+        ):
+            self._snapshot = {name: np.empty_like(getattr(simulation, name)) for name in FIELDS}
+        for name in FIELDS:
+            np.copyto(self._snapshot[name], getattr(simulation, name))
+
+        self._idle.clear()
+        self._jobs.put(describe(simulation, frame))
+        return True
+
+    def wait(self, timeout=None):
+        """Wait for the checkpoint being written, returns False on timeout"""
+
+        return self._idle.wait(timeout)
+
+    def close(self):
+        """Finish the checkpoint being written and stop the thread"""
+
+        self.wait()
+        self._jobs.put(None)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def path(self, frame):
+        return os.path.join(self.directory, f"checkpoint_{frame:08d}.ckpt")
+
+    # ---------- Writer thread ----------
+    def run(self):
+        while True:
+            header = self._jobs.get()
+            if header is None:
+                break
+
+            try:
+                write(self.path(header["frame"]), header, self._snapshot)
+                self.written += 1
+                self.prune()
+            except Exception as e:
+                self.error = e
+            finally:
+                self._idle.set()
+
+    def prune(self):
+        paths = sorted(glob.glob(os.path.join(self.directory, "checkpoint_*.ckpt")))
+        for path in paths[:-self.keep] if self.keep > 0 else []:
+            try:
+                os.remove(path)
+            except OSError:
+                # still mapped by a restored simulation on windows
+                pass
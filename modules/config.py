@@ -0,0 +1,115 @@
+"""
+Solver settings of one simulation.
+
+Each simulation carries its own SolverConfig, so two simulations in the
+same process can use different solvers. The backends read it on every
+step, changing an attribute takes effect on the next call.
+"""
+
+
+class SolverConfig:
+
+    def __init__(self, **settings) -> None:
+        # maximum number of solver iterations
+        self.n_iter = 25
+
+        # a solve stops early once the rms residual is below tolerance_abs or
+        # below tolerance_rel times the rms of the right hand side
+        self.tolerance_abs = 1e-5
+        self.tolerance_rel = 1e-4
+
+        # which solver
+        self.solver_gauss = False
+
+        # over-relaxation of the gauss-seidel sweeps, 1 is plain gauss-seidel
+        self.sor_omega = 1.0
+
+        # multigrid for the pressure projection, takes precedence over solver_gauss
+        self.solver_multigrid = False
+
+        # multigrid settings, 0 levels means coarsen as far as the grid allows
+        self.mg_levels = 0
+        self.mg_cycles = 2
+        self.mg_cycle = "V"
+        self.mg_smoother = "jacobi"
+
+        # exact DCT pressure solve, takes precedence over the other projection solvers
+        self.solver_spectral = False
+
+        # cached sparse factorizations for diffusion and projection
+        # exact, pays off when dt and the grid stay the same between frames
+        self.solver_direct = False
+
+        # preconditioned conjugate gradient for diffusion and projection
+        self.solver_cg = False
+        self.cg_max_iter = 200
+        self.cg_preconditioner = "jacobi"
+
+        # advect density and velocity together, traced once per cell
+        # the density moves with the velocity of the first projection
+        self.fused_advection = False
+
+        # memory layout of the velocity field, "aos" or "soa" (see layout)
+        # read when the simulation is created, later changes have no effect
+        self.layout = "aos"
+
+        # advection and jacobi diffusion only sweep the tiles of tile_size
+        # cells where density is above active_threshold or the velocity
+        # moves more than active_velocity cells per step, plus the tiles
+        # smoke can reach in the step (numba backend only)
+        self.active_tiles = False
+        self.tile_size = 16
+        self.active_threshold = 1e-4
+        self.active_velocity = 0.1
+
+        # jacobi runs block_steps iterations on each block of block_size
+        # cells before moving to the next one, so large grids are swept from
+        # cache, same results as the plain sweeps (numba backend only)
+        # block_size 0 fits the blocks in half the L2 cache, see blocking
+        self.temporal_blocking = False
+        self.block_size = 0
+        self.block_steps = 8
+
+        # worker processes of the strips backend, one strip of rows each
+        # 0 means one per core
+        self.strip_workers = 0
+
+        for name, value in settings.items():
+            if not hasattr(self, name):
+                raise TypeError(f"Unknown solver setting: {name}")
+            setattr(self, name, value)
+
+    def __repr__(self) -> str:
+        settings = ", ".join(f"{name}={value!r}" for name, value in vars(self).items())
+        return f"SolverConfig({settings})"
+
+    def copy(self, **settings):
+        """New config with the same settings, changed by settings"""
+
+        return SolverConfig(**{**vars(self), **settings})
+
+    def projection_solver(self):
+        """Name of the solver used for the pressure projection"""
+
+        if self.solver_spectral:
+            return "spectral"
+        elif self.solver_direct:
+            return "direct"
+        elif self.solver_multigrid:
+            return "multigrid"
+        elif self.solver_cg:
+            return "cg"
+        elif self.solver_gauss:
+            return "gauss"
+        return "jacobi"
+
+    def diffusion_solver(self):
+        """Name of the solver used for diffusion"""
+
+        if self.solver_direct:
+            return "direct"
+        elif self.solver_cg:
+            return "cg"
+        elif self.solver_gauss:
+            return "gauss"
+        return "jacobi"
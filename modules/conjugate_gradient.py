@@ -0,0 +1,209 @@
+"""
+Preconditioned conjugate gradient for the diffusion and projection systems.
+
+Both systems use the same matrix free 5 point stencil on the interior cells,
+diag*x - off*(sum of neighbours), where a neighbour outside the interior is
+a ghost cell copied from the cell itself (update_bnd):
+    projection: diag = 4,   off = 1,   b = divergence
+    diffusion:  diag = 1+a, off = a/4, b = field before diffusion
+
+The solve stops once the rms residual is below tol_abs, or below tol_rel
+times the rms of b, instead of after n_iter sweeps.
+"""
+
+import numpy as np
+from numba import njit, prange
+
+from modules.boundaries import update_bnd
+from modules.multigrid import remove_mean
+
+
+# modified incomplete cholesky parameters
+mic_tau = 0.97
+mic_sigma = 0.25
+
+
+##### Exposed funcs #####
+def solve_pressure(pressure, divergence, tol_abs, tol_rel, max_iter, preconditioner="jacobi", buffers=None):
+    """Solve for pressure in place, planes have ghost cells"""
+
+    # pure neumann problem, only has a solution if div sums to zero
+    remove_mean(divergence)
+    return solve(pressure, divergence, 4.0, 1.0, tol_abs, tol_rel, max_iter, preconditioner, buffers)
+
+
+def solve_diffusion(field, a, tol_abs, tol_rel, max_iter, preconditioner="jacobi", buffers=None):
+    """Implicit diffusion of a 2D plane in place, (1+a)x - a/4*(sum of neighbours) = x0"""
+
+    if buffers is None:
+        buffers = allocate_buffers(field.shape)
+
+    x0 = buffers[0]
+    np.copyto(x0, field)
+    return solve(field, x0, 1.0 + a, a/4.0, tol_abs, tol_rel, max_iter, preconditioner, buffers)
+
+
+def solve(x, b, diag, off, tol_abs, tol_rel, max_iter, preconditioner="jacobi", buffers=None):
+    """
+    Returns (iterations, rms residual).
+
+    buffers are six float64 planes shaped like x, as from allocate_buffers,
+    the first one is left for the caller (x0 of the diffusion).
+    """
+
+    if preconditioner not in ("jacobi", "mic"):
+        raise ValueError(f"Unknown preconditioner: {preconditioner}")
+
+    if buffers is None:
+        buffers = allocate_buffers(x.shape)
+    _, r, z, d, q, precon = buffers
+
+    use_mic = preconditioner == "mic"
+    if use_mic:
+        mic_factor(precon, diag, off, mic_tau, mic_sigma)
+
+    return pcg(x, b, diag, off, tol_abs, tol_rel, max_iter, use_mic, r, z, d, q, precon)
+
+
+def allocate_buffers(shape):
+    return tuple(np.zeros(shape, dtype=np.float64) for _ in range(6))
+
+
+##### Kernels #####
+@njit(parallel=True, nogil=True, cache=True)
+def pcg(x, b, diag, off, tol_abs, tol_rel, max_iter, use_mic, r, z, d, q, precon):
+    s = x.shape
+    n = (s[0]-2)*(s[1]-2)
+
+    # r = b - Ax
+    apply_operator(x, q, diag, off)
+    b_norm = 0.0
+    r_norm = 0.0
+    for i in prange(1, s[0]-1):
+        for j in range(1, s[1]-1):
+            r[i, j] = b[i, j] - q[i, j]
+            b_norm += b[i, j]*b[i, j]
+            r_norm += r[i, j]*r[i, j]
+
+    b_rms = np.sqrt(b_norm/n)
+    res = np.sqrt(r_norm/n)
+
+    rz = precondition(r, z, diag, off, use_mic, precon)
+    for i in prange(1, s[0]-1):
+        for j in range(1, s[1]-1):
+            d[i, j] = z[i, j]
+
+    it = 0
+    while it < max_iter and res > tol_abs and res > tol_rel*b_rms:
+        apply_operator(d, q, diag, off)
+
+        dq = 0.0
+        for i in prange(1, s[0]-1):
+            for j in range(1, s[1]-1):
+                dq += d[i, j]*q[i, j]
+        alpha = rz / dq
+
+        r_norm = 0.0
+        for i in prange(1, s[0]-1):
+            for j in range(1, s[1]-1):
+                x[i, j] += alpha*d[i, j]
+                r[i, j] -= alpha*q[i, j]
+                r_norm += r[i, j]*r[i, j]
+        res = np.sqrt(r_norm/n)
+
+        rz_new = precondition(r, z, diag, off, use_mic, precon)
+        beta = rz_new / rz
+        rz = rz_new
+
+        for i in prange(1, s[0]-1):
+            for j in range(1, s[1]-1):
+                d[i, j] = z[i, j] + beta*d[i, j]
+        it += 1
+
+    update_bnd(x)
+    return it, res
+
+@njit(parallel=True, nogil=True, cache=True)
+def apply_operator(x, out, diag, off):
+    s = x.shape
+    for i in prange(1, s[0]-1):
+        for j in range(1, s[1]-1):
+            xc = x[i, j]
+            up = x[i-1, j] if i > 1 else xc
+            down = x[i+1, j] if i < s[0]-2 else xc
+            left = x[i, j-1] if j > 1 else xc
+            right = x[i, j+1] if j < s[1]-2 else xc
+            out[i, j] = diag*xc - off*(up + down + left + right)
+
+@njit(parallel=True, nogil=True, cache=True)
+def precondition(r, z, diag, off, use_mic, precon):
+    """z = M^-1 r, returns r.z"""
+
+    s = r.shape
+    if use_mic:
+        mic_apply(r, z, off, precon)
+    else:
+        for i in prange(1, s[0]-1):
+            for j in range(1, s[1]-1):
+                z[i, j] = r[i, j] / operator_diagonal(i, j, s, diag, off)
+
+    rz = 0.0
+    for i in prange(1, s[0]-1):
+        for j in range(1, s[1]-1):
+            rz += r[i, j]*z[i, j]
+    return rz
+
+@njit(nogil=True, cache=True)
+def operator_diagonal(i, j, s, diag, off):
+    # ghost neighbours are copies of the cell itself
+    ghosts = (i == 1) + (i == s[0]-2) + (j == 1) + (j == s[1]-2)
+    return diag - off*ghosts
+
+@njit(nogil=True, cache=True)
+def mic_factor(precon, diag, off, tau, sigma):
+    # MIC(0) of the stencil, as in Bridson's "Fluid Simulation for Computer Graphics"
+    # the recurrence is sequential, so this and mic_apply are serial loops
+    s = precon.shape
+    for i in range(1, s[0]-1):
+        for j in range(1, s[1]-1):
+            a_diag = operator_diagonal(i, j, s, diag, off)
+            e = a_diag
+
+            if i > 1:
+                pu = precon[i-1, j]
+                e -= (off*pu)**2
+                if j < s[1]-2:
+                    e -= tau*off*off*pu*pu
+            if j > 1:
+                pl = precon[i, j-1]
+                e -= (off*pl)**2
+                if i < s[0]-2:
+                    e -= tau*off*off*pl*pl
+
+            if e < sigma*a_diag:
+                e = a_diag
+            precon[i, j] = 1.0/np.sqrt(e)
+
+@njit(nogil=True, cache=True)
+def mic_apply(r, z, off, precon):
+    s = r.shape
+
+    # forward substitution
+    for i in range(1, s[0]-1):
+        for j in range(1, s[1]-1):
+            t = r[i, j]
+            if i > 1:
+                t += off*precon[i-1, j]*z[i-1, j]
+            if j > 1:
+                t += off*precon[i, j-1]*z[i, j-1]
+            z[i, j] = t*precon[i, j]
+
+    # backward substitution
+    for i in range(s[0]-2, 0, -1):
+        for j in range(s[1]-2, 0, -1):
+            t = z[i, j]
+            if i < s[0]-2:
+                t += off*precon[i, j]*z[i+1, j]
+            if j < s[1]-2:
+                t += off*precon[i, j]*z[i, j+1]
+            z[i, j] = t*precon[i, j]
@@ -0,0 +1,108 @@
+"""
+Sparse direct solver for the diffusion and projection systems.
+
+On a fixed grid with a fixed time step the matrices are the same every
+frame, so each one is assembled and factorized once (SuperLU from scipy)
+and kept in an LRU cache. A solve is then only the two triangular
+back-substitutions. The systems are the ones of conjugate_gradient:
+    projection: diag = 4,   off = 1,   b = divergence
+    diffusion:  diag = 1+a, off = a/4, b = field before diffusion
+"""
+
+from functools import lru_cache
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse import linalg
+
+from modules.boundaries import update_bnd
+from modules.multigrid import remove_mean
+
+
+# factorizations kept for each system, each (shape, dt, coefficient) is
+# one entry, read once when the module is imported
+cache_size = 8
+
+
+##### Exposed funcs #####
+def solve_pressure(pressure, divergence):
+    """Solve for pressure in place, returns (1, rms residual)"""
+
+    # pure neumann problem, only has a solution if div sums to zero
+    remove_mean(divergence)
+
+    s = pressure.shape
+    matrix, lu = pressure_factorization(s[0]-2, s[1]-2)
+    return solve(matrix, lu, pressure, divergence)
+
+
+def solve_diffusion(field, dt, a_mod):
+    """Implicit diffusion of a 2D plane in place, returns (1, rms residual)"""
+
+    s = field.shape
+    matrix, lu = diffusion_factorization(s[0]-2, s[1]-2, dt, a_mod)
+    return solve(matrix, lu, field, field)
+
+
+def solve(matrix, lu, x, b):
+    rhs = b[1:-1, 1:-1].astype(np.float64).ravel()
+    solution = lu.solve(rhs)
+
+    x[1:-1, 1:-1] = solution.reshape(x.shape[0]-2, x.shape[1]-2)
+    update_bnd(x)
+
+    residual = rhs - matrix @ solution
+    return 1, float(np.sqrt(np.mean(residual*residual)))
+
+
+##### Factorizations #####
+@lru_cache(maxsize=cache_size)
+def pressure_factorization(rows, cols):
+    matrix = assemble(rows, cols, 4.0, 1.0)
+
+    # the laplacian is singular (pressure is defined up to a constant),
+    # adding 1 to one diagonal entry makes it invertible and, for a right
+    # hand side that sums to zero, gives an exact solution with p[0] = 0
+    pinned = matrix.tolil()
+    pinned[0, 0] += 1.0
+    pinned = pinned.tocsc()
+
+    return matrix, linalg.splu(pinned, permc_spec="MMD_AT_PLUS_A")
+
+
+@lru_cache(maxsize=cache_size)
+def diffusion_factorization(rows, cols, dt, a_mod):
+    a = dt*a_mod
+    matrix = assemble(rows, cols, 1.0 + a, a/4.0)
+    return matrix, linalg.splu(matrix, permc_spec="MMD_AT_PLUS_A")
+
+
+def assemble(rows, cols, diag, off):
+    """
+    Matrix of diag*x - off*(sum of neighbours) on the interior cells,
+    a neighbour outside the interior is a ghost copy of the cell itself.
+    """
+
+    index = np.arange(rows*cols).reshape(rows, cols)
+
+    # ghost neighbours fold back into the diagonal
+    ghosts = np.zeros((rows, cols))
+    ghosts[0, :] += 1
+    ghosts[-1, :] += 1
+    ghosts[:, 0] += 1
+    ghosts[:, -1] += 1
+    diagonal = (diag - off*ghosts).ravel()
+
+    # couplings between vertical and horizontal neighbours
+    pairs = [
+        (index[:-1, :].ravel(), index[1:, :].ravel()),
+        (index[:, :-1].ravel(), index[:, 1:].ravel()),
+    ]
+    first = np.concatenate([p[0] for p in pairs])
+    second = np.concatenate([p[1] for p in pairs])
+
+    row = np.concatenate([np.arange(rows*cols), first, second])
+    col = np.concatenate([np.arange(rows*cols), second, first])
+    data = np.concatenate([diagonal, np.full(2*len(first), -off)])
+
+    return sparse.csc_matrix((data, (row, col)), shape=(rows*cols, rows*cols))
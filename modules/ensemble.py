@@ -0,0 +1,395 @@
+"""
+Batched ensemble of simulations of the same grid.
+
+K members are stored as stacks, density (K, N+2, N+2) and velocity
+(K, 2, N+2, N+2), so member k is a simulation of the "soa" layout. Each
+member has its own dt, viscosity and diffusion (the a_mod of the velocity
+and density diffusion), sources are added per member.
+
+Every stage is one kernel launch for the whole batch. The parallel loops of
+the solves run over the members and the rows together, so small grids still
+use every core, advection runs the rows of each member in parallel.
+The stages are the jacobi path of modules/solvers.py in the same order and
+each plane of each member (u and v are solved on their own, as with the soa
+layout) stops iterating once it has converged, so a member gives the same
+fields as a Simulation of the soa layout. The stats hold the iterations
+and residual of each member, the largest of its planes.
+"""
+
+import numpy as np
+from numba import njit, prange
+
+from modules.boundaries import update_bnd, update_bnd_vel
+from modules.config import SolverConfig
+from modules.profiler import Profiler
+from modules.solvers import converged, interpolate, trace
+
+
+class Ensemble:
+
+    def __init__(self, width, height, cell_count, count, config=None, dtype=np.float32) -> None:
+        self.cell_count = cell_count
+        self.count = count
+        self.width = width
+        self.height = height
+
+        self.dx = width/cell_count
+        self.dy = height/cell_count
+
+        # solver settings shared by the members, jacobi only
+        self.config = config if config is not None else SolverConfig()
+        solvers = {self.config.projection_solver(), self.config.diffusion_solver()}
+        if solvers != {"jacobi"}:
+            raise ValueError(f"Ensembles only have the jacobi solver, config asks for {solvers}")
+
+        # ghost cells are used, so each dimension is increased by 2
+        shape = (cell_count+2, cell_count+2)
+        self.density_field = np.zeros((count,) + shape, dtype=dtype)
+        self.velocity_field = np.zeros((count, 2) + shape, dtype=dtype)
+
+        # pressure of the last projection of each member, seeds the next one
+        self.pressure_field = np.zeros((count,) + shape, dtype=dtype)
+        self.warm_start = True
+
+        # a_mod of the velocity and density diffusion of each member
+        self.viscosity = np.ones(count)
+        self.diffusion = np.full(count, 2.0)
+
+        # buffers of the stages, as modules/workspace.py for the whole batch
+        self.density0 = np.zeros_like(self.density_field)
+        self.density_tmp = np.zeros_like(self.density_field)
+        self.velocity0 = np.zeros_like(self.velocity_field)
+        self.velocity_tmp = np.zeros_like(self.velocity_field)
+        self.pressure = np.zeros_like(self.density_field)
+        self.pressure_tmp = np.zeros_like(self.density_field)
+        self.divergence = np.zeros_like(self.density_field)
+
+        # squared updates of each row of each plane, reduced per plane
+        self.row_totals = np.zeros((2*count, shape[0]))
+
+        self.profiler = Profiler()
+
+        # (iterations, residual) arrays of each linear solve in the last step
+        self.solve_stats = {}
+
+    def solve_fields(self, dt):
+        """One step of every member, dt is a number or one per member"""
+
+        dt = np.ascontiguousarray(np.broadcast_to(np.asarray(dt, dtype=np.float64), (self.count,)))
+        with self.profiler.stage("solve_fields"):
+            self.solve_stats = self.step(dt)
+
+    def step(self, dt):
+        config = self.config
+        timed = self.profiler.timed
+        grid = (dt, self.dx, self.dy, self.width, self.height)
+        solve = (config.n_iter, config.tolerance_abs, config.tolerance_rel, self.row_totals)
+
+        density = self.density_field[:, np.newaxis]
+        density0 = self.density0[:, np.newaxis]
+        density_tmp = self.density_tmp[:, np.newaxis]
+        velocity, velocity0 = self.velocity_field, self.velocity0
+
+        stats = {}
+        stats["difuse_vel_step"] = timed(
+            "difuse_vel_step", jacobi_planes, velocity, velocity0, self.velocity_tmp, dt, self.viscosity, *solve
+        )
+        stats["project_1"] = timed("project_1", self.project)
+
+        if config.fused_advection:
+            # both along the velocity of the first projection, the velocity
+            # snapshot taken by its advection is traced for the density too
+            stats["difuse_step"] = timed(
+                "difuse_step", jacobi_planes, density, density0, density_tmp, dt, self.diffusion, *solve
+            )
+            with self.profiler.stage("advect_fused"):
+                batch_advect(*grid, velocity, velocity0, velocity0, True)
+                batch_advect(*grid, density, density0, velocity0, False)
+            stats["project_2"] = timed("project_2", self.project)
+            return stats
+
+        timed("advect_vel", batch_advect, *grid, velocity, velocity0, velocity0, True)
+        stats["project_2"] = timed("project_2", self.project)
+
+        stats["difuse_step"] = timed(
+            "difuse_step", jacobi_planes, density, density0, density_tmp, dt, self.diffusion, *solve
+        )
+        timed("advect", batch_advect, *grid, density, density0, velocity, False)
+        return stats
+
+    def project(self):
+        """Both projections of a step, as solvers.project with jacobi_project"""
+
+        p, div = self.pressure, self.divergence
+        batch_divergence(self.dx, self.dy, self.velocity_field, p, div)
+        if self.warm_start:
+            p[...] = self.pressure_field
+
+        stats = batch_jacobi_project(
+            p, div, self.pressure_tmp, self.config.n_iter, self.config.tolerance_abs, self.config.tolerance_rel,
+            self.row_totals[:self.count]
+        )
+
+        if self.warm_start:
+            self.pressure_field[...] = p
+        batch_subtract_gradient(self.dx, self.dy, self.velocity_field, p)
+        return stats
+
+    def clamp_cell(self, row, col, radius):
+        """Keep a square of side 2*radius around (row, col) inside the grid"""
+
+        last = self.cell_count - 1
+        row = min(max(row, radius), last - radius)
+        col = min(max(col, radius), last - radius)
+        return row, col
+
+    def add_density(self, member, row, col, radius, value=1.0):
+        """Set density of one member on a square around (row, col)"""
+
+        row, col = self.clamp_cell(row, col, radius)
+        self.density_field[member, row-radius:row+radius, col-radius:col+radius] = value
+
+    def add_velocity(self, member, row, col, radius, u, v):
+        """Add velocity (u, v) to one member on a square around (row, col)"""
+
+        # summed in float64 and rounded, as Simulation.add_velocity does
+        row, col = self.clamp_cell(row, col, radius)
+        self.velocity_field[member, 0, row-radius:row+radius, col-radius:col+radius] += np.float64(u)
+        self.velocity_field[member, 1, row-radius:row+radius, col-radius:col+radius] += np.float64(v)
+
+
+def jacobi_planes(field, x0, tmp, dt, a_mod, max_iter, tol_abs, tol_rel, totals):
+    """batch_jacobi with each plane of a member its own system, as the solves of the soa layout"""
+
+    K, C = field.shape[:2]
+    shape = (K*C, 1) + field.shape[2:]
+    iterations, res = batch_jacobi(
+        field.reshape(shape), x0.reshape(shape), tmp.reshape(shape), np.repeat(dt, C), np.repeat(a_mod, C),
+        max_iter, tol_abs, tol_rel, totals[:K*C]
+    )
+    return iterations.reshape(K, C).max(axis=1), res.reshape(K, C).max(axis=1)
+
+
+##### Batch kernels #####
+# stacks are (K, C, N+2, N+2) for fields with components and (K, N+2, N+2)
+# for the pressure planes, the parallel loops run over K*N (member, row)
+# pairs, so every member and row is one task
+#
+# in the solves a converged member is not swept anymore, its last result
+# stays in the buffer of its last sweep, see batch_copy_odd
+@njit(parallel=True, nogil=True, cache=True)
+def batch_copy(src, dst):
+    # flat, the stacks are contiguous
+    a = src.reshape(-1)
+    b = dst.reshape(-1)
+    for i in prange(a.shape[0]):
+        b[i] = a[i]
+
+@njit(parallel=True, nogil=True, cache=True)
+def batch_bnd(field):
+    # every (N+2, N+2) plane of the stack
+    planes = field.reshape((-1,) + field.shape[-2:])
+    for k in prange(planes.shape[0]):
+        update_bnd(planes[k])
+
+@njit(parallel=True, nogil=True, cache=True)
+def batch_bnd_vel(velocity_field):
+    for k in prange(velocity_field.shape[0]):
+        update_bnd_vel(velocity_field[k, 0], velocity_field[k, 1])
+
+@njit(parallel=True, nogil=True, cache=True)
+def batch_rms(field, out):
+    # rms of the interior of each member
+    K, C, s0, s1 = field.shape
+    for k in prange(K):
+        total = 0.0
+        for c in range(C):
+            for i in range(1, s0-1):
+                for j in range(1, s1-1):
+                    total += field[k, c, i, j]**2
+        out[k] = np.sqrt(total / (C*(s0-2)*(s1-2)))
+
+@njit(parallel=True, nogil=True, cache=True)
+def batch_copy_odd(tmp, field, iterations):
+    # members whose last sweep went to tmp
+    K = field.shape[0]
+    a = tmp.reshape((K, -1))
+    b = field.reshape((K, -1))
+    for k in range(K):
+        if iterations[k] % 2 == 1:
+            for i in prange(a.shape[1]):
+                b[k, i] = a[k, i]
+
+@njit(nogil=True, cache=True)
+def batch_residuals(totals, scale, n, b_rms, tol_abs, tol_rel, it, res, iterations, running):
+    """Residual of the running members from the row totals, returns how many keep running"""
+
+    count = 0
+    for k in range(totals.shape[0]):
+        if not running[k]:
+            continue
+
+        res[k] = scale[k] * np.sqrt(totals[k, 1:-1].sum()/n)
+        iterations[k] = it
+        if converged(res[k], b_rms[k], tol_abs, tol_rel):
+            running[k] = False
+        else:
+            count += 1
+    return count
+
+@njit(parallel=True, nogil=True, cache=True)
+def batch_advect(dt, dx, dy, width, height, field, field0, velocity, reflect):
+    """
+    Move every member of field, (K, 1 or 2, N+2, N+2), along its velocity
+    with its dt. field0 receives the field before, velocity may be field0.
+    """
+
+    K, C, s0, s1 = field.shape
+    s = (s0, s1)
+    batch_copy(field, field0)
+
+    # the gathers of the interpolation are much faster on planes taken
+    # outside the parallel loop than on the stacks, so the members are
+    # looped here and the rows of each one in parallel
+    # fields have 1 or 2 components, first and last are the same plane for 1
+    for k in range(K):
+        u_k = velocity[k, 0]
+        v_k = velocity[k, 1]
+        dt_k = dt[k]
+        first, first0 = field[k, 0], field0[k, 0]
+        last, last0 = field[k, C-1], field0[k, C-1]
+        for i in prange(1, s0-1):
+            for j in range(1, s1-1):
+                i0, j0, kx, ky = trace(i, j, u_k[i, j], v_k[i, j], dt_k, dx, dy, width, height, s)
+                first[i, j] = interpolate(first0, i0, j0, kx, ky)
+                if C == 2:
+                    last[i, j] = interpolate(last0, i0, j0, kx, ky)
+
+    if reflect:
+        batch_bnd_vel(field)
+    else:
+        batch_bnd(field)
+
+@njit(parallel=True, nogil=True, cache=True)
+def batch_jacobi(field, x0, tmp, dt, a_mod, max_iter, tol_abs, tol_rel, totals):
+    # solvers.jacobi with a = dt[k]*a_mod[k] for member k
+    K, C, s0, s1 = field.shape
+    rows = s0-2
+    n = C*rows*(s1-2)
+    batch_copy(field, x0)
+
+    b_rms = np.zeros(K)
+    batch_rms(x0, b_rms)
+    scale = 1 + dt*a_mod
+    res = np.zeros(K)
+    iterations = np.zeros(K, dtype=np.int64)
+    running = np.ones(K, dtype=np.bool_)
+
+    src = field
+    dst = tmp
+    it = 0
+    while it < max_iter:
+        for task in prange(K*rows):
+            k = task // rows
+            i = task % rows + 1
+            if not running[k]:
+                continue
+
+            a = dt[k] * a_mod[k]
+            total = 0.0
+            for c in range(C):
+                for j in range(1, s1-1):
+                    v = (
+                        x0[k, c, i, j] + a *
+                        (
+                            (src[k, c, i-1, j] + src[k, c, i+1, j] + src[k, c, i, j-1] + src[k, c, i, j+1])/(4.0)
+                        )
+                    ) / (1+a)
+                    total += (v - src[k, c, i, j])**2
+                    dst[k, c, i, j] = v
+            totals[k, i] = total
+        batch_bnd(dst)
+        src, dst = dst, src
+
+        it += 1
+        if batch_residuals(totals, scale, n, b_rms, tol_abs, tol_rel, it, res, iterations, running) == 0:
+            break
+
+    batch_copy_odd(tmp, field, iterations)
+    return iterations, res
+
+@njit(parallel=True, nogil=True, cache=True)
+def batch_divergence(dx, dy, velocity_field, p, div):
+    K, _, s0, s1 = velocity_field.shape
+    rows = s0-2
+    for task in prange(K*rows):
+        k = task // rows
+        i = task % rows + 1
+        u = velocity_field[k, 0]
+        v = velocity_field[k, 1]
+        for j in range(1, s1-1):
+            div[k, i, j] = (
+                (u[i, j+1] - u[i, j-1]) / (-2.0*dx) +
+                (v[i+1, j] - v[i-1, j]) / (-2.0*dy)
+            )
+            p[k, i, j] = 0
+    batch_bnd(p)
+    batch_bnd(div)
+
+@njit(parallel=True, nogil=True, cache=True)
+def batch_jacobi_project(p, div, tmp, max_iter, tol_abs, tol_rel, totals):
+    # solvers.jacobi_project of every member
+    K, s0, s1 = p.shape
+    rows = s0-2
+    n = rows*(s1-2)
+
+    b_rms = np.zeros(K)
+    batch_rms(div.reshape((K, 1, s0, s1)), b_rms)
+    scale = np.full(K, 4.0)
+    res = np.zeros(K)
+    iterations = np.zeros(K, dtype=np.int64)
+    running = np.ones(K, dtype=np.bool_)
+
+    src = p
+    dst = tmp
+    it = 0
+    while it < max_iter:
+        for task in prange(K*rows):
+            k = task // rows
+            i = task % rows + 1
+            if not running[k]:
+                continue
+
+            total = 0.0
+            for j in range(1, s1-1):
+                v = (
+                    src[k, i-1, j] +
+                    src[k, i+1, j] +
+                    src[k, i, j-1] +
+                    src[k, i, j+1] +
+                    div[k, i, j]
+                ) / 4.0
+                total += (v - src[k, i, j])**2
+                dst[k, i, j] = v
+            totals[k, i] = total
+        batch_bnd(dst)
+        src, dst = dst, src
+
+        it += 1
+        if batch_residuals(totals, scale, n, b_rms, tol_abs, tol_rel, it, res, iterations, running) == 0:
+            break
+
+    batch_copy_odd(tmp, p, iterations)
+    return iterations, res
+
+@njit(parallel=True, nogil=True, cache=True)
+def batch_subtract_gradient(dx, dy, velocity_field, p):
+    K, _, s0, s1 = velocity_field.shape
+    rows = s0-2
+    for task in prange(K*rows):
+        k = task // rows
+        i = task % rows + 1
+        for j in range(1, s1-1):
+            velocity_field[k, 0, i, j] -= (p[k, i, j+1] - p[k, i, j-1]) / (2.0*dx)
+            velocity_field[k, 1, i, j] -= (p[k, i+1, j] - p[k, i-1, j]) / (2.0*dy)
+    batch_bnd_vel(velocity_field)
@@ -1,30 +1,22 @@
 from glumpy import gl, gloo, glm
 import numpy as np
 
+from modules import mesh_cache
 from modules.grid import Grid
 from modules.quiver import Quiver
-from modules import solvers
+from modules.simulation import Simulation
+from modules.simulation_thread import SimulationThread
+from modules.textures import DensityTexture
 
 
 vertex      = 'shaders/fluid/fluid.vert'
 fragment    = 'shaders/fluid/fluid.frag'
 
 
-class Fluid:
+class Fluid(Simulation):
 
-    def __init__(self, width, height, cell_count) -> None:
-        self.cell_count = cell_count
-        self.width = width
-        self.height = height
-
-        self.dx = width/cell_count
-        self.dy = height/cell_count
-
-        # ghost cells are used, so each dimension is increased by 2
-        self.velocity_field = np.zeros(shape=(cell_count+2, cell_count+2, 2), dtype=np.float32)
-
-        # density field of smoke
-        self.density_field  = np.zeros(shape=(cell_count+2, cell_count+2), dtype=np.float32)
+    def __init__(self, width, height, cell_count, backend="numba", config=None, density_format="float32") -> None:
+        super().__init__(width, height, cell_count, backend, config)
 
         # external forces acting on velocity field
         # our case is primary the mouse, so no initial forces
@@ -40,7 +32,11 @@ class Fluid:
         self.show_grid = False
         self.show_vectors = False
         self.show_fps = False
+        self.show_timings = False
         self.smoke_color = 1., 1., 1.
+
+        # steps the simulation in the background when started
+        self.sim_thread = None
     
         # opengl program for the smoke
         # count is number of vertexes
@@ -48,11 +44,19 @@ class Fluid:
         self.program = gloo.Program(vertex, fragment, count=(cell_count+2)**2, version="430")
         
         # set vertex coords
-        self.program["position"] = self.calculate_vertex_field()
+        self.program["position"] = mesh_cache.cached(
+            "vertexes", (cell_count, width, height), self.calculate_vertex_field
+        )
+
+        # density is read from a texture by the vertex shader, float32,
+        # uint16 or uint8, see modules/textures.py
+        self.density_texture = DensityTexture(self.density_field.shape, density_format)
+        self.program["density"] = self.density_texture.texture
+        self.program["side"] = cell_count+2
 
         # set index on coords
         # this tells opengl how to draw the triangles
-        self.index_buffer = self.calculate_index().view(gloo.IndexBuffer)
+        self.index_buffer = mesh_cache.cached("index", (cell_count,), self.calculate_index).view(gloo.IndexBuffer)
 
         # config initial spacial view
         view = np.eye(4)
@@ -67,46 +71,92 @@ class Fluid:
         self.update_density()
 
     def draw(self):
-        # draw smoke first
-        self.program.draw(gl.GL_TRIANGLES, self.index_buffer)
+        # time to issue the draw calls, the gpu may finish them later
+        with self.profiler.stage("draw"):
+            # draw smoke first
+            self.program.draw(gl.GL_TRIANGLES, self.index_buffer)
 
-        # controls after
-        if self.show_grid:
-            self.grid.draw()
+            # controls after
+            if self.show_grid:
+                self.grid.draw()
 
-        if self.show_vectors:
-            self.vectors.draw()
+            if self.show_vectors:
+                self.vectors.draw()
     
+    def start_thread(self, dt=None):
+        """
+        Step the simulation on a background thread from now on, with a fixed
+        dt or, when None, the wall time between steps.
+
+        The thread runs a copy of this simulation, the fields here become the
+        copy of the last step that is drawn.
+        """
+
+        if self.sim_thread is None:
+            simulation = Simulation(self.width, self.height, self.cell_count, self.backend.name, self.config)
+            np.copyto(simulation.density_field, self.density_field)
+            np.copyto(simulation.velocity_field, self.velocity_field)
+            np.copyto(simulation.pressure_field, self.pressure_field)
+
+            # stages of both threads in the same timings
+            simulation.profiler = simulation.backend.profiler = self.profiler
+            simulation.integrator = self.integrator
+
+            self.sim_thread = SimulationThread(simulation, dt)
+        self.sim_thread.start()
+
+    def stop_thread(self):
+        if self.sim_thread is not None:
+            self.sim_thread.stop()
+
+    def solve_fields(self, dt):
+        # the simulation thread steps on its own
+        if self.sim_thread is None:
+            super().solve_fields(dt)
+
+    def advance(self, dt):
+        if self.sim_thread is None:
+            return super().advance(dt)
+        return 0
+
+    def add_density(self, row, col, radius, value=1.0):
+        if self.sim_thread is not None:
+            self.sim_thread.add_density(row, col, radius, value)
+        else:
+            super().add_density(row, col, radius, value)
+
+    def add_velocity(self, row, col, radius, u, v):
+        if self.sim_thread is not None:
+            self.sim_thread.add_velocity(row, col, radius, u, v)
+        else:
+            super().add_velocity(row, col, radius, u, v)
+
     def update_smoke_color(self):
         self.program["FillColor"] = self.smoke_color
 
     def update_density(self):
-        self.program["density"] = self.density_field.flatten()
+        self.density_texture.update(self.density_field)
 
     def update_fields(self):
         """Update density and velocity field values"""
 
-        self.vectors.update_velocities(self.velocity_field)
-        self.update_density()
+        with self.profiler.stage("update_fields"):
+            # last step of the simulation thread
+            if self.sim_thread is not None:
+                with self.sim_thread.front() as (density, velocity):
+                    np.copyto(self.density_field, density)
+                    np.copyto(self.velocity_field, velocity)
+
+            # velocities are only sent when drawn
+            if self.show_vectors:
+                self.vectors.update_velocities(self.velocity_field)
+            self.update_density()
     
     def update_view_matrix(self):
         self.program["u_view"] = glm.translate(
             np.eye(4), self.view_matrix[0], self.view_matrix[1], self.view_matrix[2]
         )
 
-    def solve_fields(self, dt):
-        """Call solver for the fields"""
-
-        solvers.solve_fields(
-            dt, 
-            self.dx, 
-            self.dy, 
-            self.width, 
-            self.height, 
-            self.density_field, 
-            self.velocity_field
-        )
-
     def calculate_vertex_field(self):
         """Generate vertex coords for smoke field"""
 
@@ -119,37 +169,37 @@ class Fluid:
             # same for height
 
             return (2*pos-max_value)/max_value
-        
-        # coord matrix
+
+        # index of each row and col, ghost cells included
+        ids = np.arange(-1, self.cell_count + 1)
+        x = convert_pos(ids*self.dx + self.dx/2, self.width)
+        y = convert_pos(self.height - (ids*self.dy + self.dy/2), self.height)
+
+        # coord matrix, x changes along the cols and y along the rows
         vertexes = np.zeros(shape=(self.cell_count+2, self.cell_count+2, 2), dtype=np.float32)
-        
-        # calculate coords, ghost cells can be included
-        for i in range(-1, self.cell_count + 1):
-            for j in range(-1, self.cell_count + 1):
-                # calculate position of vertex and normalize
-                pos = j*self.dx + self.dx/2, self.height - (i*self.dy + self.dy/2)
-                pos = convert_pos(pos[0], self.width), convert_pos(pos[1], self.height)
-                vertexes[i+1, j+1] = pos
+        vertexes[:, :, 0] = x[np.newaxis, :]
+        vertexes[:, :, 1] = y[:, np.newaxis]
 
         # transform matrix to array of coords
-        return np.array([vert for row in vertexes for vert in row])
+        return vertexes.reshape(-1, 2)
 
     def calculate_index(self):
         """Generate array with index information"""
 
         size = self.cell_count+2
-        indices = np.zeros((size-1)**2*6, dtype=np.uint32)
-        index = 0
-        for x in range(size-1):
-            for z in range(size-1):
-                offset = x*size + z
-                indices[index]      = (offset + 0)
-                indices[index + 1]  = (offset + 1)
-                indices[index + 2]  = (offset + size)
-                indices[index + 3]  = (offset + 1)
-                indices[index + 4]  = (offset + size + 1)
-                indices[index + 5]  = (offset + size)
-                index += 6
-
-        return indices
 
+        # top left vertex of each quad
+        rows = np.arange(size-1, dtype=np.uint32)
+        offset = (rows[:, np.newaxis]*size + rows[np.newaxis, :]).ravel()
+
+        # two triangles per quad
+        indices = np.stack([
+            offset + 0,
+            offset + 1,
+            offset + size,
+            offset + 1,
+            offset + size + 1,
+            offset + size,
+        ], axis=1)
+
+        return indices.ravel()
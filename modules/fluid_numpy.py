@@ -0,0 +1,228 @@
+"""
+Vectorized numpy implementation of the solver, no JIT compilation.
+
+Follows the jacobi path of modules/solvers.py stage by stage, each sweep is
+one set of whole array operations on the interior. Slower than the JIT
+backends on large grids, but starts instantly and only needs numpy, which
+suits short runs and environments where numba or taichi warm up too slowly.
+
+Velocity fields of both layouts are used through their (N+2, N+2, 2) view,
+except for diffusion, which solves the two planes of soa on their own as
+the numba backend does.
+"""
+
+import numpy as np
+
+from modules.backends import Backend
+from modules.layout import aos_view, layout_of
+
+
+##### Boundaries funcs #####
+# same results as modules/boundaries.py, rows first, then cols
+def update_bnd(field):
+    field[0] = field[1]
+    field[-1] = field[-2]
+    field[:, 0] = field[:, 1]
+    field[:, -1] = field[:, -2]
+
+
+def update_bnd_vel(field):
+    field[0, :, 0] = field[1, :, 0]
+    field[0, :, 1] = -field[1, :, 1]
+    field[-1, :, 0] = field[-2, :, 0]
+    field[-1, :, 1] = -field[-2, :, 1]
+
+    field[:, 0, 0] = -field[:, 1, 0]
+    field[:, 0, 1] = field[:, 1, 1]
+    field[:, -1, 0] = -field[:, -2, 0]
+    field[:, -1, 1] = field[:, -2, 1]
+
+
+def neighbours(field):
+    """Sum of the 4 neighbours of each interior cell"""
+
+    return field[:-2, 1:-1] + field[2:, 1:-1] + field[1:-1, :-2] + field[1:-1, 2:]
+
+
+def interpolate(d0, i0, j0, kx, ky):
+    """Bilinear interpolation of d0 at the traced cells, any number of components"""
+
+    if d0.ndim == 3:
+        kx = kx[:, :, np.newaxis]
+        ky = ky[:, :, np.newaxis]
+
+    z1 = (1 - kx) * d0[i0, j0] + kx * d0[i0, j0+1]
+    z2 = (1 - kx) * d0[i0+1, j0] + kx * d0[i0+1, j0+1]
+    return (1 - ky) * z1 + ky * z2
+
+
+def rms(values):
+    return float(np.sqrt(np.mean(np.square(values, dtype=np.float64))))
+
+
+class Solver(Backend):
+
+    name = "numpy"
+
+    def __init__(self, shape, config=None, dtype=np.float32) -> None:
+        super().__init__(shape, config)
+
+        # snapshots read by advection and x0 of the diffusion solves
+        self.density0 = np.zeros(self.shape, dtype=dtype)
+        self.velocity0 = np.zeros(self.shape + (2,), dtype=dtype)
+
+        # ping-pong targets of the jacobi sweeps
+        self.density_tmp = np.zeros(self.shape, dtype=dtype)
+        self.velocity_tmp = np.zeros(self.shape + (2,), dtype=dtype)
+
+        self.pressure = np.zeros(self.shape, dtype=dtype)
+        self.pressure_tmp = np.zeros(self.shape, dtype=dtype)
+        self.divergence = np.zeros(self.shape, dtype=dtype)
+
+        # row and col of every interior cell
+        self.rows, self.cols = np.mgrid[1:self.shape[0]-1, 1:self.shape[1]-1].astype(np.float64)
+
+    # ---------- Exposed funcs ----------
+    def advect(self, dt, dx, dy, width, height, field, velocity_field):
+        if field.ndim == 3:
+            field = aos_view(field)
+            d0 = self.velocity0
+        else:
+            d0 = self.density0
+        d0[...] = field
+
+        weights = self.trace(dt, dx, dy, width, height, velocity_field)
+        field[1:-1, 1:-1] = interpolate(d0, *weights)
+        self.boundaries(field)
+
+    def advect_fused(self, dt, dx, dy, width, height, density_field, velocity_field):
+        # both fields interpolated from the same backtrace
+        velocity_field = aos_view(velocity_field)
+        self.density0[...] = density_field
+        self.velocity0[...] = velocity_field
+
+        weights = self.trace(dt, dx, dy, width, height, velocity_field)
+        density_field[1:-1, 1:-1] = interpolate(self.density0, *weights)
+        velocity_field[1:-1, 1:-1] = interpolate(self.velocity0, *weights)
+
+        update_bnd(density_field)
+        update_bnd_vel(velocity_field)
+
+    def trace(self, dt, dx, dy, width, height, velocity_field):
+        """Cells (i0, j0) and weights (kx, ky) of every interior cell dt back in time"""
+
+        velocity_field = aos_view(velocity_field)
+        s = velocity_field.shape
+
+        # a copy, taken before the fields are written
+        vel = velocity_field[1:-1, 1:-1].astype(np.float64)
+
+        # pos back in time
+        # i and j are inverted for spacial coordinates
+        x = np.clip((self.cols*dx + dx/2) - dt*vel[:, :, 0], 0, width)
+        y = np.clip((self.rows*dy + dy/2) - dt*vel[:, :, 1], 0, height)
+
+        sqX = (x-dx/2)/dx
+        sqY = (y-dy/2)/dy
+
+        # indices of the four cells back in time, truncated as int() in numba
+        i0 = sqY.astype(np.int64)
+        j0 = sqX.astype(np.int64)
+
+        kx = sqX - j0
+        ky = sqY - i0
+
+        i0 = np.clip(i0, 0, s[0]-2)
+        j0 = np.clip(j0, 0, s[1]-2)
+        return i0, j0, kx, ky
+
+    def diffuse(self, dt, field, a_mod):
+        # backward euler step, as solvers.difuse
+        self.require_jacobi()
+        a = dt*a_mod
+        if field.ndim == 3 and layout_of(field) == "soa":
+            # each plane stops on its own residual
+            stats = [self.jacobi(field[c], self.velocity0[:, :, c], self.velocity_tmp[:, :, c], a) for c in range(2)]
+            return max(it for it, _ in stats), max(res for _, res in stats)
+        elif field.ndim == 3:
+            return self.jacobi(field, self.velocity0, self.velocity_tmp, a)
+        return self.jacobi(field, self.density0, self.density_tmp, a)
+
+    def jacobi(self, field, x0, tmp, a):
+        """Jacobi sweeps of the diffusion of field, x0 and tmp are buffers shaped like it"""
+
+        x0[...] = field
+        b_rms = rms(x0[1:-1, 1:-1])
+
+        src, dst = field, tmp
+        it = 0
+        res = 0.0
+        while it < self.config.n_iter:
+            dst[1:-1, 1:-1] = (x0[1:-1, 1:-1] + a*neighbours(src)/4.0) / (1+a)
+            delta = dst[1:-1, 1:-1] - src[1:-1, 1:-1]
+            update_bnd(dst)
+            src, dst = dst, src
+
+            it += 1
+            res = (1+a) * rms(delta)
+            if self.converged(res, b_rms):
+                break
+
+        # odd number of sweeps, last one went to tmp
+        if it % 2 == 1:
+            field[...] = tmp
+        return it, res
+
+    def project(self, dx, dy, velocity_field, pressure_field=None):
+        # as solvers.project with jacobi_project
+        self.require_jacobi()
+        v = aos_view(velocity_field)
+        div = self.divergence
+        div[1:-1, 1:-1] = (
+            (v[1:-1, 2:, 0] - v[1:-1, :-2, 0]) / (-2.0*dx) +
+            (v[2:, 1:-1, 1] - v[:-2, 1:-1, 1]) / (-2.0*dy)
+        )
+        update_bnd(div)
+
+        # pressure changes little between calls, so the solve starts close to it
+        if pressure_field is not None:
+            self.pressure[...] = pressure_field
+        else:
+            self.pressure.fill(0)
+        update_bnd(self.pressure)
+        b_rms = rms(div[1:-1, 1:-1])
+
+        src, dst = self.pressure, self.pressure_tmp
+        it = 0
+        res = 0.0
+        while it < self.config.n_iter:
+            dst[1:-1, 1:-1] = (neighbours(src) + div[1:-1, 1:-1]) / 4.0
+            delta = dst[1:-1, 1:-1] - src[1:-1, 1:-1]
+            update_bnd(dst)
+            src, dst = dst, src
+
+            it += 1
+            res = 4.0 * rms(delta)
+            if self.converged(res, b_rms):
+                break
+
+        if it % 2 == 1:
+            self.pressure[...] = self.pressure_tmp
+        if pressure_field is not None:
+            pressure_field[...] = self.pressure
+
+        # gradient
+        p = self.pressure
+        v[1:-1, 1:-1, 0] -= (p[1:-1, 2:] - p[1:-1, :-2]) / (2.0*dx)
+        v[1:-1, 1:-1, 1] -= (p[2:, 1:-1] - p[:-2, 1:-1]) / (2.0*dy)
+        update_bnd_vel(v)
+        return it, res
+
+    def boundaries(self, field):
+        if field.ndim == 3:
+            update_bnd_vel(aos_view(field))
+        else:
+            update_bnd(field)
+
+    def converged(self, res, b_rms):
+        return res <= self.config.tolerance_abs or res <= self.config.tolerance_rel*b_rms
@@ -1,321 +1,386 @@
 """
-Currently this module is not working
-Possible bugs: loops in taichi context
+Taichi implementation of the solver, runs on ti.cpu.
+
+Follows the jacobi path of modules/solvers.py stage by stage, so both JIT
+backends can be compared on the same scenes. Every stage is a kernel whose
+outermost loop runs over the cells, which is what taichi parallelizes, and
+each field has its own buffer to read from while it is written.
+
+The fields live in numpy arrays, as with the other backends, and are copied
+in and out of the taichi fields on every call. solve_fields copies them once
+per step, the single stage methods once per stage. Velocity fields of the
+soa layout are interleaved on the way in and split on the way out.
 """
 
-from glumpy import gl, gloo
+import math
 
+import numpy as np
 import taichi as ti
 
-from modules.grid import Grid
-from modules.quiver import Quiver
-
+from modules.backends import Backend
+from modules.layout import aos_view
 
-vertex      = 'shaders/fluid/fluid.vert'
-fragment    = 'shaders/fluid/fluid.frag'
 
+_initialized = False
 
-@ti.data_oriented
-class Fluid:
-
-    def __init__(self, width, height, cell_count) -> None:
-        self.cell_count = cell_count
-        self.width = width
-        self.height = height
-
-        self.dx = width/cell_count
-        self.dy = height/cell_count
-
-        # Ghost cells are used, so each dimension is increased by 2
-        self.velocity_field = ti.Vector.field(dtype=ti.f32, n=2, shape=(cell_count+2, cell_count+2))
-
-        # density field of smoke, has resolution of the screen        
-        self.density_field  = ti.field(ti.f32, shape=(cell_count+2, cell_count+2))
-
-        # external forces acting on velocity field
-        self.external_forces = ti.field(ti.f32, shape=(2,))
-        self.external_forces[0] = 0
-        self.external_forces[1] = 0
-
-        self.grid = Grid(cell_count, width, height) 
-        self.vectors = Quiver(cell_count, self.velocity_field, width, height)
-
-        self.show_grid = False
-        self.show_vectors = False
-        self.smoke_color = 1., 1., 1.
-    
-        self.program = gloo.Program(vertex, fragment, count=4)
-        
-        self.program["position"] = (
-            (-1, -1), 
-            (-1, +1), 
-            (+1, -1), 
-            (+1, +1),
-        )
 
-        self.program["scale"] =  1.0/width, 1.0/height
+def init(arch=ti.cpu, **kwargs):
+    """Initialize taichi once, creating fields before this fails"""
 
-        self.update_smoke_color()
-        self.update_density()
+    global _initialized
+    if not _initialized:
+        ti.init(arch=arch, **kwargs)
+        _initialized = True
 
-    def draw(self):
-        # draw smoke first
-        self.program.draw(gl.GL_TRIANGLE_STRIP)
 
-        # controls after
-        if self.show_grid:
-            self.grid.draw()
+@ti.func
+def squared(f: ti.template(), v):
+    # v*v for values of a scalar field, |v|^2 for a vector field
+    result = ti.cast(0.0, ti.f64)
+    if ti.static(isinstance(f, ti.MatrixField)):
+        result = ti.cast(v.norm_sqr(), ti.f64)
+    else:
+        result = ti.cast(v*v, ti.f64)
+    return result
 
-        if self.show_vectors:
-            self.vectors.draw()
-    
-    def update_smoke_color(self):
-        self.program["FillColor"] = self.smoke_color
 
-    def update_density(self):
-        self.program["density"] = self.density_field.to_numpy().view(gloo.TextureFloat2D)
+@ti.data_oriented
+class Solver(Backend):
+
+    name = "taichi"
+
+    def __init__(self, shape, config=None) -> None:
+        super().__init__(shape, config)
+        init()
+
+        self.cells = (self.shape[0]-2)*(self.shape[1]-2)
+
+        self.density = ti.field(ti.f32, shape=self.shape)
+        self.density0 = ti.field(ti.f32, shape=self.shape)
+        self.density_tmp = ti.field(ti.f32, shape=self.shape)
+
+        self.velocity = ti.Vector.field(2, ti.f32, shape=self.shape)
+        self.velocity0 = ti.Vector.field(2, ti.f32, shape=self.shape)
+        self.velocity_tmp = ti.Vector.field(2, ti.f32, shape=self.shape)
+
+        self.pressure = ti.field(ti.f32, shape=self.shape)
+        self.pressure_tmp = ti.field(ti.f32, shape=self.shape)
+        self.divergence = ti.field(ti.f32, shape=self.shape)
+
+        # reductions of the residuals
+        self.total = ti.field(ti.f64, shape=())
+
+    def load_velocity(self, velocity_field):
+        self.velocity.from_numpy(np.ascontiguousarray(aos_view(velocity_field)))
+
+    def store_velocity(self, velocity_field):
+        aos_view(velocity_field)[...] = self.velocity.to_numpy()
+
+    # ---------- Exposed funcs ----------
+    def solve_fields(self, dt, dx, dy, width, height, density_field, velocity_field, pressure_field=None):
+        """Same arguments and results as Backend.solve_fields, one copy in and out"""
+
+        self.require_jacobi()
+
+        self.density.from_numpy(density_field)
+        self.load_velocity(velocity_field)
+        if pressure_field is not None:
+            self.pressure.from_numpy(pressure_field)
+
+        stats = {}
+        if self.config.fused_advection:
+            stats.update(self.fused_step(dt, dx, dy, width, height, pressure_field is not None))
+        else:
+            stats.update(self.vel_step(dt, dx, dy, width, height, pressure_field is not None))
+            stats.update(self.dens_step(dt, dx, dy, width, height))
+
+        density_field[...] = self.density.to_numpy()
+        self.store_velocity(velocity_field)
+        if pressure_field is not None:
+            pressure_field[...] = self.pressure.to_numpy()
+        return stats
+
+    def advect(self, dt, dx, dy, width, height, field, velocity_field):
+        self.load_velocity(velocity_field)
+        if field.ndim == 3:
+            self.advect_velocity(dt, dx, dy, width, height)
+            self.store_velocity(field)
+        else:
+            self.density.from_numpy(field)
+            self.advect_density(dt, dx, dy, width, height)
+            field[...] = self.density.to_numpy()
+
+    def diffuse(self, dt, field, a_mod):
+        self.require_jacobi()
+        if field.ndim == 3:
+            self.load_velocity(field)
+            stats = self.jacobi_difuse(self.velocity, self.velocity0, self.velocity_tmp, dt, a_mod, 2)
+            self.store_velocity(field)
+        else:
+            self.density.from_numpy(field)
+            stats = self.jacobi_difuse(self.density, self.density0, self.density_tmp, dt, a_mod, 1)
+            field[...] = self.density.to_numpy()
+        return stats
+
+    def project(self, dx, dy, velocity_field, pressure_field=None):
+        self.require_jacobi()
+        self.load_velocity(velocity_field)
+        if pressure_field is not None:
+            self.pressure.from_numpy(pressure_field)
+
+        stats = self.jacobi_project(dx, dy, pressure_field is not None)
+
+        self.store_velocity(velocity_field)
+        if pressure_field is not None:
+            pressure_field[...] = self.pressure.to_numpy()
+        return stats
+
+    def boundaries(self, field):
+        if field.ndim == 3:
+            self.load_velocity(field)
+            self.update_bnd_vel(self.velocity)
+            self.store_velocity(field)
+        else:
+            self.density.from_numpy(field)
+            self.update_bnd(self.density)
+            field[...] = self.density.to_numpy()
+
+    # ---------- Steps on the taichi fields ----------
+    def dens_step(self, dt, dx, dy, width, height):
+        stats = {}
+        timed = self.profiler.timed
+        stats["difuse_step"] = timed(
+            "difuse_step", self.jacobi_difuse, self.density, self.density0, self.density_tmp, dt, 2.0, 1
+        )
+        timed("advect", self.advect_density, dt, dx, dy, width, height)
+        return stats
+
+    def vel_step(self, dt, dx, dy, width, height, warm_start):
+        stats = {}
+        timed = self.profiler.timed
+        stats["difuse_vel_step"] = timed(
+            "difuse_vel_step", self.jacobi_difuse, self.velocity, self.velocity0, self.velocity_tmp, dt, 1.0, 2
+        )
+        stats["project_1"] = timed("project_1", self.jacobi_project, dx, dy, warm_start)
+        timed("advect_vel", self.advect_velocity, dt, dx, dy, width, height)
+        stats["project_2"] = timed("project_2", self.jacobi_project, dx, dy, warm_start)
+        return stats
+
+    def fused_step(self, dt, dx, dy, width, height, warm_start):
+        # as Backend.solve_fields with config.fused_advection
+        stats = {}
+        timed = self.profiler.timed
+        stats["difuse_vel_step"] = timed(
+            "difuse_vel_step", self.jacobi_difuse, self.velocity, self.velocity0, self.velocity_tmp, dt, 1.0, 2
+        )
+        stats["project_1"] = timed("project_1", self.jacobi_project, dx, dy, warm_start)
+        stats["difuse_step"] = timed(
+            "difuse_step", self.jacobi_difuse, self.density, self.density0, self.density_tmp, dt, 2.0, 1
+        )
+        timed("advect_fused", self.advect_both, dt, dx, dy, width, height)
+        stats["project_2"] = timed("project_2", self.jacobi_project, dx, dy, warm_start)
+        return stats
+
+    def advect_both(self, dt, dx, dy, width, height):
+        # both fields read the velocity snapshot
+        self.copy(self.density, self.density0)
+        self.copy(self.velocity, self.velocity0)
+        self.semi_lagrangian(dt, dx, dy, width, height, self.density, self.density0, self.velocity0)
+        self.semi_lagrangian(dt, dx, dy, width, height, self.velocity, self.velocity0, self.velocity0)
+        self.update_bnd(self.density)
+        self.update_bnd_vel(self.velocity)
+
+    def advect_density(self, dt, dx, dy, width, height):
+        self.copy(self.density, self.density0)
+        self.semi_lagrangian(dt, dx, dy, width, height, self.density, self.density0, self.velocity)
+        self.update_bnd(self.density)
+
+    def advect_velocity(self, dt, dx, dy, width, height):
+        self.copy(self.velocity, self.velocity0)
+        # reads the velocity of each cell from the copy, as it is overwritten
+        self.semi_lagrangian(dt, dx, dy, width, height, self.velocity, self.velocity0, self.velocity0)
+        self.update_bnd_vel(self.velocity)
+
+    # ---------- Solvers ----------
+    def jacobi_difuse(self, field, x0, tmp, dt, a_mod, components):
+        # backward euler step, as solvers.jacobi
+        n = self.cells*components
+        a = dt*a_mod
+        self.copy(field, x0)
+        b_rms = math.sqrt(self.sum_squares(x0)/n)
+
+        src, dst = field, tmp
+        it = 0
+        res = 0.0
+        while it < self.config.n_iter:
+            total = self.jacobi_sweep(x0, src, dst, a)
+            self.update_bnd(dst)
+            src, dst = dst, src
+
+            it += 1
+            res = (1+a) * math.sqrt(total/n)
+            if res <= self.config.tolerance_abs or res <= self.config.tolerance_rel*b_rms:
+                break
+
+        # odd number of sweeps, last one went to tmp
+        if it % 2 == 1:
+            self.copy(tmp, field)
+        return it, res
+
+    def jacobi_project(self, dx, dy, warm_start):
+        # as solvers.project with jacobi_project
+        self.compute_divergence(dx, dy)
+        if not warm_start:
+            self.pressure.fill(0)
+        self.update_bnd(self.divergence)
+        self.update_bnd(self.pressure)
+
+        b_rms = math.sqrt(self.sum_squares(self.divergence)/self.cells)
+
+        src, dst = self.pressure, self.pressure_tmp
+        it = 0
+        res = 0.0
+        while it < self.config.n_iter:
+            total = self.pressure_sweep(src, dst)
+            self.update_bnd(dst)
+            src, dst = dst, src
+
+            it += 1
+            res = 4.0 * math.sqrt(total/self.cells)
+            if res <= self.config.tolerance_abs or res <= self.config.tolerance_rel*b_rms:
+                break
+
+        if it % 2 == 1:
+            self.copy(self.pressure_tmp, self.pressure)
+
+        self.subtract_gradient(dx, dy)
+        self.update_bnd_vel(self.velocity)
+        return it, res
+
+    # ---------- Kernels ----------
+    @ti.kernel
+    def copy(self, src: ti.template(), dst: ti.template()):
+        for i, j in src:
+            dst[i, j] = src[i, j]
 
-    def update_fields(self):
-        self.vectors.update_velocities(self.velocity_field)
-        self.update_density()
+    @ti.kernel
+    def sum_squares(self, f: ti.template()) -> ti.f64:
+        s = f.shape
+        self.total[None] = 0.0
+        for i, j in ti.ndrange((1, s[0]-1), (1, s[1]-1)):
+            self.total[None] += squared(f, f[i, j])
+        return self.total[None]
 
-    # ---------- Taichi context lvl funcs ----------
     @ti.kernel
-    def solve_fields(self, dt: ti.f32):
-        self.vel_step(dt)
-        self.dens_step(dt)
-    
-    @ti.func
-    def dens_step(self, dt: ti.f32):
-        self.difuse_step(dt*10)
-        self.advect(dt, self.density_field)
-    
-    @ti.func
-    def vel_step(self, dt: ti.f32):
-        # self.add_forces(dt)
-        self.difuse_vel_step(dt)
-        # self.project(self.velocity_field)
-        self.advect_vel(dt, self.velocity_field)
-        self.project(self.velocity_field)
-    
-    @ti.func
-    def update_bnd(self, original_field: ti.template(), value_field):
-        # slicing doesn't work on fields
-        s = original_field.shape
-        
+    def update_bnd(self, f: ti.template()):
+        s = f.shape
+
         # rows
         for i in range(s[1]):
-            original_field[0, i] = value_field[1, i]
-            original_field[s[0]-1, i] = value_field[s[0]-2, i]
-        
-        # cols
+            f[0, i] = f[1, i]
+            f[s[0]-1, i] = f[s[0]-2, i]
+
+        # cols, taichi runs each top level loop after the previous one
         for i in range(s[0]):
-            original_field[i, 0] = value_field[i, 1]
-            original_field[i, s[1]-1] = value_field[i, s[1]-2]
-
-    @ti.func
-    def update_bnd_vel(self, original_field: ti.template(), value_field):
-        # slicing doesn't work on fields
-        s = original_field.shape
-        
+            f[i, 0] = f[i, 1]
+            f[i, s[1]-1] = f[i, s[1]-2]
+
+    @ti.kernel
+    def update_bnd_vel(self, f: ti.template()):
+        s = f.shape
+
         # rows
         for i in range(s[1]):
-            original_field[0, i] = [value_field[1, i][0], -value_field[1, i][1]]
-            original_field[s[0]-1, i] = [value_field[s[0]-2, i][0], -value_field[s[0]-2, i][1]]
-        
+            f[0, i] = [f[1, i][0], -f[1, i][1]]
+            f[s[0]-1, i] = [f[s[0]-2, i][0], -f[s[0]-2, i][1]]
+
         # cols
         for i in range(s[0]):
-            original_field[i, 0] = [-value_field[i, 1][0], value_field[1, i][1]]
-            original_field[i, s[1]-1] = [-value_field[i, s[1]-2][0], value_field[i, s[1]-2][1]]
-
-    # density funcs
-    @ti.func
-    def difuse(self, dt: ti.f32, x0):
-        # density field x0 is passed by value not ref
-        s = self.density_field.shape
-        a = dt
-
-        for i in range(1, s[0]-1):
-            for j in range(1, s[1]-1):
-                v = (
-                    x0[i, j] + a *
-                    (
-                        (x0[i-1, j] + x0[i+1, j] + x0[i, j-1] + x0[i, j+1])/(4.0)
-                    )
-                ) / (1+a)
-                self.density_field[i, j] = v
-
-    @ti.func
-    def difuse_step(self, dt: ti.f32):
-        # solve system with 20 iterations
-        for _ in range(1):
-            for it in range(20):
-                self.difuse(dt/20.0, self.density_field)
-                self.update_bnd(self.density_field, self.density_field)
-
-    @ti.func
-    def advect(self, dt: ti.f32, d0):
-        s = self.density_field.shape
-
-        for i in range(1, s[0]-1):
-            for j in range(1, s[1]-1):
-                vel = self.velocity_field[i, j]
-            
-                # pos back in time
-                # i and j are inverted for spacial coordinates
-                x = (j*self.dx+self.dx/2) - dt*vel[0]
-                y = (i*self.dy+self.dy/2) - dt*vel[1]
-
-                if x < 0:
-                    x = 0
-                if x > self.width:
-                    x = self.width
-                if y < 0:
-                    y = 0
-                if y > self.height:
-                    y = self.height
-                
-                sqX = (x-self.dx/2)/self.dx
-                sqY = (y-self.dy/2)/self.dy
-
-                # indices of the four cells back in time
-                i0 = int(sqY)
-                j0 = int(sqX)
-
-                kx = sqX - int(sqX)
-                ky = sqY - int(sqY)
-                
-                if i0 < 0:
-                    i0 = 0
-                if i0 > s[0]-2:
-                    i0 = s[0]-2
-                if j0 < 0:
-                    j0 = 0
-                if j0 > s[1]-2:
-                    j0 = s[1]-2
-
-                z1 = (1 - kx) * d0[i0, j0] + kx * d0[i0, j0+1]
-                z2 = (1 - kx) * d0[i0+1, j0] + kx * d0[i0+1, j0+1]
-                v = (1 - ky) * z1 + ky * z2
-
-                self.density_field[i, j] = v
-    
-        self.update_bnd(self.density_field, self.density_field)
-    
-    # velocity funcs
-    @ti.func
-    def add_forces(self, dt: ti.f32):
-        for i, j in self.velocity_field:
-            self.velocity_field[i, j][0] = self.external_forces[0] * dt
-            self.velocity_field[i, j][1] = self.external_forces[1] * dt
-
-    @ti.func
-    def difuse_vel(self, dt, x0):
-        s = self.velocity_field.shape
-        a = dt
-
-        for i in range(1, s[0]-1):
-            for j in range(1, s[1]-1):
-                v = (
+            f[i, 0] = [-f[i, 1][0], f[i, 1][1]]
+            f[i, s[1]-1] = [-f[i, s[1]-2][0], f[i, s[1]-2][1]]
+
+    @ti.kernel
+    def jacobi_sweep(self, x0: ti.template(), src: ti.template(), dst: ti.template(), a: ti.f64) -> ti.f64:
+        s = src.shape
+        self.total[None] = 0.0
+        for i, j in ti.ndrange((1, s[0]-1), (1, s[1]-1)):
+            v = ti.cast(
+                (
                     x0[i, j] + a *
                     (
-                        (x0[i-1, j] + x0[i+1, j] + x0[i, j-1] + x0[i, j+1])/(4.0)
+                        (src[i-1, j] + src[i+1, j] + src[i, j-1] + src[i, j+1])/(4.0)
                     )
-                ) / (1+a)
-                self.velocity_field[i, j] = v
-    
-    @ti.func
-    def difuse_vel_step(self, dt):
-        # solve system with 20 iterations
-        for _ in range(1):
-            for it in range(20):
-                self.difuse_vel(dt/20.0, self.velocity_field)
-                self.update_bnd_vel(self.velocity_field, self.velocity_field)
-    
-    @ti.func
-    def advect_vel(self, dt, d0):
-        s = self.velocity_field.shape
-
-        for i in range(1, s[0]-1):
-            for j in range(1, s[1]-1):
-                vel = self.velocity_field[i, j]
-
-                # pos back in time
-                # i and j are inverted for spacial coordinates
-                x = (j*self.dx+self.dx/2) - dt*vel[0]
-                y = (i*self.dy+self.dy/2) - dt*vel[1]
-
-                if x < 0:
-                    x = 0
-                if x > self.width:
-                    x = self.width
-                if y < 0:
-                    y = 0
-                if y > self.height:
-                    y = self.height
-
-                sqX = (x-self.dx/2)/self.dx
-                sqY = (y-self.dy/2)/self.dy
-                
-                # indices of the four cells back in time
-                i0 = int(sqY)
-                j0 = int(sqX)
-
-                kx = sqX - int(sqX)
-                ky = sqY - int(sqY)
-                
-                if i0 < 0:
-                    i0 = 0
-                if i0 > s[0]-2:
-                    i0 = s[0]-2
-                if j0 < 0:
-                    j0 = 0
-                if j0 > s[1]-2:
-                    j0 = s[1]-2
-
-                z1 = (1 - kx) * d0[i0, j0] + kx * d0[i0, j0+1]
-                z2 = (1 - kx) * d0[i0+1, j0] + kx * d0[i0+1, j0+1]
-                v = (1 - ky) * z1 + ky * z2
-                
-                self.velocity_field[i, j] = v
-                
-        self.update_bnd_vel(self.velocity_field, self.velocity_field)
-
-    @ti.func
-    def project(self, prev_vel):
-        s = self.velocity_field.shape
-
-        for i in range(1, s[0]-1):
-            for j in range(1, s[1]-1):
-                prev_vel[i, j][1] = ( 
-                    # divergence
-                    (self.velocity_field[i, j+1][0] - self.velocity_field[i, j-1][0]) / (-2.0*self.dx) + 
-                    (self.velocity_field[i+1, j][1] - self.velocity_field[i-1, j][1]) / (-2.0*self.dy)
-                )
-                prev_vel[i, j][0] = 0
-        self.update_bnd(prev_vel, prev_vel)
-        
-        # avoid parallel for in this case
-        for _ in range(1):
-            for it in range(20):
-                self.proj_solver(s, prev_vel, prev_vel)
-                self.update_bnd(prev_vel, prev_vel)
-    
-        for i in range(1, s[0]-1):
-            for j in range(1, s[1]-1):
-                # gradient
-                self.velocity_field[i, j][0] -= (prev_vel[i, j+1][0] - prev_vel[i, j-1][0]) / (2.0*self.dx)
-                self.velocity_field[i, j][1] -= (prev_vel[i+1, j][0] - prev_vel[i-1, j][0]) / (2.0*self.dy)
-        self.update_bnd_vel(self.velocity_field, self.velocity_field)
-
-    @ti.func
-    def proj_solver(self, shape, original: ti.template(), value):
-        for i in range(1, shape[0]-1):  
-            for j in range(1, shape[1]-1):
-                original[i, j][0] = ( 
-                    value[i-1, j][0] + 
-                    value[i+1, j][0] + 
-                    value[i, j-1][0] + 
-                    value[i, j+1][0] +
-                    value[i, j][1]
-                ) / 4.0
+                ) / (1+a),
+                ti.f32
+            )
+            self.total[None] += squared(src, v - src[i, j])
+            dst[i, j] = v
+        return self.total[None]
+
+    @ti.kernel
+    def pressure_sweep(self, src: ti.template(), dst: ti.template()) -> ti.f64:
+        s = src.shape
+        self.total[None] = 0.0
+        for i, j in ti.ndrange((1, s[0]-1), (1, s[1]-1)):
+            v = (
+                src[i-1, j] +
+                src[i+1, j] +
+                src[i, j-1] +
+                src[i, j+1] +
+                self.divergence[i, j]
+            ) / 4.0
+            self.total[None] += squared(src, v - src[i, j])
+            dst[i, j] = v
+        return self.total[None]
+
+    @ti.kernel
+    def semi_lagrangian(self, dt: ti.f64, dx: ti.f64, dy: ti.f64, width: ti.f64, height: ti.f64,
+               field: ti.template(), d0: ti.template(), velocity: ti.template()):
+        s = field.shape
+        for i, j in ti.ndrange((1, s[0]-1), (1, s[1]-1)):
+            vel = velocity[i, j]
+
+            # pos back in time
+            # i and j are inverted for spacial coordinates
+            x = (j*dx + dx/2) - dt*vel[0]
+            y = (i*dy + dy/2) - dt*vel[1]
+
+            x = ti.min(ti.max(x, 0.0), width)
+            y = ti.min(ti.max(y, 0.0), height)
+
+            sqX = (x-dx/2)/dx
+            sqY = (y-dy/2)/dy
+
+            # indices of the four cells back in time
+            # casts truncate towards zero, as int() in numba
+            i0 = ti.cast(sqY, ti.i32)
+            j0 = ti.cast(sqX, ti.i32)
+
+            kx = sqX - j0
+            ky = sqY - i0
+
+            i0 = ti.min(ti.max(i0, 0), s[0]-2)
+            j0 = ti.min(ti.max(j0, 0), s[1]-2)
+
+            z1 = (1 - kx) * d0[i0, j0] + kx * d0[i0, j0+1]
+            z2 = (1 - kx) * d0[i0+1, j0] + kx * d0[i0+1, j0+1]
+
+            # the arguments are f64, as the python floats numba receives
+            field[i, j] = ti.cast((1 - ky) * z1 + ky * z2, ti.f32)
+
+    @ti.kernel
+    def compute_divergence(self, dx: ti.f64, dy: ti.f64):
+        s = self.velocity.shape
+        for i, j in ti.ndrange((1, s[0]-1), (1, s[1]-1)):
+            self.divergence[i, j] = ti.cast(
+                (self.velocity[i, j+1][0] - self.velocity[i, j-1][0]) / (-2.0*dx) +
+                (self.velocity[i+1, j][1] - self.velocity[i-1, j][1]) / (-2.0*dy),
+                ti.f32
+            )
+
+    @ti.kernel
+    def subtract_gradient(self, dx: ti.f64, dy: ti.f64):
+        s = self.velocity.shape
+        for i, j in ti.ndrange((1, s[0]-1), (1, s[1]-1)):
+            self.velocity[i, j][0] -= ti.cast((self.pressure[i, j+1] - self.pressure[i, j-1]) / (2.0*dx), ti.f32)
+            self.velocity[i, j][1] -= ti.cast((self.pressure[i+1, j] - self.pressure[i-1, j]) / (2.0*dy), ti.f32)
@@ -0,0 +1,117 @@
+"""
+Time integration around Simulation.solve_fields.
+
+The frame time is split into substeps, so the cost per unit of simulated
+time stays bounded when frames hitch and no solve is wasted on dt = 0.
+
+Modes:
+    "cfl"    substeps from a CFL target, using the max velocity of the
+             field (one reduction pass per frame), frame dt limited to max_dt
+    "fixed"  steps of fixed_dt taken from an accumulator of frame time,
+             time left over after max_substeps steps is dropped
+    None     one solve with the frame dt, as before
+"""
+
+import math
+
+from numba import njit, prange
+
+from modules.layout import planes
+
+
+class TimeIntegrator:
+
+    def __init__(self, mode="cfl", cfl=1.0, fixed_dt=1/60, max_substeps=4, max_dt=1/15) -> None:
+        if mode not in ("cfl", "fixed", None):
+            raise ValueError(f"Unknown integrator mode: {mode}")
+
+        self.mode = mode
+
+        # cells a value may travel in one substep
+        self.cfl = cfl
+
+        # step of the fixed mode
+        self.fixed_dt = fixed_dt
+
+        # solves allowed per frame in both modes
+        self.max_substeps = max_substeps
+
+        # longest frame the cfl mode simulates, longer hitches are cut
+        self.max_dt = max_dt
+
+        # frame time not simulated yet in fixed mode
+        self.accumulator = 0.0
+
+        # last frame: substeps taken, their dt, the cfl number of each
+        # substep and the time dropped by the caps
+        self.substeps = 0
+        self.substep_dt = 0.0
+        self.courant = 0.0
+        self.dropped = 0.0
+
+    def advance(self, simulation, dt):
+        """Simulate a frame of dt seconds, returns the number of solves"""
+
+        if self.mode == "cfl":
+            steps = self.cfl_steps(simulation, dt)
+        elif self.mode == "fixed":
+            steps = self.fixed_steps(dt)
+        else:
+            steps = [dt] if dt > 0 else []
+
+        for step in steps:
+            simulation.solve_fields(step)
+
+        self.substeps = len(steps)
+        self.substep_dt = steps[0] if steps else 0.0
+        return self.substeps
+
+    def cfl_steps(self, simulation, dt):
+        self.dropped = max(dt - self.max_dt, 0.0)
+        dt = min(dt, self.max_dt)
+        if dt <= 0:
+            return []
+
+        u, v = max_velocity(*planes(simulation.velocity_field))
+        speed = max(u/simulation.dx, v/simulation.dy)
+
+        # cells travelled in the whole frame, over the cfl target
+        substeps = max(math.ceil(dt*speed/self.cfl), 1)
+        if substeps > self.max_substeps:
+            # keep the cfl target, simulate less of the frame
+            substeps = self.max_substeps
+            limit = substeps*self.cfl/speed
+            self.dropped += dt - limit
+            dt = limit
+
+        self.courant = dt/substeps*speed
+        return [dt/substeps]*substeps
+
+    def fixed_steps(self, dt):
+        self.accumulator += max(dt, 0.0)
+
+        substeps = min(int(self.accumulator // self.fixed_dt), self.max_substeps)
+        self.accumulator -= substeps*self.fixed_dt
+
+        # behind by more than a step after the cap, catching up would
+        # take even longer next frame
+        self.dropped = 0.0
+        if self.accumulator >= self.fixed_dt:
+            self.dropped = self.accumulator - self.accumulator % self.fixed_dt
+            self.accumulator -= self.dropped
+
+        return [self.fixed_dt]*substeps
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def max_velocity(u, v):
+    """Max of |u| and of |v| over the interior, in one pass"""
+
+    s = u.shape
+    u_max = 0.0
+    v_max = 0.0
+    for i in prange(1, s[0]-1):
+        for j in range(1, s[1]-1):
+            u_max = max(u_max, abs(u[i, j]))
+            v_max = max(v_max, abs(v[i, j]))
+    return u_max, v_max
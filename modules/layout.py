@@ -0,0 +1,46 @@
+"""
+Memory layouts of the velocity field.
+
+    "aos"  (N+2, N+2, 2), u and v of a cell next to each other
+    "soa"  (2, N+2, N+2), one contiguous plane for u and one for v
+
+The numba kernels take the u and v planes separately, so the same code runs
+on both: strided views for aos, unit stride planes for soa.
+"""
+
+
+LAYOUTS = ("aos", "soa")
+
+
+def velocity_shape(shape, layout="aos"):
+    """Shape of the velocity field for a density field of shape"""
+
+    if layout == "aos":
+        return tuple(shape) + (2,)
+    elif layout == "soa":
+        return (2,) + tuple(shape)
+    raise ValueError(f"Unknown layout: {layout}")
+
+
+def layout_of(velocity_field):
+    # grids have at least 1 cell plus 2 ghost cells per side, so the
+    # component axis is the only one of size 2
+    if velocity_field.shape[2] == 2:
+        return "aos"
+    return "soa"
+
+
+def planes(velocity_field):
+    """u and v planes of a velocity field, views on it"""
+
+    if layout_of(velocity_field) == "aos":
+        return velocity_field[:, :, 0], velocity_field[:, :, 1]
+    return velocity_field[0], velocity_field[1]
+
+
+def aos_view(velocity_field):
+    """(N+2, N+2, 2) view of a velocity field of any layout"""
+
+    if layout_of(velocity_field) == "aos":
+        return velocity_field
+    return velocity_field.transpose(1, 2, 0)
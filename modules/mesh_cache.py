@@ -0,0 +1,49 @@
+"""
+On-disk cache of the generated meshes.
+
+The vertex and index arrays only depend on the grid, each one is saved as
+a .npy file named after the grid the first time it is built and loaded on
+later launches. The names also carry FORMAT_VERSION, files of an older
+layout of the arrays are not loaded.
+"""
+
+import os
+
+import numpy as np
+
+
+# bumped whenever the vertex or index arrays of a grid change
+FORMAT_VERSION = 1
+
+# SMOKE_CACHE_DIR overrides it, read once when the module is imported
+cache_dir = os.environ.get(
+    "SMOKE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "smoke_simulation")
+)
+
+
+def cached(name, key, build):
+    """
+    Array saved as name for key (a tuple of numbers), build() creates it
+    when it is not on disk yet.
+    """
+
+    path = os.path.join(cache_dir, f"{name}_v{FORMAT_VERSION}_" + "_".join(str(k) for k in key) + ".npy")
+    try:
+        return np.load(path)
+    except (OSError, ValueError):
+        pass
+
+    array = build()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # written under another name first, a concurrent launch never
+        # reads a partial file
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp, path)
+    except OSError:
+        # a read-only home only loses the cache
+        pass
+    return array
@@ -0,0 +1,263 @@
+"""
+Geometric multigrid solver for the pressure projection.
+
+Solves the same system as jacobi_project, 4p - (sum of neighbours) = div,
+with the ghost cell (Neumann) boundaries of update_bnd. The residual is
+restricted to a grid with half the cells on each side, the error is solved
+there recursively and interpolated back, so the cost of each cycle stays
+proportional to the number of cells.
+
+Coarsening stops at the first level with an odd number of cells on a side,
+its last coarse cell would only cover one fine cell, which the transfers
+and the coarse operator do not model. The coarsest level is solved with the
+factorization of modules/direct.py when it is small, else (an odd grid
+that can not be coarsened, 257x257 for 514x514) with conjugate gradient.
+"""
+
+import numpy as np
+from numba import njit, prange
+
+from modules.boundaries import update_bnd
+
+
+# smoothing sweeps before and after the coarse correction
+smooth_sweeps = 2
+
+# coarsest grids up to this many cells are solved directly, larger ones
+# with MIC conjugate gradient down to coarse_tolerance of their rhs
+direct_cells = 256*256
+coarse_tolerance = 1e-6
+coarse_max_iter = 1000
+
+# weight of the damped jacobi smoother
+jacobi_weight = 0.8
+
+
+##### Exposed funcs #####
+def solve(pressure, divergence, levels=0, cycles=2, cycle="V", smoother="jacobi", tol_abs=0.0, tol_rel=0.0, hierarchy=None):
+    """
+    Solve for pressure in place, returns (cycles, rms residual).
+
+    pressure and divergence are 2D planes with ghost cells, as the
+    projection planes of the workspace used by solvers.project. Stops before
+    running all cycles once the rms residual is below tol_abs, or below
+    tol_rel times the rms of the divergence. A hierarchy from build_hierarchy on
+    the same planes can be passed to avoid allocating the coarse grids.
+    """
+
+    if cycle not in ("V", "F"):
+        raise ValueError(f"Unknown multigrid cycle: {cycle}")
+    if smoother not in ("jacobi", "gauss"):
+        raise ValueError(f"Unknown multigrid smoother: {smoother}")
+
+    if hierarchy is None:
+        hierarchy = build_hierarchy(pressure, divergence, levels)
+
+    # pure neumann problem, only has a solution if div sums to zero
+    remove_mean(divergence)
+
+    b_rms = rms(divergence)
+    res = residual_norm(pressure, divergence)
+    it = 0
+    while it < cycles and res > tol_abs and res > tol_rel*b_rms:
+        if cycle == "F":
+            f_cycle(hierarchy, 0, smoother)
+        else:
+            v_cycle(hierarchy, 0, smoother)
+
+        res = residual_norm(pressure, divergence)
+        it += 1
+
+    return it, res
+
+
+def build_hierarchy(pressure, divergence, levels=0):
+    """List of (pressure, rhs, residual, scratch) for each level, finest first"""
+
+    s = pressure.shape
+    hierarchy = [(
+        pressure,
+        divergence,
+        np.zeros(s, dtype=pressure.dtype),
+        np.zeros(s, dtype=pressure.dtype),
+    )]
+
+    rows, cols = s[0]-2, s[1]-2
+    while rows > 2 and cols > 2 and rows % 2 == 0 and cols % 2 == 0:
+        if levels and len(hierarchy) >= levels:
+            break
+
+        rows, cols = rows//2, cols//2
+        shape = (rows+2, cols+2)
+        hierarchy.append(tuple(np.zeros(shape, dtype=pressure.dtype) for _ in range(4)))
+
+    return hierarchy
+
+
+##### Cycles #####
+def v_cycle(hierarchy, level, smoother):
+    p, b, r, tmp = hierarchy[level]
+    h2 = 4.0**level
+
+    if level == len(hierarchy)-1:
+        coarse_solve(p, b, tmp, h2)
+        return
+
+    smooth(p, b, tmp, h2, smooth_sweeps, smoother)
+    coarse_correction(hierarchy, level, smoother, v_cycle)
+    smooth(p, b, tmp, h2, smooth_sweeps, smoother)
+
+
+def f_cycle(hierarchy, level, smoother):
+    p, b, r, tmp = hierarchy[level]
+    h2 = 4.0**level
+
+    if level == len(hierarchy)-1:
+        coarse_solve(p, b, tmp, h2)
+        return
+
+    smooth(p, b, tmp, h2, smooth_sweeps, smoother)
+    coarse_correction(hierarchy, level, smoother, f_cycle, v_cycle)
+    smooth(p, b, tmp, h2, smooth_sweeps, smoother)
+
+
+def coarse_correction(hierarchy, level, smoother, *cycles):
+    p, b, r, _ = hierarchy[level]
+    pc, bc, _, _ = hierarchy[level+1]
+
+    residual(p, b, r, 1.0/4.0**level)
+    restrict(r, bc)
+
+    # coarse grid solves for the error, starting from zero
+    pc.fill(0)
+    for cycle in cycles:
+        cycle(hierarchy, level+1, smoother)
+
+    prolong(pc, p)
+
+
+def coarse_solve(p, b, tmp, h2):
+    remove_mean(b)
+    s = p.shape
+
+    # imported here, both import this module
+    from modules import conjugate_gradient, direct
+
+    # 4p - (sum of neighbours) = h2*b
+    np.multiply(b, h2, out=tmp)
+    if (s[0]-2)*(s[1]-2) > direct_cells:
+        # too large to factorize, the cg buffers are only allocated here
+        conjugate_gradient.solve(p, tmp, 4.0, 1.0, 0.0, coarse_tolerance, coarse_max_iter, "mic")
+        return
+
+    # factorized once per grid size
+    matrix, lu = direct.pressure_factorization(s[0]-2, s[1]-2)
+    direct.solve(matrix, lu, p, tmp)
+
+
+def smooth(p, b, tmp, h2, sweeps, smoother):
+    if smoother == "gauss":
+        smooth_red_black(p, b, h2, sweeps)
+    else:
+        smooth_jacobi(p, b, tmp, h2, sweeps, jacobi_weight)
+
+
+##### Kernels #####
+@njit(parallel=True, nogil=True, cache=True)
+def smooth_jacobi(p, b, tmp, h2, sweeps, weight):
+    s = p.shape
+    for it in range(sweeps):
+        for i in prange(1, s[0]-1):
+            for j in range(1, s[1]-1):
+                tmp[i, j] = (1-weight)*p[i, j] + weight*(
+                    p[i-1, j] + p[i+1, j] + p[i, j-1] + p[i, j+1] + h2*b[i, j]
+                ) / 4.0
+
+        for i in prange(1, s[0]-1):
+            for j in range(1, s[1]-1):
+                p[i, j] = tmp[i, j]
+        update_bnd(p)
+
+@njit(parallel=True, nogil=True, cache=True)
+def smooth_red_black(p, b, h2, sweeps):
+    s = p.shape
+    for it in range(sweeps):
+        # cells with (i+j) even first, then odd ones
+        # each color only reads the other, so rows can run in parallel
+        for color in range(2):
+            for i in prange(1, s[0]-1):
+                for j in range(1 + (i+1+color) % 2, s[1]-1, 2):
+                    p[i, j] = (
+                        p[i-1, j] + p[i+1, j] + p[i, j-1] + p[i, j+1] + h2*b[i, j]
+                    ) / 4.0
+            update_bnd(p)
+
+@njit(parallel=True, nogil=True, cache=True)
+def residual(p, b, r, inv_h2):
+    s = p.shape
+    for i in prange(1, s[0]-1):
+        for j in range(1, s[1]-1):
+            r[i, j] = b[i, j] - (
+                4.0*p[i, j] - p[i-1, j] - p[i+1, j] - p[i, j-1] - p[i, j+1]
+            ) * inv_h2
+
+@njit(parallel=True, nogil=True, cache=True)
+def residual_norm(p, b):
+    # rms residual on the finest grid
+    s = p.shape
+    total = 0.0
+    for i in prange(1, s[0]-1):
+        for j in range(1, s[1]-1):
+            r = b[i, j] - (4.0*p[i, j] - p[i-1, j] - p[i+1, j] - p[i, j-1] - p[i, j+1])
+            total += r*r
+    return np.sqrt(total / ((s[0]-2)*(s[1]-2)))
+
+@njit(parallel=True, nogil=True, cache=True)
+def rms(b):
+    s = b.shape
+    total = 0.0
+    for i in prange(1, s[0]-1):
+        for j in range(1, s[1]-1):
+            total += b[i, j]*b[i, j]
+    return np.sqrt(total / ((s[0]-2)*(s[1]-2)))
+
+@njit(parallel=True, nogil=True, cache=True)
+def restrict(r, bc):
+    # average of the four fine cells under each coarse cell
+    sc = bc.shape
+    for I in prange(1, sc[0]-1):
+        for J in range(1, sc[1]-1):
+            bc[I, J] = 0.25*(
+                r[2*I-1, 2*J-1] + r[2*I-1, 2*J] + r[2*I, 2*J-1] + r[2*I, 2*J]
+            )
+
+@njit(parallel=True, nogil=True, cache=True)
+def prolong(pc, p):
+    # bilinear interpolation of the coarse error, added to the fine pressure
+    # ghost cells of pc must be up to date
+    s = p.shape
+    for i in prange(1, s[0]-1):
+        I = (i+1)//2
+        I2 = I-1 if i % 2 == 1 else I+1
+        for j in range(1, s[1]-1):
+            J = (j+1)//2
+            J2 = J-1 if j % 2 == 1 else J+1
+            p[i, j] += (
+                0.5625*pc[I, J] +
+                0.1875*(pc[I2, J] + pc[I, J2]) +
+                0.0625*pc[I2, J2]
+            )
+    update_bnd(p)
+
+@njit(parallel=True, nogil=True, cache=True)
+def remove_mean(b):
+    s = b.shape
+    total = 0.0
+    for i in prange(1, s[0]-1):
+        for j in range(1, s[1]-1):
+            total += b[i, j]
+    mean = total / ((s[0]-2)*(s[1]-2))
+
+    for i in prange(1, s[0]-1):
+        for j in range(1, s[1]-1):
+            b[i, j] -= mean
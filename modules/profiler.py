@@ -0,0 +1,85 @@
+"""
+Wall time of each stage of a frame, kept in fixed size ring buffers.
+
+Recording a sample is two perf_counter calls and one array write, so the
+profiler can stay on in production. The summary (mean, p95 and max over the
+last samples) is only computed when asked for, by the gui or a headless run.
+"""
+
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class Profiler:
+
+    def __init__(self, capacity=120) -> None:
+        # samples kept for each stage, older ones are overwritten
+        self.capacity = capacity
+        self.enabled = True
+
+        # stage -> ring buffer of seconds, and the samples written to it
+        self._samples = {}
+        self._counts = {}
+
+    def record(self, name, seconds):
+        """Add one sample of stage name"""
+
+        if not self.enabled:
+            return
+
+        samples = self._samples.get(name)
+        if samples is None:
+            self._counts[name] = 0
+            samples = self._samples[name] = np.zeros(self.capacity)
+
+        samples[self._counts[name] % self.capacity] = seconds
+        self._counts[name] += 1
+
+    @contextmanager
+    def stage(self, name):
+        """Time the body of a with block as stage name"""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def timed(self, name, func, *args):
+        """Call func(*args) as stage name, returns its result"""
+
+        start = time.perf_counter()
+        result = func(*args)
+        self.record(name, time.perf_counter() - start)
+        return result
+
+    def stats(self):
+        """
+        Summary of each stage over the samples in the buffer, in milliseconds:
+            {name: {"last", "mean", "p95", "max", "count"}}
+        stages in the order they were first recorded
+        """
+
+        summary = {}
+        # a list, stages may be added by another thread meanwhile
+        for name, samples in list(self._samples.items()):
+            count = self._counts[name]
+            if count == 0:
+                continue
+            values = samples[:min(count, self.capacity)]*1000
+            last = samples[(count-1) % self.capacity]*1000
+
+            summary[name] = {
+                "last": float(last),
+                "mean": float(values.mean()),
+                "p95": float(np.percentile(values, 95)),
+                "max": float(values.max()),
+                "count": count,
+            }
+        return summary
+
+    def reset(self):
+        self._samples.clear()
+        self._counts.clear()
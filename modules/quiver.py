@@ -1,4 +1,7 @@
 from glumpy import gl, gloo
+import numpy as np
+
+from modules.layout import aos_view
 
 
 vertex      = 'shaders/quiver/quiver.vert'
@@ -25,12 +28,16 @@ class Quiver:
         self.program["linewidth"] = 1.0
         self.program["iResolution"] = width, height
 
+        # persistent texture without ghost cells, updated in place
+        self.texture = np.zeros((side_count, side_count, 2), dtype=np.float32).view(gloo.TextureFloat2D)
+        self.program["velocities"] = self.texture
+
         self.update_velocities(velocities)
 
     def draw(self):
         self.program.draw(gl.GL_TRIANGLE_STRIP)
     
     def update_velocities(self, velocities):
-        # send without ghost cells
-        v = velocities[1:-1, 1:-1]
-        self.program["velocities"] = v.view(gloo.TextureFloat2D)
+        # send without ghost cells, copied straight into the texture memory
+        # (the texture is interleaved, soa planes are gathered here)
+        self.texture[...] = aos_view(velocities)[1:-1, 1:-1]
@@ -0,0 +1,488 @@
+"""
+Streaming recorder of the density (and velocity) frames of a simulation.
+
+The simulation thread only copies the fields into a snapshot buffer. A
+pool of threads quantizes and compresses the snapshots (numpy and zlib
+release the GIL) and a writer thread appends them in order to a chunked
+file. Snapshot buffers are a fixed pool, when all of them are waiting for
+the encoders or the disk, record blocks until one is free (or drops the
+frame with block=False), and the time spent there is counted in stats.
+
+Encoding of a field:
+    quantize   density as in modules/textures.py (float32, or uint16 and
+               uint8 clipped to [0, 1]), velocity as float32 or float16
+    delta      difference of the integer bits with the previous frame,
+               modulo 2**bits so it is lossless, a keyframe every few
+               frames is stored whole for random access
+    shuffle    the bytes of the values split into planes, the high bytes
+               of a delta are mostly zero and compress well
+    compress   zlib
+
+File layout:
+    magic     b"SMOKEREC", uint32 FORMAT_VERSION, uint32 length of the header
+    header    json: shape, format of each field, keyframe interval
+    chunks    b"CHNK", uint32 records, uint64 bytes, then the records:
+              uint32 frame, uint8 keyframe, per field uint32 bytes + data
+    index     (frame, offset of the record, keyframe) of every record
+    footer    uint64 offset of the index, b"SMOKEIDX"
+
+A file without footer (the run crashed) is read by scanning its chunks.
+"""
+
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from modules.layout import aos_view
+
+
+MAGIC = b"SMOKEREC"
+FORMAT_VERSION = 1
+
+DENSITY_FORMATS = ("float32", "uint16", "uint8")
+VELOCITY_FORMATS = ("float32", "float16")
+
+PREFIX = struct.Struct("<8sII")
+CHUNK = struct.Struct("<4sIQ")
+RECORD = struct.Struct("<IB")
+PAYLOAD = struct.Struct("<I")
+FOOTER = struct.Struct("<Q8s")
+
+INDEX = np.dtype([("frame", "<u4"), ("offset", "<u8"), ("key", "u1")])
+
+# integer type of the bits of each format, deltas are taken on these
+BITS = {"float32": np.uint32, "uint16": np.uint16, "uint8": np.uint8, "float16": np.uint16}
+
+
+##### Quantization #####
+def quantize(field, fmt, out):
+    """field as fmt written to out, the integer bits of the values"""
+
+    if fmt in ("uint16", "uint8"):
+        scale = float(np.iinfo(fmt).max)
+        scratch = np.clip(field, 0.0, 1.0)
+        np.multiply(scratch, scale, out=scratch)
+        np.rint(scratch, out=scratch)
+        out[...] = scratch
+    else:
+        out.view(fmt)[...] = field
+    return out
+
+
+def dequantize(bits, fmt):
+    """float32 values of the integer bits of fmt"""
+
+    if fmt in ("uint16", "uint8"):
+        return bits.astype(np.float32) / np.float32(np.iinfo(fmt).max)
+    return bits.view(fmt).astype(np.float32)
+
+
+def shuffle(bits):
+    # byte planes, the first bytes of all the values then the second ones...
+    return np.ascontiguousarray(bits.reshape(-1).view(np.uint8).reshape(-1, bits.itemsize).T)
+
+
+def unshuffle(data, dtype, shape):
+    itemsize = np.dtype(dtype).itemsize
+    planes = np.frombuffer(data, dtype=np.uint8).reshape(itemsize, -1)
+    return np.ascontiguousarray(planes.T).view(dtype).reshape(shape)
+
+
+##### Writing #####
+class Recorder:
+    """Writes frames to path, see the module docstring"""
+
+    def __init__(
+        self, path, density_format="uint16", velocity_format=None, keyframe=30, level=1,
+        workers=2, buffers=8, chunk_frames=32, block=True
+    ) -> None:
+        if density_format not in DENSITY_FORMATS:
+            raise ValueError(f"Unknown density format: {density_format}")
+        if velocity_format is not None and velocity_format not in VELOCITY_FORMATS:
+            raise ValueError(f"Unknown velocity format: {velocity_format}")
+        if buffers < 2:
+            # the previous snapshot stays in use until the next frame is encoded
+            raise ValueError(f"A recorder needs at least 2 buffers, got {buffers}")
+
+        # format of each recorded field
+        self.formats = {"density": density_format}
+        if velocity_format is not None:
+            self.formats["velocity"] = velocity_format
+
+        # frames between keyframes and zlib level
+        self.keyframe = keyframe
+        self.level = level
+        self.chunk_frames = chunk_frames
+
+        # wait for a free buffer when all are in flight, or drop the frame
+        self.block = block
+
+        self.path = path
+        self._file = open(path, "wb")
+        self._header_written = False
+
+        # snapshot buffers, allocated on the first frame, and the buffers
+        # free for the next frame
+        self._buffers = buffers
+        self._free = queue.Queue()
+        self._users = {}
+        self._users_lock = threading.Lock()
+
+        # snapshot of the previous frame, deltas are taken against it
+        self._previous = None
+        self.frames = 0
+
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="recorder")
+        self._pending = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self.run, name="recorder-writer", daemon=True)
+        self._writer.start()
+
+        # index of the records written
+        self._index = []
+
+        # error of a worker or the writer, raised by the next record
+        self.error = None
+
+        # backpressure and compression counters, see stats
+        self._stats_lock = threading.Lock()
+        self.counters = {
+            "recorded": 0, "written": 0, "dropped": 0, "stalls": 0, "stall_seconds": 0.0,
+            "max_in_flight": 0, "encode_seconds": 0.0, "write_seconds": 0.0, "raw_bytes": 0, "bytes": 0,
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---------- Simulation thread ----------
+    def record(self, simulation, frame=None):
+        """Snapshot the fields of simulation, returns False when the frame was dropped"""
+
+        if self.error is not None:
+            raise self.error
+
+        # without ghost cells, velocity as (N, N, 2)
+        fields = {"density": simulation.density_field[1:-1, 1:-1]}
+        if "velocity" in self.formats:
+            fields["velocity"] = aos_view(simulation.velocity_field)[1:-1, 1:-1]
+
+        if not self._header_written:
+            self.start(fields)
+
+        try:
+            snapshot = self._free.get_nowait()
+        except queue.Empty:
+            if not self.block:
+                self.count(dropped=1)
+                return False
+
+            start = time.perf_counter()
+            snapshot = self._free.get()
+            self.count(stalls=1, stall_seconds=time.perf_counter() - start)
+
+        for name, field in fields.items():
+            np.copyto(snapshot[name], field)
+
+        # keyframes do not need the previous frame
+        key = self.frames % self.keyframe == 0 or self._previous is None
+        previous = None if key else self._previous
+        with self._users_lock:
+            # used by the job of this frame and the one of the next frame,
+            # a keyframe releases the previous snapshot right away
+            self._users[id(snapshot)] = 2
+            if key and self._previous is not None:
+                self._release(self._previous)
+
+        frame = self.frames if frame is None else frame
+        future = self._pool.submit(self.encode, snapshot, previous, key)
+        self._pending.put((frame, key, future, snapshot, previous))
+        self._previous = snapshot
+        self.frames += 1
+
+        in_flight = self._buffers - self._free.qsize()
+        with self._stats_lock:
+            self.counters["recorded"] += 1
+            self.counters["max_in_flight"] = max(self.counters["max_in_flight"], in_flight)
+        return True
+
+    def close(self):
+        """Write the frames in flight, the index and the footer"""
+
+        if self._file is None:
+            return
+
+        self._pending.put(None)
+        self._writer.join()
+        self._pool.shutdown()
+
+        if self.error is None:
+            self.flush_chunk()
+            self.write_index()
+        self._file.close()
+        self._file = None
+        if self.error is not None:
+            raise self.error
+
+    def stats(self):
+        """
+        Counters of the recorder:
+            recorded, written, dropped   frames
+            in_flight, max_in_flight     snapshot buffers waiting for encoders or disk
+            stalls, stall_seconds        records that waited for a free buffer
+            encode_seconds, write_seconds
+            raw_bytes, bytes, ratio      of the quantized frames and the file
+        """
+
+        with self._stats_lock:
+            stats = dict(self.counters)
+        stats["in_flight"] = stats["recorded"] - stats["written"]
+        stats["ratio"] = stats["raw_bytes"] / stats["bytes"] if stats["bytes"] else 0.0
+        return stats
+
+    def start(self, fields):
+        # header and buffers from the shapes of the first frame
+        header = {
+            "fields": {
+                name: {"format": self.formats[name], "shape": list(field.shape)} for name, field in fields.items()
+            },
+            "keyframe": self.keyframe,
+        }
+        encoded = json.dumps(header).encode()
+        self._file.write(PREFIX.pack(MAGIC, FORMAT_VERSION, len(encoded)))
+        self._file.write(encoded)
+        self._header_written = True
+
+        for _ in range(self._buffers):
+            self._free.put({name: np.empty(field.shape, dtype=np.float32) for name, field in fields.items()})
+
+        self._chunk = []
+        self._chunk_bytes = 0
+
+    def count(self, **counters):
+        with self._stats_lock:
+            for name, value in counters.items():
+                self.counters[name] += value
+
+    def _release(self, snapshot):
+        # callers hold _users_lock
+        self._users[id(snapshot)] -= 1
+        if self._users[id(snapshot)] == 0:
+            del self._users[id(snapshot)]
+            self._free.put(snapshot)
+
+    # ---------- Workers ----------
+    def encode(self, snapshot, previous, key):
+        """Compressed payload of each field of a snapshot"""
+
+        start = time.perf_counter()
+        payloads = []
+        raw = 0
+        for name, fmt in self.formats.items():
+            bits = quantize(snapshot[name], fmt, np.empty(snapshot[name].shape, dtype=BITS[fmt]))
+            if not key:
+                # wraps around, decoding adds it back modulo 2**bits as well
+                bits -= quantize(previous[name], fmt, np.empty_like(bits))
+            raw += bits.nbytes
+            payloads.append(zlib.compress(shuffle(bits), self.level))
+
+        self.count(encode_seconds=time.perf_counter() - start, raw_bytes=raw)
+        return payloads
+
+    # ---------- Writer thread ----------
+    def run(self):
+        # records in the order of record, whatever order the workers finish in
+        while True:
+            job = self._pending.get()
+            if job is None:
+                break
+
+            frame, key, future, snapshot, previous = job
+            try:
+                payloads = future.result()
+                if self.error is None:
+                    start = time.perf_counter()
+                    self.add_record(frame, key, payloads)
+                    self.count(write_seconds=time.perf_counter() - start)
+            except Exception as e:
+                self.error = e
+            finally:
+                with self._users_lock:
+                    self._release(snapshot)
+                    if previous is not None:
+                        self._release(previous)
+                self.count(written=1)
+
+        # the last frame is not the previous one of any job
+        with self._users_lock:
+            if self._previous is not None and id(self._previous) in self._users:
+                self._release(self._previous)
+
+    def add_record(self, frame, key, payloads):
+        record = [RECORD.pack(frame, key)]
+        for payload in payloads:
+            record.append(PAYLOAD.pack(len(payload)))
+            record.append(payload)
+        record = b"".join(record)
+
+        # offset once the chunk header before it is written
+        self._chunk.append((frame, key, record))
+        self._chunk_bytes += len(record)
+        if len(self._chunk) >= self.chunk_frames:
+            self.flush_chunk()
+
+    def flush_chunk(self):
+        if not self._chunk:
+            return
+
+        f = self._file
+        f.write(CHUNK.pack(b"CHNK", len(self._chunk), self._chunk_bytes))
+        offset = f.tell()
+        for frame, key, record in self._chunk:
+            self._index.append((frame, offset, key))
+            offset += len(record)
+        f.write(b"".join(record for _, _, record in self._chunk))
+        f.flush()
+
+        self.count(bytes=CHUNK.size + self._chunk_bytes)
+        self._chunk = []
+        self._chunk_bytes = 0
+
+    def write_index(self):
+        f = self._file
+        if not self._header_written:
+            # no frame recorded, an empty recording
+            self.start({})
+        offset = f.tell()
+        f.write(np.array(self._index, dtype=INDEX).tobytes())
+        f.write(FOOTER.pack(offset, b"SMOKEIDX"))
+
+
+##### Reading #####
+class Recording:
+    """Random access to the frames of a recording, recording[i] is the density of the i-th frame"""
+
+    def __init__(self, path) -> None:
+        self.path = path
+        self._file = open(path, "rb")
+
+        magic, version, length = PREFIX.unpack(self._file.read(PREFIX.size))
+        if magic != MAGIC:
+            raise ValueError(f"Not a recording: {path}")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Recording format {version} of {path} is not supported, expected {FORMAT_VERSION}")
+
+        header = json.loads(self._file.read(length))
+        self.fields = {name: spec["format"] for name, spec in header["fields"].items()}
+        self.shapes = {name: tuple(spec["shape"]) for name, spec in header["fields"].items()}
+        self.keyframe = header["keyframe"]
+        self._data = PREFIX.size + length
+
+        self.index = self.read_index()
+
+        # quantized fields of the last decoded record, sequential reads
+        # decode one delta each
+        self._cached = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        return self.read(i)["density"]
+
+    @property
+    def frames(self):
+        """Frame number of each record"""
+
+        return self.index["frame"]
+
+    def close(self):
+        self._file.close()
+
+    def read(self, i):
+        """{field: float32 array} of the i-th record"""
+
+        if not -len(self) <= i < len(self):
+            raise IndexError(f"Record {i} of a recording of {len(self)}")
+        i %= len(self)
+
+        # from the cached record when it is on the way, else from the keyframe
+        start = i
+        while not self.index["key"][start]:
+            start -= 1
+        if self._cached is not None and start <= self._cached[0] <= i:
+            start, bits = self._cached[0] + 1, self._cached[1]
+        else:
+            bits = None
+
+        for j in range(start, i+1):
+            payloads = self.read_record(j)
+            if self.index["key"][j]:
+                bits = payloads
+            else:
+                for name in bits:
+                    bits[name] = bits[name] + payloads[name]
+
+        self._cached = (i, bits)
+        return {name: dequantize(bits[name], fmt) for name, fmt in self.fields.items()}
+
+    def read_record(self, j):
+        # integer bits (or deltas) of each field of the j-th record
+        f = self._file
+        f.seek(int(self.index["offset"][j]) + RECORD.size)
+        payloads = {}
+        for name, fmt in self.fields.items():
+            length, = PAYLOAD.unpack(f.read(PAYLOAD.size))
+            payloads[name] = unshuffle(zlib.decompress(f.read(length)), BITS[fmt], self.shapes[name])
+        return payloads
+
+    def read_index(self):
+        f = self._file
+        size = f.seek(0, os.SEEK_END)
+        if size >= self._data + FOOTER.size:
+            f.seek(size - FOOTER.size)
+            offset, magic = FOOTER.unpack(f.read(FOOTER.size))
+            if magic == b"SMOKEIDX":
+                f.seek(offset)
+                return np.frombuffer(f.read(size - FOOTER.size - offset), dtype=INDEX)
+        return self.scan(size)
+
+    def scan(self, size):
+        """Index of a recording without footer, from its chunk headers"""
+
+        f = self._file
+        index = []
+        position = self._data
+        while position + CHUNK.size <= size:
+            f.seek(position)
+            tag, count, nbytes = CHUNK.unpack(f.read(CHUNK.size))
+            if tag != b"CHNK" or position + CHUNK.size + nbytes > size:
+                # cut while being written
+                break
+
+            offset = position + CHUNK.size
+            for _ in range(count):
+                f.seek(offset)
+                frame, key = RECORD.unpack(f.read(RECORD.size))
+                index.append((frame, offset, key))
+                offset += RECORD.size
+                for _ in self.fields:
+                    length, = PAYLOAD.unpack(f.read(PAYLOAD.size))
+                    f.seek(length, os.SEEK_CUR)
+                    offset += PAYLOAD.size + length
+            position += CHUNK.size + nbytes
+        return np.array(index, dtype=INDEX)
@@ -0,0 +1,110 @@
+"""
+Simulation state without any rendering.
+
+Holds the fields and grid spacing used by the solvers, so a simulation
+can run without an OpenGL context (e.g. on headless render nodes).
+"""
+
+import numpy as np
+
+from modules import backends
+from modules.config import SolverConfig
+from modules.integrator import TimeIntegrator
+from modules.layout import aos_view, velocity_shape
+
+
+class Simulation:
+
+    def __init__(self, width, height, cell_count, backend="numba", config=None) -> None:
+        self.cell_count = cell_count
+        self.width = width
+        self.height = height
+
+        self.dx = width/cell_count
+        self.dy = height/cell_count
+
+        # solver settings of this simulation only
+        self.config = config if config is not None else SolverConfig()
+
+        # ghost cells are used, so each dimension is increased by 2
+        # (N+2, N+2, 2) or (2, N+2, N+2) depending on config.layout
+        shape = (cell_count+2, cell_count+2)
+        self.velocity_field = np.zeros(shape=velocity_shape(shape, self.config.layout), dtype=np.float32)
+
+        # density field of smoke
+        self.density_field  = np.zeros(shape=shape, dtype=np.float32)
+
+        # pressure of the last projection, seeds the next one
+        self.pressure_field = np.zeros(shape=shape, dtype=np.float32)
+        self.warm_start = True
+
+        # numba, taichi or numpy, see modules/backends.py
+        self.backend = backends.create(backend, self.density_field.shape, self.config)
+
+        # wall time of each stage of the last frames, see modules/profiler.py
+        self.profiler = self.backend.profiler
+
+        # splits frame time into substeps for advance
+        self.integrator = TimeIntegrator()
+
+        # (iterations, final residual) of each linear solve in the last step
+        self.solve_stats = {}
+
+    def solve_fields(self, dt):
+        """Call solver for the fields"""
+
+        with self.profiler.stage("solve_fields"):
+            self.solve_stats = self.backend.solve_fields(
+                dt,
+                self.dx,
+                self.dy,
+                self.width,
+                self.height,
+                self.density_field,
+                self.velocity_field,
+                self.pressure_field if self.warm_start else None
+            )
+
+    def warm_up(self, cells=8):
+        """
+        Compile the kernels of this backend and config before the first
+        frame, by stepping a small grid, the fields here are not touched.
+
+        The numba kernels are cached on disk (cache=True), after the first
+        launch this only loads them.
+        """
+
+        small = Simulation(self.width, self.height, cells, self.backend.name, self.config)
+        try:
+            small.add_density(cells//2, cells//2, 1)
+            small.add_velocity(cells//2, cells//2, 1, 1.0, 1.0)
+            small.integrator = TimeIntegrator(self.integrator.mode)
+            small.advance(1/60)
+        finally:
+            # strips starts worker processes and a shared block of its own
+            small.backend.close()
+
+    def advance(self, dt):
+        """Simulate a frame of dt seconds in substeps, returns the number of solves"""
+
+        return self.integrator.advance(self, dt)
+
+    def clamp_cell(self, row, col, radius):
+        """Keep a square of side 2*radius around (row, col) inside the grid"""
+
+        last = self.cell_count - 1
+        row = min(max(row, radius), last - radius)
+        col = min(max(col, radius), last - radius)
+        return row, col
+
+    def add_density(self, row, col, radius, value=1.0):
+        """Set density on a square around (row, col)"""
+
+        row, col = self.clamp_cell(row, col, radius)
+        self.density_field[row-radius:row+radius, col-radius:col+radius] = value
+
+    def add_velocity(self, row, col, radius, u, v):
+        """Add velocity (u, v) on a square around (row, col)"""
+
+        row, col = self.clamp_cell(row, col, radius)
+        aos_view(self.velocity_field)[row-radius:row+radius, col-radius:col+radius] += [u, v]
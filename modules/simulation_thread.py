@@ -0,0 +1,134 @@
+"""
+Simulation stepped on a background thread.
+
+The njit kernels release the GIL (nogil=True), so the solver runs on its own
+cores while the render thread draws. After each step the fields are copied
+into the back buffer and the buffers are swapped under a lock; the renderer
+reads the front buffer under the same lock, so it never sees half a step.
+
+Inputs from other threads (the mouse) are queued and applied by the
+simulation thread between steps.
+"""
+
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class SimulationThread:
+
+    def __init__(self, simulation, dt=None, max_dt=1/30) -> None:
+        self.simulation = simulation
+
+        # frame time passed to simulation.advance, fixed and paced to the
+        # wall clock, or None for the wall time since the previous frame,
+        # limited to max_dt
+        self.dt = dt
+        self.max_dt = max_dt
+
+        # (name of a simulation method, args) to call between steps
+        self.commands = queue.SimpleQueue()
+
+        # front buffer is read by the renderer, back buffer written by publish
+        self._buffers = [
+            (simulation.density_field.copy(), simulation.velocity_field.copy())
+            for _ in range(2)
+        ]
+        self._front = 0
+        self._lock = threading.Lock()
+
+        self._stop = threading.Event()
+        self._thread = None
+
+        # steps done since start
+        self.steps = 0
+
+    # ---------- Exposed funcs ----------
+    def start(self):
+        if self.running:
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="simulation", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Ask the thread to stop after the current step and wait for it"""
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @contextmanager
+    def front(self):
+        """(density, velocity) of the last published step, only valid inside the with block"""
+
+        with self._lock:
+            yield self._buffers[self._front]
+
+    def submit(self, name, *args):
+        """Call simulation.name(*args) on the simulation thread before the next step"""
+
+        self.commands.put((name, args))
+
+    def add_density(self, row, col, radius, value=1.0):
+        self.submit("add_density", row, col, radius, value)
+
+    def add_velocity(self, row, col, radius, u, v):
+        self.submit("add_velocity", row, col, radius, u, v)
+
+    # ---------- Simulation thread ----------
+    def run(self):
+        last = time.perf_counter()
+        while not self._stop.is_set():
+            self.apply_commands()
+
+            now = time.perf_counter()
+            if self.dt is None:
+                dt = min(now - last, self.max_dt)
+            else:
+                dt = self.dt
+            last = now
+
+            if self.simulation.advance(dt) == 0:
+                # not enough time for a step yet, e.g. fixed mode of the integrator
+                self._stop.wait(0.001)
+                continue
+
+            self.publish()
+            self.steps += 1
+
+            # a fixed step should not run ahead of real time
+            if self.dt is not None:
+                remaining = self.dt - (time.perf_counter() - now)
+                if remaining > 0:
+                    self._stop.wait(remaining)
+
+    def apply_commands(self):
+        while True:
+            try:
+                name, args = self.commands.get_nowait()
+            except queue.Empty:
+                return
+            getattr(self.simulation, name)(*args)
+
+    def publish(self):
+        """Copy the fields into the back buffer and make it the front one"""
+
+        back = 1 - self._front
+        density, velocity = self._buffers[back]
+
+        # the renderer only reads the front buffer, no lock needed to write here
+        np.copyto(density, self.simulation.density_field)
+        np.copyto(velocity, self.simulation.velocity_field)
+
+        with self._lock:
+            self._front = back
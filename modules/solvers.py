@@ -4,274 +4,613 @@ Implementation of functions to solve the fields.
 Using numba for performance.
 """
 
+import numpy as np
 from numba import njit, prange
 
+from modules import blocking, conjugate_gradient, direct, multigrid, spectral
+from modules.backends import Backend
+from modules.boundaries import update_bnd, update_bnd_vel
+from modules.layout import layout_of, planes
+from modules.tiles import copy_tiles, rms_tiles, tile_cells
+from modules.workspace import Workspace
 
-# number of solver iterations
-n_iter = 25
 
-# which solver
-solver_gauss = False
+##### Exposed funcs #####
+class NumbaBackend(Backend):
+    """Backend of the njit kernels of this module, the settings are in config"""
+
+    name = "numba"
+
+    def __init__(self, shape, config=None, workspace=None) -> None:
+        super().__init__(shape, config)
+
+        # buffers reused by every solver stage
+        if workspace is None:
+            workspace = Workspace(self.shape, layout=self.config.layout)
+        self.workspace = workspace
+
+        # active tiles of the current step, set by track_active
+        self.tiles = None
+
+    def advect(self, dt, dx, dy, width, height, field, velocity_field):
+        tiles = self.active()
+        if field.ndim == 3:
+            # velocity moves itself, the snapshot is taken by advect_vel
+            args = (dt, dx, dy, width, height, *planes(field), *planes(self.workspace.velocity0))
+            if tiles is None:
+                advect_vel(*args)
+            else:
+                advect_vel_tiles(*args, tiles.active, tiles.halo, tiles.tile)
+        else:
+            args = (dt, dx, dy, width, height, field, *planes(velocity_field), self.workspace.density0)
+            if tiles is None:
+                advect(*args)
+            else:
+                advect_tiles(*args, tiles.active, tiles.halo, tiles.tile)
+
+    def advect_fused(self, dt, dx, dy, width, height, density_field, velocity_field):
+        tiles = self.active()
+        args = (
+            dt, dx, dy, width, height, density_field, *planes(velocity_field),
+            self.workspace.density0, *planes(self.workspace.velocity0)
+        )
+        if tiles is None:
+            advect_fused(*args)
+        else:
+            advect_fused_tiles(*args, tiles.active, tiles.halo, tiles.tile)
+
+    def diffuse(self, dt, field, a_mod):
+        if field.ndim == 3:
+            x0, tmp = self.workspace.velocity0, self.workspace.velocity_tmp
+        else:
+            x0, tmp = self.workspace.density0, self.workspace.density_tmp
+        return difuse(dt, field, a_mod, x0, tmp, self.workspace, self.config, self.active())
+
+    def project(self, dx, dy, velocity_field, pressure_field=None):
+        return project(dx, dy, velocity_field, self.workspace, pressure_field, self.config)
+
+    def boundaries(self, field):
+        if field.ndim == 3:
+            update_bnd_vel(*planes(field))
+        else:
+            update_bnd(field)
+
+    def track_active(self, dt, dx, dy, density_field, velocity_field):
+        self.tiles = self.workspace.active_tiles(self.config.tile_size)
+        self.tiles.update(
+            dt, dx, dy, density_field, *planes(velocity_field), self.config.active_threshold, self.config.active_velocity
+        )
+
+    def active(self):
+        """Active tiles for the stages, None when every cell is swept"""
+
+        if self.config.active_tiles and self.tiles is not None:
+            return self.tiles
+        return None
+
+
+def solve_fields(dt, dx, dy, width, height, density_field, velocity_field, workspace=None, pressure_field=None, config=None):
+    """One step with the numba backend, returns the stats of each linear solve"""
+
+    # without a workspace the buffers are allocated on every call
+    backend = NumbaBackend(density_field.shape, config, workspace)
+    return backend.solve_fields(dt, dx, dy, width, height, density_field, velocity_field, pressure_field)
+
+
+def components(field):
+    """View of a field with the components on the last axis, (N+2, N+2, c)"""
+
+    if field.ndim == 2:
+        return field[:, :, np.newaxis]
+    return field
+
+
+def difuse(dt, field, a_mod, x0, tmp, workspace, config, tiles=None):
+    """
+    Implicit diffusion of every component of field, returns (iterations, residual).
+
+    x0 and tmp are workspace buffers shaped like field. With tiles (see
+    modules/tiles.py) jacobi only sweeps the active ones, the other solvers
+    always solve the whole grid.
+    """
+
+    if field.ndim == 3 and layout_of(field) == "soa":
+        # one solve per contiguous plane
+        stats = [difuse(dt, field[c], a_mod, x0[c], tmp[c], workspace, config, tiles) for c in range(2)]
+        return max(it for it, _ in stats), max(res for _, res in stats)
+
+    field = components(field)
+    solver = config.diffusion_solver()
+    if solver == "direct":
+        stats = [direct.solve_diffusion(field[:, :, c], dt, a_mod) for c in range(field.shape[2])]
+        return 1, max(res for _, res in stats)
+    elif solver == "cg":
+        stats = [
+            conjugate_gradient.solve_diffusion(
+                field[:, :, c], dt*a_mod, config.tolerance_abs, config.tolerance_rel, config.cg_max_iter,
+                config.cg_preconditioner, workspace.cg_buffers()
+            )
+            for c in range(field.shape[2])
+        ]
+        return max(it for it, _ in stats), max(res for _, res in stats)
+    elif solver == "gauss":
+        return gauss_siedel(
+            field, components(x0), dt, a_mod, config.sor_omega, config.n_iter, config.tolerance_abs, config.tolerance_rel
+        )
+    elif tiles is not None:
+        return jacobi_tiles(
+            field, components(x0), components(tmp), dt, a_mod, config.n_iter, config.tolerance_abs, config.tolerance_rel,
+            tiles.active, tiles.halo, tiles.tile
+        )
+    elif config.temporal_blocking:
+        return blocking.jacobi(
+            field, components(x0), components(tmp), dt, a_mod, config.n_iter, config.tolerance_abs, config.tolerance_rel,
+            workspace.blocking_buffers(
+                field.shape[2], blocking.block_size(config, field.shape[2], field.itemsize), config.block_steps
+            )
+        )
+    else:
+        return jacobi(
+            field, components(x0), components(tmp), dt, a_mod, config.n_iter, config.tolerance_abs, config.tolerance_rel
+        )
 
 
-##### Exposed funcs #####
-def solve_fields(dt, dx, dy, width, height, density_field, velocity_field):
-    vel_step(dt, dx, dy, width, height, velocity_field)
-    dens_step(dt, dx, dy, width, height, density_field, velocity_field)
-
-
-def dens_step(dt, dx, dy, width, height, density_field, velocity_field):
-    difuse_step(dt, density_field)
-    advect(dt, dx, dy, width, height, density_field, velocity_field)
-
-
-def vel_step(dt, dx, dy, width, height, velocity_field):
-    # add forces is the mouse in our case
-    # self.add_forces(dt)
-    # two projections increase stability
-    difuse_vel_step(dt, velocity_field)
-    project(dx, dy, velocity_field)
-    advect_vel(dt, dx, dy, width, height, velocity_field)
-    project(dx, dy, velocity_field)
-
-
-##### Boundaries funcs #####
-@njit
-def update_bnd(original_field):
-    s = original_field.shape
-    value_field = original_field.copy()
-    
-    # rows
-    original_field[0, :] = value_field[1, :]
-    original_field[s[0]-1, :] = value_field[s[0]-2, :]
-    
-    # cols
-    original_field[:, 0] = value_field[:, 1]
-    original_field[:, s[1]-1] = value_field[:, s[1]-2]
-
-@njit(parallel=True)
-def update_bnd_vel(original_field):
-    s = original_field.shape
-    value_field = original_field.copy()
-    
-    # rows
-    for i in prange(s[1]):
-        original_field[0, i] = [value_field[1, i, 0], -value_field[1, i, 1]]
-        original_field[s[0]-1, i] = [value_field[s[0]-2, i, 0], -value_field[s[0]-2, i, 1]]
-    
-    # cols
+@njit(parallel=True, nogil=True, cache=True)
+def copy_field(src, dst):
+    s = src.shape
     for i in prange(s[0]):
-        original_field[i, 0] = [-value_field[i, 1, 0], value_field[i, 1, 1]]
-        original_field[i, s[1]-1] = [-value_field[i, s[1]-2, 0], value_field[i, s[1]-2, 1]]
+        for j in range(s[1]):
+            dst[i, j] = src[i, j]
 
 
-###### density funcs #####
-def difuse_step(dt, density_field):
-    # solve system with n iterations
-    if solver_gauss:
-        gauss_siedel(density_field, dt, 2.0)
-    else:
-        jacobi(density_field, dt, 2.0)
+###### advection #####
+@njit(nogil=True, cache=True)
+def trace(i, j, u, v, dt, dx, dy, width, height, s):
+    """Cell (i0, j0) and weights (kx, ky) to interpolate at the position of (i, j) dt back in time"""
+
+    # pos back in time
+    # i and j are inverted for spacial coordinates
+    x = (j*dx + dx/2) - dt*u
+    y = (i*dy + dy/2) - dt*v
+
+    if x < 0:
+        x = 0
+    if x > width:
+        x = width
+    if y < 0:
+        y = 0
+    if y > height:
+        y = height
 
-@njit(parallel=True)
-def advect(dt, dx, dy, width, height, density_field, velocity_field):
+    sqX = (x-dx/2)/dx
+    sqY = (y-dy/2)/dy
+
+    # indices of the four cells back in time
+    i0 = int(sqY)
+    j0 = int(sqX)
+
+    kx = sqX - int(sqX)
+    ky = sqY - int(sqY)
+
+    if i0 < 0:
+        i0 = 0
+    if i0 > s[0]-2:
+        i0 = s[0]-2
+    if j0 < 0:
+        j0 = 0
+    if j0 > s[1]-2:
+        j0 = s[1]-2
+
+    return i0, j0, kx, ky
+
+
+@njit(nogil=True, cache=True)
+def interpolate(d0, i0, j0, kx, ky):
+    z1 = (1 - kx) * d0[i0, j0] + kx * d0[i0, j0+1]
+    z2 = (1 - kx) * d0[i0+1, j0] + kx * d0[i0+1, j0+1]
+    return (1 - ky) * z1 + ky * z2
+
+
+###### density funcs #####
+@njit(parallel=True, nogil=True, cache=True)
+def advect(dt, dx, dy, width, height, density_field, u, v, d0):
+    # d0 is a workspace buffer for the field before advection
     s = density_field.shape
-    d0 = density_field.copy()
+    copy_field(density_field, d0)
 
     for i in prange(1, s[0]-1):
         for j in range(1, s[1]-1):
-            vel = velocity_field[i, j]
-        
-            # pos back in time
-            # i and j are inverted for spacial coordinates
-            x = (j*dx + dx/2) - dt*vel[0]
-            y = (i*dy + dy/2) - dt*vel[1]
-
-            if x < 0:
-                x = 0
-            if x > width:
-                x = width
-            if y < 0:
-                y = 0
-            if y > height:
-                y = height
-            
-            sqX = (x-dx/2)/dx
-            sqY = (y-dy/2)/dy
-
-            # indices of the four cells back in time
-            i0 = int(sqY)
-            j0 = int(sqX)
-
-            kx = sqX - int(sqX)
-            ky = sqY - int(sqY)
-            
-            if i0 < 0:
-                i0 = 0
-            if i0 > s[0]-2:
-                i0 = s[0]-2
-            if j0 < 0:
-                j0 = 0
-            if j0 > s[1]-2:
-                j0 = s[1]-2
-
-            z1 = (1 - kx) * d0[i0, j0] + kx * d0[i0, j0+1]
-            z2 = (1 - kx) * d0[i0+1, j0] + kx * d0[i0+1, j0+1]
-
-            density_field[i, j] = (1 - ky) * z1 + ky * z2
+            i0, j0, kx, ky = trace(i, j, u[i, j], v[i, j], dt, dx, dy, width, height, s)
+            density_field[i, j] = interpolate(d0, i0, j0, kx, ky)
 
     update_bnd(density_field)
 
 
 ##### velocity funcs #####
-def difuse_vel_step(dt, velocity_field):
-    # solve system with n iterations
-    if solver_gauss:
-        gauss_siedel(velocity_field, dt)
-    else:
-        jacobi(velocity_field, dt)
-
-@njit(parallel=True)
-def advect_vel(dt, dx, dy, width, height, velocity_field):
-    s = velocity_field.shape
-    d0 = velocity_field.copy()
+@njit(parallel=True, nogil=True, cache=True)
+def advect_vel(dt, dx, dy, width, height, u, v, u0, v0):
+    # u0 and v0 are workspace planes for the field before advection
+    s = u.shape
+    copy_field(u, u0)
+    copy_field(v, v0)
 
     for i in prange(1, s[0]-1):
         for j in range(1, s[1]-1):
-            vel = velocity_field[i, j]
-
-            # pos back in time
-            # i and j are inverted for spacial coordinates
-            x = (j*dx + dx/2) - dt*vel[0]
-            y = (i*dy + dy/2) - dt*vel[1]
-
-            if x < 0:
-                x = 0
-            if x > width:
-                x = width
-            if y < 0:
-                y = 0
-            if y > height:
-                y = height
-
-            sqX = (x-dx/2)/dx
-            sqY = (y-dy/2)/dy
-            
-            # indices of the four cells back in time
-            i0 = int(sqY)
-            j0 = int(sqX)
-
-            kx = sqX - int(sqX)
-            ky = sqY - int(sqY)
-            
-            if i0 < 0:
-                i0 = 0
-            if i0 > s[0]-2:
-                i0 = s[0]-2
-            if j0 < 0:
-                j0 = 0
-            if j0 > s[1]-2:
-                j0 = s[1]-2
-
-            z1 = (1 - kx) * d0[i0, j0] + kx * d0[i0, j0+1]
-            z2 = (1 - kx) * d0[i0+1, j0] + kx * d0[i0+1, j0+1]
-            
-            velocity_field[i, j] = (1 - ky) * z1 + ky * z2
-            
-    update_bnd_vel(velocity_field)
-
-@njit(parallel=True)
-def project(dx, dy, velocity_field):
-    s = velocity_field.shape
-    prev_vel = velocity_field.copy()
+            i0, j0, kx, ky = trace(i, j, u0[i, j], v0[i, j], dt, dx, dy, width, height, s)
+            u[i, j] = interpolate(u0, i0, j0, kx, ky)
+            v[i, j] = interpolate(v0, i0, j0, kx, ky)
+
+    update_bnd_vel(u, v)
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def advect_fused(dt, dx, dy, width, height, density_field, u, v, d0, u0, v0):
+    """
+    Density and velocity along the same velocity in one pass, each cell is
+    traced once. d0, u0 and v0 are workspace buffers for the fields before.
+    """
+
+    s = density_field.shape
+    copy_field(density_field, d0)
+    copy_field(u, u0)
+    copy_field(v, v0)
 
     for i in prange(1, s[0]-1):
         for j in range(1, s[1]-1):
-            prev_vel[i, j][1] = ( 
-                # divergence
-                (velocity_field[i, j+1, 0] - velocity_field[i, j-1, 0]) / (-2.0*dx) + 
-                (velocity_field[i+1, j, 1] - velocity_field[i-1, j, 1]) / (-2.0*dy)
-            )
-            prev_vel[i, j][0] = 0
-    update_bnd(prev_vel)
-    
+            i0, j0, kx, ky = trace(i, j, u0[i, j], v0[i, j], dt, dx, dy, width, height, s)
+
+            density_field[i, j] = interpolate(d0, i0, j0, kx, ky)
+            u[i, j] = interpolate(u0, i0, j0, kx, ky)
+            v[i, j] = interpolate(v0, i0, j0, kx, ky)
+
+    update_bnd(density_field)
+    update_bnd_vel(u, v)
+
+
+###### active tiles #####
+# the advection kernels above over the active tiles only, cells outside
+# them keep their values. The snapshots are refreshed on the halo tiles,
+# which hold every cell the backtraces of the active tiles can reach.
+@njit(parallel=True, nogil=True, cache=True)
+def advect_tiles(dt, dx, dy, width, height, density_field, u, v, d0, active, halo, tile):
+    s = density_field.shape
+    copy_tiles(density_field, d0, halo, tile)
+    update_bnd(d0)
+
+    for t in prange(active.shape[0]):
+        i_start = 1 + active[t, 0]*tile
+        j_start = 1 + active[t, 1]*tile
+        for i in range(i_start, min(i_start + tile, s[0]-1)):
+            for j in range(j_start, min(j_start + tile, s[1]-1)):
+                i0, j0, kx, ky = trace(i, j, u[i, j], v[i, j], dt, dx, dy, width, height, s)
+                density_field[i, j] = interpolate(d0, i0, j0, kx, ky)
+
+    update_bnd(density_field)
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def advect_vel_tiles(dt, dx, dy, width, height, u, v, u0, v0, active, halo, tile):
+    s = u.shape
+    copy_tiles(u, u0, halo, tile)
+    copy_tiles(v, v0, halo, tile)
+    update_bnd_vel(u0, v0)
+
+    for t in prange(active.shape[0]):
+        i_start = 1 + active[t, 0]*tile
+        j_start = 1 + active[t, 1]*tile
+        for i in range(i_start, min(i_start + tile, s[0]-1)):
+            for j in range(j_start, min(j_start + tile, s[1]-1)):
+                i0, j0, kx, ky = trace(i, j, u0[i, j], v0[i, j], dt, dx, dy, width, height, s)
+                u[i, j] = interpolate(u0, i0, j0, kx, ky)
+                v[i, j] = interpolate(v0, i0, j0, kx, ky)
+
+    update_bnd_vel(u, v)
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def advect_fused_tiles(dt, dx, dy, width, height, density_field, u, v, d0, u0, v0, active, halo, tile):
+    s = density_field.shape
+    copy_tiles(density_field, d0, halo, tile)
+    copy_tiles(u, u0, halo, tile)
+    copy_tiles(v, v0, halo, tile)
+    update_bnd(d0)
+    update_bnd_vel(u0, v0)
+
+    for t in prange(active.shape[0]):
+        i_start = 1 + active[t, 0]*tile
+        j_start = 1 + active[t, 1]*tile
+        for i in range(i_start, min(i_start + tile, s[0]-1)):
+            for j in range(j_start, min(j_start + tile, s[1]-1)):
+                i0, j0, kx, ky = trace(i, j, u0[i, j], v0[i, j], dt, dx, dy, width, height, s)
+
+                density_field[i, j] = interpolate(d0, i0, j0, kx, ky)
+                u[i, j] = interpolate(u0, i0, j0, kx, ky)
+                v[i, j] = interpolate(v0, i0, j0, kx, ky)
+
+    update_bnd(density_field)
+    update_bnd_vel(u, v)
+
+def project(dx, dy, velocity_field, workspace, pressure_field, config):
+    # pressure_field, when given, is the initial guess and receives the solution
+    # pressure changes little between calls, so the solve starts close to it
+    p, div = workspace.pressure, workspace.divergence
+    u, v = planes(velocity_field)
+    divergence(dx, dy, u, v, p, div)
+    if pressure_field is not None:
+        copy_field(pressure_field, p)
+
     # solve div system
-    if solver_gauss:
-        gauss_siedel_project(prev_vel)
+    solver = config.projection_solver()
+    tol_abs, tol_rel = config.tolerance_abs, config.tolerance_rel
+    if solver == "spectral":
+        stats = spectral.solve(p, div)
+    elif solver == "direct":
+        stats = direct.solve_pressure(p, div)
+    elif solver == "multigrid":
+        stats = multigrid.solve(
+            p, div,
+            config.mg_levels, config.mg_cycles, config.mg_cycle, config.mg_smoother, tol_abs, tol_rel,
+            workspace.multigrid_hierarchy(config.mg_levels)
+        )
+    elif solver == "cg":
+        stats = conjugate_gradient.solve_pressure(
+            p, div,
+            tol_abs, tol_rel, config.cg_max_iter, config.cg_preconditioner,
+            workspace.cg_buffers()
+        )
+    elif solver == "gauss":
+        stats = gauss_siedel_project(p, div, config.sor_omega, config.n_iter, tol_abs, tol_rel)
+    elif config.temporal_blocking:
+        stats = blocking.jacobi_project(
+            p, div, workspace.pressure_tmp, config.n_iter, tol_abs, tol_rel,
+            workspace.blocking_buffers(1, blocking.block_size(config, 1, p.itemsize), config.block_steps)
+        )
     else:
-        jacobi_project(prev_vel)
+        stats = jacobi_project(p, div, workspace.pressure_tmp, config.n_iter, tol_abs, tol_rel)
+
+    if pressure_field is not None:
+        copy_field(p, pressure_field)
+
+    subtract_gradient(dx, dy, u, v, p)
+    return stats
+
+@njit(parallel=True, nogil=True, cache=True)
+def divergence(dx, dy, u, v, p, div):
+    s = u.shape
+
+    for i in prange(1, s[0]-1):
+        for j in range(1, s[1]-1):
+            div[i, j] = (
+                (u[i, j+1] - u[i, j-1]) / (-2.0*dx) + 
+                (v[i+1, j] - v[i-1, j]) / (-2.0*dy)
+            )
+            p[i, j] = 0
+    update_bnd(p)
+    update_bnd(div)
+
+@njit(parallel=True, nogil=True, cache=True)
+def subtract_gradient(dx, dy, u, v, p):
+    s = u.shape
 
     for i in prange(1, s[0]-1):
         for j in range(1, s[1]-1):
             # gradient
-            velocity_field[i, j][0] -= (prev_vel[i, j+1][0] - prev_vel[i, j-1][0]) / (2.0*dx)
-            velocity_field[i, j][1] -= (prev_vel[i+1, j][0] - prev_vel[i-1, j][0]) / (2.0*dy)
-    update_bnd_vel(velocity_field)
+            u[i, j] -= (p[i, j+1] - p[i, j-1]) / (2.0*dx)
+            v[i, j] -= (p[i+1, j] - p[i-1, j]) / (2.0*dy)
+    update_bnd_vel(u, v)
 
 
 ##### Solvers #####
-@njit(parallel=True)
-def gauss_siedel(field_vector, dt, a_mod = 1.0):
+# diffusion solves the backward euler step (1+a)x - a/4*(sum of neighbours) = x0
+# with a = dt*a_mod, on fields with the components on the last axis
+#
+# the residual is taken from the size of each update, for jacobi it is the
+# exact residual of the iterate the sweep started from
+@njit(nogil=True, cache=True)
+def converged(res, b_rms, tol_abs, tol_rel):
+    return res <= tol_abs or res <= tol_rel*b_rms
+
+@njit(parallel=True, nogil=True, cache=True)
+def rms(field_vector):
+    # over the interior cells of a (N+2, N+2, c) field
     s = field_vector.shape
-    a = dt/n_iter * a_mod
-    for it in range(n_iter):
-        x0 = field_vector.copy()
-
-        for i in prange(1, s[0]-1):
-            for j in range(1, s[1]-1):
-                field_vector[i, j] = (
-                    x0[i, j] + a *
-                    (
-                        (field_vector[i-1, j] + field_vector[i+1, j] + field_vector[i, j-1] + field_vector[i, j+1])/(4.0)
-                    )
-                ) / (1+a)
-        update_bnd(field_vector)
-
-@njit(parallel=True)
-def gauss_siedel_project(field_vector):
+    total = 0.0
+    for i in prange(1, s[0]-1):
+        for j in range(1, s[1]-1):
+            for c in range(s[2]):
+                total += field_vector[i, j, c]**2
+    return np.sqrt(total / ((s[0]-2)*(s[1]-2)*s[2]))
+
+@njit(parallel=True, nogil=True, cache=True)
+def gauss_siedel(field_vector, x0, dt, a_mod, omega, max_iter, tol_abs, tol_rel):
+    # red-black ordering: cells with (i+j) even first, then odd ones
+    # each color only reads the other, so the sweep is the same for any
+    # thread schedule and the cell being updated still holds its old value
     s = field_vector.shape
-    for it in range(n_iter):
-        value = field_vector.copy()
-        for i in prange(1, s[0]-1):  
-            for j in range(1, s[1]-1):
-                field_vector[i, j][0] = ( 
-                    field_vector[i-1, j][0] + 
-                    field_vector[i+1, j][0] + 
-                    field_vector[i, j-1][0] + 
-                    field_vector[i, j+1][0] +
-                    value[i, j][1]
-                ) / 4.0
-        update_bnd(field_vector)
-
-@njit(parallel=True)
-def jacobi(field_vector, dt, a_mod = 1.0):
+    n = (s[0]-2)*(s[1]-2)*s[2]
+    a = dt * a_mod
+    copy_field(field_vector, x0)
+    b_rms = rms(x0)
+
+    it = 0
+    res = 0.0
+    while it < max_iter:
+        total = 0.0
+        for color in range(2):
+            for i in prange(1, s[0]-1):
+                for j in range(1 + (i+1+color) % 2, s[1]-1, 2):
+                    for c in range(s[2]):
+                        v = (
+                            x0[i, j, c] + a *
+                            (
+                                (field_vector[i-1, j, c] + field_vector[i+1, j, c] + field_vector[i, j-1, c] + field_vector[i, j+1, c])/(4.0)
+                            )
+                        ) / (1+a)
+                        delta = omega*(v - field_vector[i, j, c])
+                        total += delta*delta
+                        field_vector[i, j, c] += delta
+            update_bnd(field_vector)
+
+        it += 1
+        res = (1+a)/omega * np.sqrt(total/n)
+        if converged(res, b_rms, tol_abs, tol_rel):
+            break
+    return it, res
+
+@njit(parallel=True, nogil=True, cache=True)
+def gauss_siedel_project(p, div, omega, max_iter, tol_abs, tol_rel):
+    # red-black ordering, see gauss_siedel
+    s = p.shape
+    n = (s[0]-2)*(s[1]-2)
+    b_rms = rms(div[:, :, np.newaxis])
+
+    it = 0
+    res = 0.0
+    while it < max_iter:
+        total = 0.0
+        for color in range(2):
+            for i in prange(1, s[0]-1):
+                for j in range(1 + (i+1+color) % 2, s[1]-1, 2):
+                    v = ( 
+                        p[i-1, j] + 
+                        p[i+1, j] + 
+                        p[i, j-1] + 
+                        p[i, j+1] +
+                        div[i, j]
+                    ) / 4.0
+                    delta = omega*(v - p[i, j])
+                    total += delta*delta
+                    p[i, j] += delta
+            update_bnd(p)
+
+        it += 1
+        res = 4.0/omega * np.sqrt(total/n)
+        if converged(res, b_rms, tol_abs, tol_rel):
+            break
+    return it, res
+
+@njit(parallel=True, nogil=True, cache=True)
+def jacobi(field_vector, x0, tmp, dt, a_mod, max_iter, tol_abs, tol_rel):
+    # sweeps alternate between field_vector and tmp instead of copying
     s = field_vector.shape
-    a = dt/n_iter * a_mod
-    for it in range(n_iter):
-        x0 = field_vector.copy()
+    n = (s[0]-2)*(s[1]-2)*s[2]
+    a = dt * a_mod
+    copy_field(field_vector, x0)
+    b_rms = rms(x0)
+
+    src = field_vector
+    dst = tmp
+    it = 0
+    res = 0.0
+    while it < max_iter:
+        total = 0.0
 
         for i in prange(1, s[0]-1):
             for j in range(1, s[1]-1):
-                field_vector[i, j] = (
-                    x0[i, j] + a *
-                    (
-                        (x0[i-1, j] + x0[i+1, j] + x0[i, j-1] + x0[i, j+1])/(4.0)
-                    )
-                ) / (1+a)
-        update_bnd(field_vector)
-
-@njit(parallel=True)
-def jacobi_project(field_vector):
-    s = field_vector.shape
-    for it in range(n_iter):
-        value = field_vector.copy()
+                for c in range(s[2]):
+                    v = (
+                        x0[i, j, c] + a *
+                        (
+                            (src[i-1, j, c] + src[i+1, j, c] + src[i, j-1, c] + src[i, j+1, c])/(4.0)
+                        )
+                    ) / (1+a)
+                    total += (v - src[i, j, c])**2
+                    dst[i, j, c] = v
+        update_bnd(dst)
+        src, dst = dst, src
+
+        it += 1
+        res = (1+a) * np.sqrt(total/n)
+        if converged(res, b_rms, tol_abs, tol_rel):
+            break
+
+    # odd number of sweeps, last one went to tmp
+    if it % 2 == 1:
+        copy_field(tmp, field_vector)
+    return it, res
+
+@njit(parallel=True, nogil=True, cache=True)
+def jacobi_project(p, div, tmp, max_iter, tol_abs, tol_rel):
+    # sweeps alternate the pressure between p and tmp, see jacobi
+    s = p.shape
+    n = (s[0]-2)*(s[1]-2)
+    b_rms = rms(div[:, :, np.newaxis])
+
+    src = p
+    dst = tmp
+    it = 0
+    res = 0.0
+    while it < max_iter:
+        total = 0.0
         for i in prange(1, s[0]-1):  
             for j in range(1, s[1]-1):
-                field_vector[i, j][0] = ( 
-                    value[i-1, j][0] + 
-                    value[i+1, j][0] + 
-                    value[i, j-1][0] + 
-                    value[i, j+1][0] +
-                    value[i, j][1]
+                v = ( 
+                    src[i-1, j] + 
+                    src[i+1, j] + 
+                    src[i, j-1] + 
+                    src[i, j+1] +
+                    div[i, j]
                 ) / 4.0
+                total += (v - src[i, j])**2
+                dst[i, j] = v
+        update_bnd(dst)
+        src, dst = dst, src
+
+        it += 1
+        res = 4.0 * np.sqrt(total/n)
+        if converged(res, b_rms, tol_abs, tol_rel):
+            break
+
+    if it % 2 == 1:
+        copy_field(tmp, p)
+    return it, res
+
+@njit(parallel=True, nogil=True, cache=True)
+def jacobi_tiles(field_vector, x0, tmp, dt, a_mod, max_iter, tol_abs, tol_rel, active, halo, tile):
+    # jacobi over the active tiles, the residual is the one of those cells
+    # tmp starts as the field on the halo, so both buffers agree on the cells
+    # around the active tiles and the sweeps read them as fixed values
+    s = field_vector.shape
+    n = tile_cells(active, tile, s[:2])*s[2]
+    if n == 0:
+        return 0, 0.0
+
+    a = dt * a_mod
+    copy_tiles(field_vector, x0, active, tile)
+    copy_tiles(field_vector, tmp, halo, tile)
+    update_bnd(tmp)
+    b_rms = rms_tiles(x0, active, tile)
+
+    src = field_vector
+    dst = tmp
+    it = 0
+    res = 0.0
+    while it < max_iter:
+        total = 0.0
+
+        for t in prange(active.shape[0]):
+            i_start = 1 + active[t, 0]*tile
+            j_start = 1 + active[t, 1]*tile
+            for i in range(i_start, min(i_start + tile, s[0]-1)):
+                for j in range(j_start, min(j_start + tile, s[1]-1)):
+                    for c in range(s[2]):
+                        v = (
+                            x0[i, j, c] + a *
+                            (
+                                (src[i-1, j, c] + src[i+1, j, c] + src[i, j-1, c] + src[i, j+1, c])/(4.0)
+                            )
+                        ) / (1+a)
+                        total += (v - src[i, j, c])**2
+                        dst[i, j, c] = v
+        update_bnd(dst)
+        src, dst = dst, src
+
+        it += 1
+        res = (1+a) * np.sqrt(total/n)
+        if converged(res, b_rms, tol_abs, tol_rel):
+            break
+
+    if it % 2 == 1:
+        copy_tiles(tmp, field_vector, active, tile)
         update_bnd(field_vector)
+    return it, res
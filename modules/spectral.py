@@ -0,0 +1,54 @@
+"""
+Direct spectral solver for the pressure projection.
+
+The domain is an obstacle free rectangle and the ghost cells copy their
+neighbour (update_bnd), so the 5 point Laplacian of jacobi_project is
+diagonalized by the type II discrete cosine transform. The system is solved
+exactly in O(N^2 log N) with one forward and one inverse transform.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+from scipy import fft
+
+from modules.boundaries import update_bnd
+from modules.multigrid import remove_mean, residual_norm
+
+
+# threads used by scipy.fft, -1 is all cores
+workers = -1
+
+
+##### Exposed funcs #####
+def solve(pressure, divergence):
+    """Solve for pressure in place, returns (1, rms residual)"""
+
+    # pure neumann problem, only has a solution if div sums to zero
+    remove_mean(divergence)
+
+    s = pressure.shape
+    b = divergence[1:-1, 1:-1]
+
+    b_hat = fft.dctn(b, type=2, norm="ortho", workers=workers)
+    b_hat *= inverse_eigenvalues(s[0]-2, s[1]-2, b_hat.dtype)
+    pressure[1:-1, 1:-1] = fft.idctn(b_hat, type=2, norm="ortho", workers=workers)
+    update_bnd(pressure)
+
+    return 1, residual_norm(pressure, divergence)
+
+
+@lru_cache(maxsize=8)
+def inverse_eigenvalues(rows, cols, dtype):
+    """1/eigenvalue of 4p - (sum of neighbours) for each cosine mode"""
+
+    # 1D neumann second difference has eigenvalues 2 - 2cos(pi*k/n)
+    ey = 2.0 - 2.0*np.cos(np.pi*np.arange(rows)/rows)
+    ex = 2.0 - 2.0*np.cos(np.pi*np.arange(cols)/cols)
+    eigen = ey[:, np.newaxis] + ex[np.newaxis, :]
+
+    # constant mode has eigenvalue 0, pressure is defined up to a constant
+    eigen[0, 0] = 1.0
+    inverse = 1.0/eigen
+    inverse[0, 0] = 0.0
+    return inverse.astype(dtype)
@@ -0,0 +1,645 @@
+"""
+Domain decomposition of the jacobi path over a pool of processes.
+
+The interior rows are split into horizontal strips, one per worker process.
+Every field and buffer lives in one multiprocessing.shared_memory block,
+each worker sweeps the rows of its strip and reads the rows next to it from
+its neighbours in place, so the halo exchange is a barrier between sweeps
+instead of a copy. Ghost cells follow update_bnd: the first and last strips
+fill the ghost rows, every strip fills the ghost cols of its own rows.
+
+The main process is the driver: it copies the fields in, releases the
+workers with a barrier, waits on a second one for the step to finish and
+copies the fields out. Inside a step the workers only synchronize with each
+other, once per solver iteration (the residual is reduced over the strips
+at the same barrier) and once at the end of each stage.
+
+The row kernels are serial, the parallelism comes from the processes, so
+this scales past the cores numba threads of one process can use well and
+keeps the working set of each process to its strip.
+"""
+
+import math
+import multiprocessing
+import multiprocessing.connection
+import os
+import threading
+import time
+import traceback
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+from numba import njit
+
+from modules.backends import Backend
+from modules.layout import planes
+from modules.solvers import converged, interpolate, trace
+
+
+# planes of the shared block, all shaped like the density field
+PLANES = (
+    "density", "u", "v", "pressure_field",
+    "density0", "u0", "v0", "density_tmp", "u_tmp", "v_tmp",
+    "pressure", "divergence", "pressure_tmp",
+)
+
+# slots of the control array, written by the driver before each command
+CONTROL = {name: i for i, name in enumerate((
+    "command", "dt", "dx", "dy", "width", "height", "a_mod", "velocity",
+    "warm_start", "fused", "n_iter", "tol_abs", "tol_rel", "planes", "stage",
+))}
+
+# rows of the stats array, (iterations, residual, seconds) of each stage
+STAGES = ("difuse_vel_step", "project_1", "advect_vel", "project_2", "difuse_step", "advect", "advect_fused")
+
+# commands
+STOP, STEP, ADVECT, ADVECT_FUSED, DIFFUSE, PROJECT, BOUNDARIES = range(7)
+
+
+class SharedFields:
+    """Planes, control and reduction arrays in one shared memory block"""
+
+    def __init__(self, shape, workers, name=None) -> None:
+        self.shape = tuple(shape)
+        self.workers = workers
+
+        arrays = [(plane, self.shape, np.float32) for plane in PLANES]
+        arrays += [
+            ("control", (len(CONTROL),), np.float64),
+            ("stats", (len(STAGES), 3), np.float64),
+            # partial sums of squares of each strip, double buffered so one
+            # barrier per iteration is enough
+            ("totals", (2, workers), np.float64),
+        ]
+
+        # 64 byte aligned offsets
+        offsets = []
+        size = 0
+        for _, array_shape, dtype in arrays:
+            offsets.append(size)
+            size += -(-int(np.prod(array_shape))*np.dtype(dtype).itemsize // 64)*64
+
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            # spawned workers share the resource tracker of the driver, so
+            # attaching registers the block again and leaves it to the driver
+            self.shm = shared_memory.SharedMemory(name=name)
+
+        self.names = [name for name, _, _ in arrays]
+        for (key, array_shape, dtype), offset in zip(arrays, offsets):
+            setattr(self, key, np.ndarray(array_shape, dtype=dtype, buffer=self.shm.buf, offset=offset))
+
+    @property
+    def spec(self):
+        """Arguments of SharedFields to attach to this block from another process"""
+
+        return self.shape, self.workers, self.shm.name
+
+    def close(self):
+        # the views hold the buffer, they go before the block is closed
+        for key in self.names:
+            delattr(self, key)
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class StripBackend(Backend):
+    """Jacobi path of modules/solvers.py on strips of rows, one worker process each"""
+
+    name = "strips"
+
+    def __init__(self, shape, config=None) -> None:
+        super().__init__(shape, config)
+        self.require_jacobi()
+
+        # at most one strip per interior row
+        workers = self.config.strip_workers or os.cpu_count()
+        self.workers = max(min(workers, self.shape[0]-2), 1)
+
+        self.fields = SharedFields(self.shape, self.workers)
+
+        # spawned, numba and its threads do not survive a fork
+        context = multiprocessing.get_context("spawn")
+        self.start = context.Barrier(self.workers + 1)
+        self.done = context.Barrier(self.workers + 1)
+        # kept here, the semaphores go away with the last reference in the driver
+        self.sweep = context.Barrier(self.workers)
+
+        self.processes = [
+            context.Process(
+                target=run_worker, args=(self.fields.spec, index, self.start, self.done, self.sweep), daemon=True
+            )
+            for index in range(self.workers)
+        ]
+        for process in self.processes:
+            process.start()
+
+        # a worker that dies leaves the driver waiting on the barriers
+        self.stopping = threading.Event()
+        threading.Thread(
+            target=watch, args=(self.processes, (self.start, self.done, self.sweep), self.stopping), daemon=True
+        ).start()
+
+        # one command at a time, the backend may be driven from a thread
+        self.lock = threading.Lock()
+        self._finalizer = weakref.finalize(self, shutdown, self.fields, self.start, self.processes, self.stopping)
+
+    def close(self):
+        """Stop the workers and free the shared block"""
+
+        self._finalizer()
+
+    # ---------- Exposed funcs ----------
+    def solve_fields(self, dt, dx, dy, width, height, density_field, velocity_field, pressure_field=None):
+        """Same arguments and results as Backend.solve_fields, one copy in and out"""
+
+        self.require_jacobi()
+        with self.lock:
+            self.load(density_field, velocity_field, pressure_field)
+            self.run(
+                STEP, dt=dt, dx=dx, dy=dy, width=width, height=height,
+                warm_start=pressure_field is not None, fused=self.config.fused_advection
+            )
+            self.store(density_field, velocity_field, pressure_field)
+
+            if self.config.fused_advection:
+                stages = ("difuse_vel_step", "project_1", "difuse_step", "advect_fused", "project_2")
+            else:
+                stages = ("difuse_vel_step", "project_1", "advect_vel", "project_2", "difuse_step", "advect")
+
+            stats = {}
+            for name in stages:
+                it, res, seconds = self.fields.stats[STAGES.index(name)]
+                self.profiler.record(name, seconds)
+                if name.startswith(("difuse", "project")):
+                    stats[name] = int(it), float(res)
+            return stats
+
+    def advect(self, dt, dx, dy, width, height, field, velocity_field):
+        velocity = field.ndim == 3
+        with self.lock:
+            self.load(None if velocity else field, velocity_field)
+            self.run(ADVECT, dt=dt, dx=dx, dy=dy, width=width, height=height, velocity=velocity)
+            if velocity:
+                self.store(None, field)
+            else:
+                self.store(field, None)
+
+    def advect_fused(self, dt, dx, dy, width, height, density_field, velocity_field):
+        with self.lock:
+            self.load(density_field, velocity_field)
+            self.run(ADVECT_FUSED, dt=dt, dx=dx, dy=dy, width=width, height=height)
+            self.store(density_field, velocity_field)
+
+    def diffuse(self, dt, field, a_mod):
+        self.require_jacobi()
+        velocity = field.ndim == 3
+        stage = STAGES.index("difuse_vel_step" if velocity else "difuse_step")
+        with self.lock:
+            self.load(None, field) if velocity else self.load(field, None)
+            self.run(DIFFUSE, dt=dt, a_mod=a_mod, velocity=velocity, stage=stage)
+            self.store(None, field) if velocity else self.store(field, None)
+            it, res, _ = self.fields.stats[stage]
+            return int(it), float(res)
+
+    def project(self, dx, dy, velocity_field, pressure_field=None):
+        self.require_jacobi()
+        stage = STAGES.index("project_1")
+        with self.lock:
+            self.load(None, velocity_field, pressure_field)
+            self.run(PROJECT, dx=dx, dy=dy, warm_start=pressure_field is not None, stage=stage)
+            self.store(None, velocity_field, pressure_field)
+            it, res, _ = self.fields.stats[stage]
+            return int(it), float(res)
+
+    def boundaries(self, field):
+        velocity = field.ndim == 3
+        with self.lock:
+            self.load(None, field) if velocity else self.load(field, None)
+            self.run(BOUNDARIES, velocity=velocity)
+            self.store(None, field) if velocity else self.store(field, None)
+
+    # ---------- Driver ----------
+    def load(self, density_field=None, velocity_field=None, pressure_field=None):
+        fields = self.fields
+        if density_field is not None:
+            fields.density[...] = density_field
+        if velocity_field is not None:
+            u, v = planes(velocity_field)
+            fields.u[...] = u
+            fields.v[...] = v
+        if pressure_field is not None:
+            fields.pressure_field[...] = pressure_field
+
+    def store(self, density_field=None, velocity_field=None, pressure_field=None):
+        fields = self.fields
+        if density_field is not None:
+            density_field[...] = fields.density
+        if velocity_field is not None:
+            u, v = planes(velocity_field)
+            u[...] = fields.u
+            v[...] = fields.v
+        if pressure_field is not None:
+            pressure_field[...] = fields.pressure_field
+
+    def run(self, command, **values):
+        """Run a command on every strip and wait for it"""
+
+        control = self.fields.control
+        control[:] = 0
+        control[CONTROL["command"]] = command
+        control[CONTROL["n_iter"]] = self.config.n_iter
+        control[CONTROL["tol_abs"]] = self.config.tolerance_abs
+        control[CONTROL["tol_rel"]] = self.config.tolerance_rel
+        # the soa layout solves u and v on their own in solvers.difuse
+        control[CONTROL["planes"]] = self.config.layout == "soa"
+        for name, value in values.items():
+            control[CONTROL[name]] = value
+
+        try:
+            self.start.wait()
+            self.done.wait()
+        except threading.BrokenBarrierError:
+            raise RuntimeError("A strip worker failed or exited, the backend cannot be used anymore") from None
+
+
+def watch(processes, barriers, stopping):
+    # aborts the barriers when a worker exits before shutdown
+    multiprocessing.connection.wait([process.sentinel for process in processes])
+    if not stopping.is_set():
+        for barrier in barriers:
+            barrier.abort()
+
+
+def shutdown(fields, start, processes, stopping):
+    # finalizer of StripBackend, must not hold a reference to it
+    stopping.set()
+    if any(process.is_alive() for process in processes):
+        fields.control[CONTROL["command"]] = STOP
+        try:
+            start.wait(timeout=5)
+        except threading.BrokenBarrierError:
+            pass
+    for process in processes:
+        process.join(timeout=5)
+        if process.is_alive():
+            process.terminate()
+    fields.close()
+
+
+##### Workers #####
+def run_worker(spec, index, start, done, sweep):
+    """Main loop of a worker process"""
+
+    fields = SharedFields(*spec)
+    strip = Strip(fields, index, sweep)
+    try:
+        while True:
+            start.wait()
+            command = int(fields.control[CONTROL["command"]])
+            if command == STOP:
+                break
+            strip.run(command)
+            done.wait()
+    except threading.BrokenBarrierError:
+        # another worker failed, it reported the error
+        pass
+    except Exception:
+        traceback.print_exc()
+        for barrier in (start, done, sweep):
+            barrier.abort()
+    finally:
+        del strip
+        fields.close()
+
+
+class Strip:
+    """State of one worker, interior rows r0 up to r1 (excluded)"""
+
+    def __init__(self, fields, index, sweep) -> None:
+        self.fields = fields
+        self.index = index
+        self.sweep = sweep
+
+        rows = fields.shape[0]-2
+        bounds = np.linspace(0, rows, fields.workers+1).round().astype(int) + 1
+        self.r0, self.r1 = int(bounds[index]), int(bounds[index+1])
+
+        # the first and last strips own the ghost rows
+        self.first = index == 0
+        self.last = index == fields.workers-1
+        self.e0 = 0 if self.first else self.r0
+        self.e1 = fields.shape[0] if self.last else self.r1
+
+        # interior cells of the whole grid
+        self.cells = rows*(fields.shape[1]-2)
+        self.parity = 0
+
+    def value(self, name):
+        return self.fields.control[CONTROL[name]]
+
+    def reduce(self, total):
+        """Sum of total over the strips, one barrier"""
+
+        totals = self.fields.totals[self.parity]
+        totals[self.index] = total
+        self.sweep.wait()
+        self.parity ^= 1
+        return float(totals.sum())
+
+    def record(self, stage, func, *args):
+        # the stage of the first strip stands for all of them, they end on a barrier
+        start = time.perf_counter()
+        result = func(*args)
+        if self.index == 0:
+            row = self.fields.stats[stage]
+            if result is not None:
+                row[0], row[1] = result
+            row[2] = time.perf_counter() - start
+
+    def run(self, command):
+        dt, dx, dy = self.value("dt"), self.value("dx"), self.value("dy")
+        width, height = self.value("width"), self.value("height")
+        warm_start = self.value("warm_start") > 0
+        velocity = self.value("velocity") > 0
+        stage = int(self.value("stage"))
+        grid = (dt, dx, dy, width, height)
+
+        if command == STEP:
+            record = self.record
+            record(0, self.diffuse, dt, 1.0, True)
+            record(1, self.project, dx, dy, warm_start)
+            if self.value("fused") > 0:
+                record(4, self.diffuse, dt, 2.0, False)
+                record(6, self.advect_fused, *grid)
+                record(3, self.project, dx, dy, warm_start)
+            else:
+                record(2, self.advect, *grid, True)
+                record(3, self.project, dx, dy, warm_start)
+                record(4, self.diffuse, dt, 2.0, False)
+                record(5, self.advect, *grid, False)
+        elif command == ADVECT:
+            self.advect(*grid, velocity)
+        elif command == ADVECT_FUSED:
+            self.advect_fused(*grid)
+        elif command == DIFFUSE:
+            self.record(stage, self.diffuse, dt, self.value("a_mod"), velocity)
+        elif command == PROJECT:
+            self.record(stage, self.project, dx, dy, warm_start)
+        elif command == BOUNDARIES:
+            self.boundaries(velocity)
+            self.sweep.wait()
+
+    def boundaries(self, velocity):
+        f = self.fields
+        if velocity:
+            bnd_vel_rows(f.u, f.v, self.r0, self.r1, self.first, self.last)
+        else:
+            bnd_rows(f.density, self.r0, self.r1, self.first, self.last)
+
+    # ---------- Stages ----------
+    def diffuse(self, dt, a_mod, velocity):
+        # solvers.difuse, the components of the velocity share one residual
+        # for the aos layout and each one has its own for soa
+        f = self.fields
+        if not velocity:
+            return self.jacobi([f.density], [f.density0], [f.density_tmp], dt*a_mod)
+        if self.value("planes") > 0:
+            stats = [
+                self.jacobi([f.u], [f.u0], [f.u_tmp], dt*a_mod),
+                self.jacobi([f.v], [f.v0], [f.v_tmp], dt*a_mod),
+            ]
+            return max(it for it, _ in stats), max(res for _, res in stats)
+        return self.jacobi([f.u, f.v], [f.u0, f.v0], [f.u_tmp, f.v_tmp], dt*a_mod)
+
+    def jacobi(self, fields, x0s, tmps, a):
+        # solvers.jacobi on the planes of fields, with one residual
+        r0, r1 = self.r0, self.r1
+        n = self.cells*len(fields)
+        tol_abs, tol_rel = self.value("tol_abs"), self.value("tol_rel")
+
+        total = 0.0
+        for field, x0 in zip(fields, x0s):
+            copy_rows(field, x0, self.e0, self.e1)
+            total += sum_squares_rows(x0, r0, r1)
+        b_rms = math.sqrt(self.reduce(total)/n)
+
+        src, dst = fields, tmps
+        it = 0
+        res = 0.0
+        while it < int(self.value("n_iter")):
+            total = 0.0
+            for s, d, x0 in zip(src, dst, x0s):
+                total += jacobi_rows(s, d, x0, a, r0, r1)
+                bnd_rows(d, r0, r1, self.first, self.last)
+            total = self.reduce(total)
+            src, dst = dst, src
+
+            it += 1
+            res = (1+a) * math.sqrt(total/n)
+            if converged(res, b_rms, tol_abs, tol_rel):
+                break
+
+        # odd number of sweeps, last one went to tmp
+        if it % 2 == 1:
+            for field, tmp in zip(fields, tmps):
+                copy_rows(tmp, field, self.e0, self.e1)
+        self.sweep.wait()
+        return it, res
+
+    def project(self, dx, dy, warm_start):
+        # solvers.project with jacobi_project
+        f = self.fields
+        r0, r1 = self.r0, self.r1
+        tol_abs, tol_rel = self.value("tol_abs"), self.value("tol_rel")
+
+        divergence_rows(dx, dy, f.u, f.v, f.pressure, f.divergence, r0, r1)
+        bnd_rows(f.pressure, r0, r1, self.first, self.last)
+        bnd_rows(f.divergence, r0, r1, self.first, self.last)
+        if warm_start:
+            copy_rows(f.pressure_field, f.pressure, self.e0, self.e1)
+        b_rms = math.sqrt(self.reduce(sum_squares_rows(f.divergence, r0, r1))/self.cells)
+
+        src, dst = f.pressure, f.pressure_tmp
+        it = 0
+        res = 0.0
+        while it < int(self.value("n_iter")):
+            total = pressure_rows(src, dst, f.divergence, r0, r1)
+            bnd_rows(dst, r0, r1, self.first, self.last)
+            total = self.reduce(total)
+            src, dst = dst, src
+
+            it += 1
+            res = 4.0 * math.sqrt(total/self.cells)
+            if converged(res, b_rms, tol_abs, tol_rel):
+                break
+
+        if it % 2 == 1:
+            copy_rows(f.pressure_tmp, f.pressure, self.e0, self.e1)
+        if warm_start:
+            copy_rows(f.pressure, f.pressure_field, self.e0, self.e1)
+
+        # the gradient reads the pressure of the neighbouring strips
+        self.sweep.wait()
+        subtract_gradient_rows(dx, dy, f.u, f.v, f.pressure, r0, r1)
+        bnd_vel_rows(f.u, f.v, r0, r1, self.first, self.last)
+        self.sweep.wait()
+        return it, res
+
+    def advect(self, dt, dx, dy, width, height, velocity):
+        f = self.fields
+        r0, r1 = self.r0, self.r1
+
+        # backtraces read the snapshots anywhere, all strips copy first
+        if velocity:
+            copy_rows(f.u, f.u0, self.e0, self.e1)
+            copy_rows(f.v, f.v0, self.e0, self.e1)
+            self.sweep.wait()
+            advect_vel_rows(dt, dx, dy, width, height, f.u, f.v, f.u0, f.v0, r0, r1)
+            bnd_vel_rows(f.u, f.v, r0, r1, self.first, self.last)
+        else:
+            copy_rows(f.density, f.density0, self.e0, self.e1)
+            self.sweep.wait()
+            advect_rows(dt, dx, dy, width, height, f.density, f.density0, f.u, f.v, r0, r1)
+            bnd_rows(f.density, r0, r1, self.first, self.last)
+        self.sweep.wait()
+
+    def advect_fused(self, dt, dx, dy, width, height):
+        f = self.fields
+        r0, r1 = self.r0, self.r1
+
+        copy_rows(f.density, f.density0, self.e0, self.e1)
+        copy_rows(f.u, f.u0, self.e0, self.e1)
+        copy_rows(f.v, f.v0, self.e0, self.e1)
+        self.sweep.wait()
+        advect_rows(dt, dx, dy, width, height, f.density, f.density0, f.u0, f.v0, r0, r1)
+        advect_vel_rows(dt, dx, dy, width, height, f.u, f.v, f.u0, f.v0, r0, r1)
+        bnd_rows(f.density, r0, r1, self.first, self.last)
+        bnd_vel_rows(f.u, f.v, r0, r1, self.first, self.last)
+        self.sweep.wait()
+
+
+##### Row kernels #####
+# the kernels of modules/solvers.py and modules/boundaries.py on the
+# interior rows r0 up to r1 (excluded) of whole planes
+@njit(nogil=True, cache=True)
+def copy_rows(src, dst, r0, r1):
+    for i in range(r0, r1):
+        for j in range(src.shape[1]):
+            dst[i, j] = src[i, j]
+
+@njit(nogil=True, cache=True)
+def sum_squares_rows(field, r0, r1):
+    total = 0.0
+    for i in range(r0, r1):
+        for j in range(1, field.shape[1]-1):
+            total += field[i, j]**2
+    return total
+
+@njit(nogil=True, cache=True)
+def bnd_rows(field, r0, r1, first, last):
+    # update_bnd split by rows: ghost rows by the first and last strips,
+    # ghost cols of the own rows (and ghost rows) after them
+    s = field.shape
+    if first:
+        for j in range(s[1]):
+            field[0, j] = field[1, j]
+    if last:
+        for j in range(s[1]):
+            field[s[0]-1, j] = field[s[0]-2, j]
+
+    e0 = 0 if first else r0
+    e1 = s[0] if last else r1
+    for i in range(e0, e1):
+        field[i, 0] = field[i, 1]
+        field[i, s[1]-1] = field[i, s[1]-2]
+
+@njit(nogil=True, cache=True)
+def bnd_vel_rows(u, v, r0, r1, first, last):
+    # update_bnd_vel split as bnd_rows
+    s = u.shape
+    if first:
+        for j in range(s[1]):
+            u[0, j] = u[1, j]
+            v[0, j] = -v[1, j]
+    if last:
+        for j in range(s[1]):
+            u[s[0]-1, j] = u[s[0]-2, j]
+            v[s[0]-1, j] = -v[s[0]-2, j]
+
+    e0 = 0 if first else r0
+    e1 = s[0] if last else r1
+    for i in range(e0, e1):
+        u[i, 0] = -u[i, 1]
+        v[i, 0] = v[i, 1]
+        u[i, s[1]-1] = -u[i, s[1]-2]
+        v[i, s[1]-1] = v[i, s[1]-2]
+
+@njit(nogil=True, cache=True)
+def jacobi_rows(src, dst, x0, a, r0, r1):
+    total = 0.0
+    for i in range(r0, r1):
+        for j in range(1, src.shape[1]-1):
+            v = (
+                x0[i, j] + a *
+                (
+                    (src[i-1, j] + src[i+1, j] + src[i, j-1] + src[i, j+1])/(4.0)
+                )
+            ) / (1+a)
+            total += (v - src[i, j])**2
+            dst[i, j] = v
+    return total
+
+@njit(nogil=True, cache=True)
+def pressure_rows(src, dst, div, r0, r1):
+    total = 0.0
+    for i in range(r0, r1):
+        for j in range(1, src.shape[1]-1):
+            v = (
+                src[i-1, j] +
+                src[i+1, j] +
+                src[i, j-1] +
+                src[i, j+1] +
+                div[i, j]
+            ) / 4.0
+            total += (v - src[i, j])**2
+            dst[i, j] = v
+    return total
+
+@njit(nogil=True, cache=True)
+def divergence_rows(dx, dy, u, v, p, div, r0, r1):
+    for i in range(r0, r1):
+        for j in range(1, u.shape[1]-1):
+            div[i, j] = (
+                (u[i, j+1] - u[i, j-1]) / (-2.0*dx) +
+                (v[i+1, j] - v[i-1, j]) / (-2.0*dy)
+            )
+            p[i, j] = 0
+
+@njit(nogil=True, cache=True)
+def subtract_gradient_rows(dx, dy, u, v, p, r0, r1):
+    for i in range(r0, r1):
+        for j in range(1, u.shape[1]-1):
+            u[i, j] -= (p[i, j+1] - p[i, j-1]) / (2.0*dx)
+            v[i, j] -= (p[i+1, j] - p[i-1, j]) / (2.0*dy)
+
+@njit(nogil=True, cache=True)
+def advect_rows(dt, dx, dy, width, height, field, d0, u, v, r0, r1):
+    s = field.shape
+    for i in range(r0, r1):
+        for j in range(1, s[1]-1):
+            i0, j0, kx, ky = trace(i, j, u[i, j], v[i, j], dt, dx, dy, width, height, s)
+            field[i, j] = interpolate(d0, i0, j0, kx, ky)
+
+@njit(nogil=True, cache=True)
+def advect_vel_rows(dt, dx, dy, width, height, u, v, u0, v0, r0, r1):
+    s = u.shape
+    for i in range(r0, r1):
+        for j in range(1, s[1]-1):
+            i0, j0, kx, ky = trace(i, j, u0[i, j], v0[i, j], dt, dx, dy, width, height, s)
+            u[i, j] = interpolate(u0, i0, j0, kx, ky)
+            v[i, j] = interpolate(v0, i0, j0, kx, ky)
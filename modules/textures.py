@@ -0,0 +1,61 @@
+"""
+Persistent textures the fields are uploaded through.
+
+Each texture is allocated once, with its own contiguous memory; a frame
+copies the field into it (no new array) and glumpy sends the whole texture
+with one glTexSubImage2D at the next draw.
+"""
+
+import numpy as np
+from glumpy import gl, gloo
+
+
+# texture formats of the density, bytes per cell: 4, 2 and 1
+DENSITY_FORMATS = ("float32", "uint16", "uint8")
+
+
+class DensityTexture:
+    """
+    Density field as a single channel texture.
+
+    uint16 and uint8 store the density clipped to [0, 1] as normalized
+    integers, the shader reads them back as floats in [0, 1]. Density only
+    drives the alpha of the smoke, which is clipped to [0, 1] anyway.
+    """
+
+    def __init__(self, shape, density_format="float32") -> None:
+        if density_format not in DENSITY_FORMATS:
+            raise ValueError(f"Unknown density format: {density_format}")
+
+        self.format = density_format
+        if density_format == "float32":
+            self.texture = np.zeros(shape, dtype=np.float32).view(gloo.TextureFloat2D)
+            self.scale = None
+        else:
+            dtype = np.dtype(density_format)
+            self.texture = np.zeros(shape, dtype=dtype).view(gloo.Texture2D)
+            self.scale = float(np.iinfo(dtype).max)
+
+            # 16 bit normalized on the gpu, the default red format is 8 bit
+            if dtype == np.uint16:
+                self.texture.gpu_format = gl.GL_R16
+
+            # quantization happens here before the copy into the texture
+            self._scratch = np.zeros(shape, dtype=np.float32)
+
+    @property
+    def nbytes(self):
+        """Bytes sent to the gpu on each update"""
+
+        return self.texture.nbytes
+
+    def update(self, density):
+        if self.scale is None:
+            self.texture[...] = density
+            return
+
+        scratch = self._scratch
+        np.clip(density, 0.0, 1.0, out=scratch)
+        np.multiply(scratch, self.scale, out=scratch)
+        np.rint(scratch, out=scratch)
+        self.texture[...] = scratch
@@ -0,0 +1,172 @@
+"""
+Active tiles of the grid.
+
+The interior is split into tiles of tile x tile cells. A tile is active
+when density goes above a threshold in one of its cells or the velocity
+moves a value more than a given part of a cell per step, or when it is
+close enough to such a tile that smoke can reach it during the step.
+The pressure of a projection reaches the whole grid, so the velocity is
+small but not zero far from the smoke, hence the separate threshold.
+The advection and jacobi diffusion kernels of modules/solvers.py only
+sweep the active tiles, so sparse scenes cost about the area of the smoke.
+A step of dt <= 0 moves nothing, so only the density marks tiles then.
+
+Two lists are kept, both (k, 2) arrays of tile (row, col):
+    active  core tiles dilated by the distance a value travels in one step
+            (backtrace plus the interpolation stencil), the tiles written
+    halo    dilated by twice that distance, the tiles read, their snapshots
+            are refreshed before each stage
+"""
+
+import math
+
+import numpy as np
+from numba import njit, prange
+
+
+class ActiveTiles:
+
+    def __init__(self, shape, tile=16) -> None:
+        # shape of the density field, ghost cells included
+        self.shape = tuple(shape)
+        self.tile = tile
+
+        rows = -(-(self.shape[0]-2) // tile)
+        cols = -(-(self.shape[1]-2) // tile)
+
+        # tiles above the threshold and both dilations of them
+        self.core = np.zeros((rows, cols), dtype=np.bool_)
+        self.mask = np.zeros((rows, cols), dtype=np.bool_)
+        self.halo_mask = np.zeros((rows, cols), dtype=np.bool_)
+
+        # lists of the masks, active and halo are views on these
+        self._active = np.zeros((rows*cols, 2), dtype=np.int64)
+        self._halo = np.zeros((rows*cols, 2), dtype=np.int64)
+        self.active = self._active[:0]
+        self.halo = self._halo[:0]
+
+        # dilation of the last update, in tiles
+        self.radius = 0
+
+    def update(self, dt, dx, dy, density_field, u, v, threshold, cells_per_step):
+        """Tiles of the next step of dt, from the fields before it"""
+
+        if dt > 0:
+            u_limit, v_limit = cells_per_step*dx/dt, cells_per_step*dy/dt
+        else:
+            # no velocity moves a value, only the density is tested
+            u_limit = v_limit = math.inf
+        u_max, v_max = tile_activity(
+            density_field, u, v, self.tile, threshold, u_limit, v_limit, self.core
+        )
+
+        # cells a value travels in the step, plus the interpolation stencil
+        # and the first cells reached by diffusion
+        cells = math.ceil(max(dt, 0.0)*max(u_max/dx, v_max/dy)) + 2
+        self.radius = -(-cells // self.tile)
+
+        dilate(self.core, self.radius, self.mask)
+        dilate(self.core, 2*self.radius, self.halo_mask)
+        self.active = self._active[:tile_list(self.mask, self._active)]
+        self.halo = self._halo[:tile_list(self.halo_mask, self._halo)]
+
+    @property
+    def fraction(self):
+        """Share of the tiles swept by the last step"""
+
+        return len(self.active) / self.mask.size
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def tile_activity(density_field, u, v, tile, threshold, u_limit, v_limit, core):
+    """Marks the tiles above the thresholds in core, returns the max |u| and |v| of the interior"""
+
+    s = density_field.shape
+    u_max = 0.0
+    v_max = 0.0
+    for ti in prange(core.shape[0]):
+        i_end = min(1 + (ti+1)*tile, s[0]-1)
+        for tj in range(core.shape[1]):
+            j_end = min(1 + (tj+1)*tile, s[1]-1)
+
+            active = False
+            for i in range(1 + ti*tile, i_end):
+                for j in range(1 + tj*tile, j_end):
+                    a = abs(u[i, j])
+                    b = abs(v[i, j])
+                    u_max = max(u_max, a)
+                    v_max = max(v_max, b)
+                    if a > u_limit or b > v_limit or abs(density_field[i, j]) > threshold:
+                        active = True
+            core[ti, tj] = active
+    return u_max, v_max
+
+
+@njit(nogil=True, cache=True)
+def dilate(core, radius, mask):
+    # square dilation, the tile grid is small so this is cheap
+    rows, cols = core.shape
+    mask[:] = False
+    for ti in range(rows):
+        for tj in range(cols):
+            if not core[ti, tj]:
+                continue
+            for i in range(max(ti-radius, 0), min(ti+radius+1, rows)):
+                for j in range(max(tj-radius, 0), min(tj+radius+1, cols)):
+                    mask[i, j] = True
+
+
+@njit(nogil=True, cache=True)
+def tile_list(mask, out):
+    """(row, col) of the tiles set in mask written to out, returns how many"""
+
+    count = 0
+    for ti in range(mask.shape[0]):
+        for tj in range(mask.shape[1]):
+            if mask[ti, tj]:
+                out[count, 0] = ti
+                out[count, 1] = tj
+                count += 1
+    return count
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def copy_tiles(src, dst, tiles, tile):
+    s = src.shape
+    for t in prange(tiles.shape[0]):
+        i_start = 1 + tiles[t, 0]*tile
+        j_start = 1 + tiles[t, 1]*tile
+        for i in range(i_start, min(i_start + tile, s[0]-1)):
+            for j in range(j_start, min(j_start + tile, s[1]-1)):
+                dst[i, j] = src[i, j]
+
+
+@njit(nogil=True, cache=True)
+def tile_cells(tiles, tile, shape):
+    """Number of interior cells in the tiles, edge tiles may be smaller"""
+
+    n = 0
+    for t in range(tiles.shape[0]):
+        rows = min(tile, shape[0]-1 - (1 + tiles[t, 0]*tile))
+        cols = min(tile, shape[1]-1 - (1 + tiles[t, 1]*tile))
+        n += rows*cols
+    return n
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def rms_tiles(field_vector, tiles, tile):
+    # as solvers.rms, over the cells of the tiles only
+    s = field_vector.shape
+    n = tile_cells(tiles, tile, s[:2])*s[2]
+    if n == 0:
+        return 0.0
+
+    total = 0.0
+    for t in prange(tiles.shape[0]):
+        i_start = 1 + tiles[t, 0]*tile
+        j_start = 1 + tiles[t, 1]*tile
+        for i in range(i_start, min(i_start + tile, s[0]-1)):
+            for j in range(j_start, min(j_start + tile, s[1]-1)):
+                for c in range(s[2]):
+                    total += field_vector[i, j, c]**2
+    return np.sqrt(total / n)
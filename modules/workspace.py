@@ -0,0 +1,73 @@
+"""
+Preallocated buffers for the solver stages.
+
+One workspace is kept per simulation and reused every step, so a steady
+state call to solvers.solve_fields does not allocate any array.
+"""
+
+import numpy as np
+
+from modules import blocking, conjugate_gradient, multigrid
+from modules.layout import velocity_shape
+from modules.tiles import ActiveTiles
+
+
+class Workspace:
+
+    def __init__(self, shape, dtype=np.float32, layout="aos") -> None:
+        # shape of the density field, ghost cells included
+        self.shape = tuple(shape)
+        self.dtype = dtype
+
+        # velocity buffers are shaped like the velocity field, see layout
+        self.layout = layout
+        vel_shape = velocity_shape(self.shape, layout)
+
+        # snapshot read by advection and x0 of the diffusion solves
+        self.density0 = np.zeros(self.shape, dtype=dtype)
+        self.velocity0 = np.zeros(vel_shape, dtype=dtype)
+
+        # ping-pong targets of the jacobi sweeps
+        self.density_tmp = np.zeros(self.shape, dtype=dtype)
+        self.velocity_tmp = np.zeros(vel_shape, dtype=dtype)
+
+        # contiguous planes of the projection, only the pressure needs a
+        # ping-pong target
+        self.pressure = np.zeros(self.shape, dtype=dtype)
+        self.divergence = np.zeros(self.shape, dtype=dtype)
+        self.pressure_tmp = np.zeros(self.shape, dtype=dtype)
+
+        # only allocated when those solvers are used
+        self._cg_buffers = None
+        self._hierarchies = {}
+        self._blocks = {}
+        self._tiles = None
+
+    def cg_buffers(self):
+        """x0, r, z, d, q and preconditioner planes for conjugate gradient"""
+
+        if self._cg_buffers is None:
+            self._cg_buffers = conjugate_gradient.allocate_buffers(self.shape)
+        return self._cg_buffers
+
+    def multigrid_hierarchy(self, levels):
+        """Multigrid levels whose finest grid is the projection buffer"""
+
+        if levels not in self._hierarchies:
+            self._hierarchies[levels] = multigrid.build_hierarchy(self.pressure, self.divergence, levels)
+        return self._hierarchies[levels]
+
+    def blocking_buffers(self, channels, block, steps):
+        """Blocks and per thread buffers of the temporally blocked sweeps, see modules/blocking.py"""
+
+        key = (channels, block, steps)
+        if key not in self._blocks:
+            self._blocks[key] = blocking.allocate_buffers(self.shape, channels, block, steps, self.dtype)
+        return self._blocks[key]
+
+    def active_tiles(self, tile):
+        """Tile masks and lists of the active tiles, see modules/tiles.py"""
+
+        if self._tiles is None or self._tiles.tile != tile:
+            self._tiles = ActiveTiles(self.shape, tile)
+        return self._tiles
@@ -4,8 +4,11 @@ uniform mat4   u_model;         // Model matrix
 uniform mat4   u_view;          // View matrix
 uniform mat4   u_projection;    // Projection matrix
 
+// density of every cell, ghost cells included, one texel per vertex
+uniform sampler2D density;
+uniform int side;
+
 in vec2 position;
-in float density;
 
 out vec4 color;
 
@@ -13,5 +16,7 @@ void main()
 {
     //gl_Position = vec4(position, 0.0, 1.0);
     gl_Position = u_projection * u_view * u_model * vec4(position, 0.0, 1.0);
-    color = vec4(FillColor, density);
+    // vertexes are laid out row by row, as the density field
+    ivec2 cell = ivec2(gl_VertexID % side, gl_VertexID / side);
+    color = vec4(FillColor, texelFetch(density, cell, 0).r);
 }
@@ -0,0 +1,130 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from modules.config import SolverConfig
+from modules.integrator import TimeIntegrator
+from modules.layout import planes
+from modules.simulation import Simulation
+
+
+# float32 fields, the backends sum in different orders, differences are
+# relative to the largest value of each field
+TOLERANCE = 1e-5
+
+
+def run(backend, steps=10, cells=48, **settings):
+    sim = Simulation(900, 900, cells, backend, SolverConfig(**settings))
+    for _ in range(steps):
+        sim.add_density(cells//2, cells//2 - 4, 3, 1.0)
+        sim.add_velocity(cells//2, cells//2 - 4, 2, 200/60, -500/60)
+        sim.advance(1/60)
+    return sim
+
+
+@pytest.fixture(scope="module")
+def reference():
+    return run("numba")
+
+
+@pytest.mark.parametrize("backend", ["taichi", "numpy"])
+def test_same_fields_as_numba(backend, reference):
+    if backend == "taichi":
+        pytest.importorskip("taichi")
+
+    sim = run(backend)
+
+    for name in ("density_field", "velocity_field"):
+        expected = np.asarray(getattr(reference, name))
+        field = np.asarray(getattr(sim, name))
+        scale = np.abs(expected).max()
+        assert scale > 0
+        np.testing.assert_allclose(field, expected, rtol=0, atol=TOLERANCE*scale, err_msg=name)
+
+
+@pytest.mark.parametrize("backend", ["taichi", "numpy"])
+def test_fused_advection_same_fields_as_numba(backend):
+    if backend == "taichi":
+        pytest.importorskip("taichi")
+
+    reference = run("numba", fused_advection=True)
+    sim = run(backend, fused_advection=True)
+
+    for name in ("density_field", "velocity_field"):
+        expected = np.asarray(getattr(reference, name))
+        field = np.asarray(getattr(sim, name))
+        scale = np.abs(expected).max()
+        np.testing.assert_allclose(field, expected, rtol=0, atol=TOLERANCE*scale, err_msg=name)
+
+
+@pytest.mark.parametrize("layout", ["aos", "soa"])
+def test_strips_same_fields_as_numba(layout):
+    # a strong jet in u and weak noise in v, with the soa layout the v
+    # plane runs more diffusion iterations than a joint residual would
+    cells = 48
+    velocity = np.zeros((2, cells+2, cells+2), dtype=np.float32)
+    velocity[0, 20:28, 16:24] = 15.0
+    velocity[1, 1:-1, 1:-1] = 0.1*np.random.default_rng(0).standard_normal((cells, cells))
+
+    results = []
+    for backend in ("numba", "strips"):
+        sim = Simulation(900, 900, cells, backend, SolverConfig(layout=layout, n_iter=200, strip_workers=2))
+        u, v = planes(sim.velocity_field)
+        u[...], v[...] = velocity
+        stats = []
+        for _ in range(4):
+            sim.add_density(24, 20, 3)
+            sim.solve_fields(1/60)
+            stats.append({name: it for name, (it, _) in sim.solve_stats.items()})
+        results.append((sim.density_field.copy(), np.array(sim.velocity_field), stats))
+        if backend == "strips":
+            sim.backend.close()
+
+    # bit for bit, except around subnormals: ti.init turns on flush to zero
+    # in this process but not in the spawned workers
+    (density, velocity, stats), (strip_density, strip_velocity, strip_stats) = results
+    np.testing.assert_allclose(strip_density, density, rtol=0, atol=1e-30)
+    np.testing.assert_allclose(strip_velocity, velocity, rtol=0, atol=1e-30)
+    assert strip_stats == stats
+
+
+def test_numpy_soa_diffusion_stops_per_plane():
+    # same jet and noise as above, the v plane needs more diffusion
+    # iterations than u, numpy has to stop each plane on its own residual
+    cells = 48
+    velocity = np.zeros((2, cells+2, cells+2), dtype=np.float32)
+    velocity[0, 20:28, 16:24] = 15.0
+    velocity[1, 1:-1, 1:-1] = 0.1*np.random.default_rng(0).standard_normal((cells, cells))
+
+    results = []
+    for backend in ("numba", "numpy"):
+        sim = Simulation(900, 900, cells, backend, SolverConfig(layout="soa", n_iter=200))
+        u, v = planes(sim.velocity_field)
+        u[...], v[...] = velocity
+        it, _ = sim.backend.diffuse(1/60, sim.velocity_field, 1.0)
+        results.append((np.array(sim.velocity_field), it))
+
+    (expected, it), (field, numpy_it) = results
+    assert numpy_it == it
+    scale = np.abs(expected).max()
+    np.testing.assert_allclose(field, expected, rtol=0, atol=TOLERANCE*scale)
+
+
+def test_strips_warm_up_stops_its_workers(monkeypatch):
+    sim = Simulation(900, 900, 16, "strips", SolverConfig(strip_workers=2))
+    try:
+        workers = set(multiprocessing.active_children())
+        sim.warm_up()
+        assert set(multiprocessing.active_children()) == workers
+
+        # the traceback keeps the small simulation alive
+        def fail(*args):
+            raise RuntimeError("step failed")
+        monkeypatch.setattr(TimeIntegrator, "advance", fail)
+        with pytest.raises(RuntimeError) as failure:
+            sim.warm_up()
+        assert set(multiprocessing.active_children()) == workers
+    finally:
+        sim.backend.close()
+    assert not multiprocessing.active_children()
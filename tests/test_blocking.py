@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+from modules.config import SolverConfig
+from modules.simulation import Simulation
+
+
+def run(layout, cells=50, **settings):
+    sim = Simulation(900, 900, cells, config=SolverConfig(layout=layout, n_iter=40, **settings))
+    for _ in range(6):
+        sim.add_density(cells//2, cells//3, 3)
+        sim.add_velocity(cells//2, cells//3, 2, 300/60, -500/60)
+        sim.solve_fields(1/60)
+    return sim
+
+
+@pytest.mark.parametrize("layout", ["aos", "soa"])
+@pytest.mark.parametrize("block, steps", [(16, 4), (8, 3)])
+def test_same_fields_as_plain_sweeps(layout, block, steps):
+    expected = run(layout)
+    sim = run(layout, temporal_blocking=True, block_size=block, block_steps=steps)
+
+    np.testing.assert_array_equal(sim.density_field, expected.density_field)
+    np.testing.assert_array_equal(sim.velocity_field, expected.velocity_field)
+    assert {name: it for name, (it, _) in sim.solve_stats.items()} == {
+        name: it for name, (it, _) in expected.solve_stats.items()
+    }
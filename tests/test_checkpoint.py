@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from modules import checkpoint
+from modules.config import SolverConfig
+from modules.integrator import TimeIntegrator
+from modules.simulation import Simulation
+
+
+def simulation(backend="numba", **settings):
+    sim = Simulation(900, 900, 32, backend, SolverConfig(**settings))
+    # 1/60 frames in steps of 1/100, the accumulator carries over
+    sim.integrator = TimeIntegrator("fixed", fixed_dt=1/100)
+    return sim
+
+
+def advance(sim, frames):
+    for _ in range(frames):
+        sim.add_density(16, 12, 3)
+        sim.add_velocity(16, 12, 2, 3.0, -8.0)
+        sim.advance(1/60)
+
+
+def assert_same_state(sim, expected):
+    for name in checkpoint.FIELDS:
+        assert np.array_equal(getattr(sim, name), getattr(expected, name)), name
+    assert sim.integrator.accumulator == expected.integrator.accumulator
+
+
+@pytest.fixture
+def saved(tmp_path):
+    # an uninterrupted run of 10 frames, saved after the fifth
+    sim = simulation()
+    advance(sim, 5)
+    path = checkpoint.save(sim, str(tmp_path / "run.ckpt"), frame=4)
+    advance(sim, 5)
+    return sim, path
+
+
+def test_restore_continues_bit_exact(saved):
+    expected, path = saved
+    sim = simulation()
+    assert checkpoint.restore(sim, path)["frame"] == 4
+
+    advance(sim, 5)
+    assert_same_state(sim, expected)
+
+
+def test_load_continues_bit_exact(saved):
+    expected, path = saved
+    sim = checkpoint.load(path)
+    assert sim.integrator.mode == "fixed"
+
+    advance(sim, 5)
+    assert_same_state(sim, expected)
+
+
+@pytest.mark.parametrize("backend, settings", [("numba", {"n_iter": 10}), ("numba", {"layout": "soa"}), ("numpy", {})])
+def test_restore_refuses_other_settings(saved, backend, settings):
+    expected, path = saved
+    sim = simulation(backend, **settings)
+    density = sim.density_field
+
+    with pytest.raises(ValueError):
+        checkpoint.restore(sim, path)
+    assert sim.density_field is density
@@ -0,0 +1,92 @@
+import pytest
+
+from modules.integrator import TimeIntegrator
+from modules.simulation import Simulation
+
+
+def simulation(speed=0.0):
+    # cells of size 1, the solves are recorded instead of run
+    sim = Simulation(16, 16, 16)
+    sim.velocity_field[..., 0] = speed
+    sim.steps = []
+    sim.solve_fields = sim.steps.append
+    return sim
+
+
+def test_cfl_substeps():
+    sim = simulation(speed=90.0)
+    integrator = TimeIntegrator("cfl", cfl=1.0)
+
+    assert integrator.advance(sim, 1/30) == 3
+    assert sim.steps == pytest.approx([1/90]*3)
+    assert integrator.courant == pytest.approx(1.0)
+    assert integrator.dropped == 0.0
+
+
+def test_cfl_at_rest_is_one_step():
+    sim = simulation()
+    integrator = TimeIntegrator("cfl")
+
+    assert integrator.advance(sim, 1/60) == 1
+    assert sim.steps == [1/60]
+
+
+def test_cfl_caps_substeps_and_drops_time():
+    sim = simulation(speed=600.0)
+    integrator = TimeIntegrator("cfl", cfl=1.0, max_substeps=4)
+    integrator.advance(sim, 1/30)
+
+    # the cfl target is kept, only 4 cells of travel are simulated
+    assert sim.steps == pytest.approx([1/600]*4)
+    assert integrator.courant == pytest.approx(1.0)
+    assert integrator.dropped == pytest.approx(1/30 - 4/600)
+
+
+def test_cfl_cuts_long_frames():
+    sim = simulation()
+    integrator = TimeIntegrator("cfl", max_dt=1/15)
+    integrator.advance(sim, 1.0)
+
+    assert sim.steps == [1/15]
+    assert integrator.dropped == pytest.approx(1 - 1/15)
+
+
+@pytest.mark.parametrize("mode", ["cfl", "fixed", None])
+def test_zero_dt_does_not_solve(mode):
+    sim = simulation(speed=10.0)
+
+    assert TimeIntegrator(mode).advance(sim, 0.0) == 0
+    assert sim.steps == []
+
+
+def test_fixed_steps_accumulate():
+    sim = simulation()
+    integrator = TimeIntegrator("fixed", fixed_dt=0.25)
+
+    assert integrator.advance(sim, 0.375) == 1
+    assert integrator.accumulator == 0.125
+    assert integrator.advance(sim, 0.375) == 2
+    assert sim.steps == [0.25]*3
+    assert integrator.accumulator == 0.0
+
+
+def test_fixed_drops_backlog():
+    sim = simulation()
+    integrator = TimeIntegrator("fixed", fixed_dt=0.25, max_substeps=4)
+    integrator.advance(sim, 2.125)
+
+    assert sim.steps == [0.25]*4
+    assert integrator.dropped == 1.0
+    assert integrator.accumulator == 0.125
+
+
+def test_no_integrator_is_one_solve():
+    sim = simulation(speed=1000.0)
+
+    assert TimeIntegrator(None).advance(sim, 1/60) == 1
+    assert sim.steps == [1/60]
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        TimeIntegrator("rk4")
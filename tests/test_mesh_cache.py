@@ -0,0 +1,21 @@
+import numpy as np
+
+from modules import mesh_cache
+
+
+def test_built_once_per_version(tmp_path, monkeypatch):
+    monkeypatch.setattr(mesh_cache, "cache_dir", str(tmp_path))
+    builds = []
+
+    def build():
+        builds.append(1)
+        return np.arange(len(builds) + 3)
+
+    first = mesh_cache.cached("index", (8, 900), build)
+    np.testing.assert_array_equal(mesh_cache.cached("index", (8, 900), build), first)
+    assert len(builds) == 1
+
+    # files of another layout are not loaded
+    monkeypatch.setattr(mesh_cache, "FORMAT_VERSION", mesh_cache.FORMAT_VERSION + 1)
+    assert len(mesh_cache.cached("index", (8, 900), build)) == len(first) + 1
+    assert len(builds) == 2
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from modules import multigrid
+
+
+@pytest.mark.parametrize("smoother", ["jacobi", "gauss"])
+@pytest.mark.parametrize("n", [25, 33, 48, 49, 100])
+def test_converges_on_any_grid_size(n, smoother):
+    rng = np.random.default_rng(n)
+    divergence = np.zeros((n+2, n+2))
+    divergence[1:-1, 1:-1] = rng.standard_normal((n, n))
+    pressure = np.zeros_like(divergence)
+
+    it, res = multigrid.solve(pressure, divergence, cycles=8, smoother=smoother)
+
+    assert res < 1e-5*multigrid.rms(divergence)
+    # residual_norm is the one of the pressure left in place
+    assert res == pytest.approx(multigrid.residual_norm(pressure, divergence))
+
+
+def test_odd_levels_are_not_coarsened():
+    pressure = np.zeros((100+2, 100+2))
+    hierarchy = multigrid.build_hierarchy(pressure, np.zeros_like(pressure))
+
+    # 100, 50, 25
+    assert [level[0].shape[0]-2 for level in hierarchy] == [100, 50, 25]
+
+
+def test_odd_coarsest_level_above_direct_cells(monkeypatch):
+    # 50, 25: the 25x25 level is too large to factorize, cg solves it
+    monkeypatch.setattr(multigrid, "direct_cells", 16*16)
+    n = 50
+    divergence = np.zeros((n+2, n+2))
+    divergence[1:-1, 1:-1] = np.random.default_rng(n).standard_normal((n, n))
+    pressure = np.zeros_like(divergence)
+
+    it, res = multigrid.solve(pressure, divergence, cycles=8)
+
+    assert res < 1e-5*multigrid.rms(divergence)
@@ -0,0 +1,105 @@
+import threading
+
+import numpy as np
+import pytest
+
+from modules.recorder import FOOTER, Recorder, Recording
+from modules.simulation import Simulation
+
+
+def frames(count, n=16, seed=0):
+    # simulations with random fields, one per frame
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        sim = Simulation(n, n, n)
+        sim.density_field[...] = rng.random(sim.density_field.shape)
+        sim.velocity_field[...] = rng.standard_normal(sim.velocity_field.shape)
+        yield sim
+
+
+def record(path, sims, **options):
+    with Recorder(path, **options) as recorder:
+        for sim in sims:
+            recorder.record(sim)
+    return recorder
+
+
+def test_round_trip_random_access(tmp_path):
+    path = tmp_path / "run.rec"
+    sims = list(frames(10))
+    record(path, sims, density_format="float32", velocity_format="float32", keyframe=4, chunk_frames=3)
+
+    with Recording(path) as recording:
+        assert len(recording) == 10
+        assert list(recording.frames) == list(range(10))
+        # backwards, across keyframes, then from the cached record
+        for i in [9, 0, 6, 3, 4, 5, -1]:
+            fields = recording.read(i)
+            assert np.array_equal(fields["density"], sims[i].density_field[1:-1, 1:-1])
+            assert np.array_equal(fields["velocity"], sims[i].velocity_field[1:-1, 1:-1])
+        with pytest.raises(IndexError):
+            recording[10]
+
+
+def test_quantized_density(tmp_path):
+    path = tmp_path / "run.rec"
+    sims = list(frames(3))
+    sims[1].density_field[5, 5] = 2.0
+    record(path, sims, density_format="uint16", keyframe=2)
+
+    with Recording(path) as recording:
+        assert set(recording.fields) == {"density"}
+        for i, sim in enumerate(sims):
+            expected = np.clip(sim.density_field[1:-1, 1:-1], 0, 1)
+            assert np.abs(recording[i] - expected).max() <= 0.5/65535 + 1e-7
+
+
+def test_crashed_recording_is_scanned(tmp_path):
+    path = tmp_path / "run.rec"
+    sims = list(frames(7))
+    record(path, sims, density_format="float32", keyframe=3, chunk_frames=2)
+
+    data = path.read_bytes()
+    with Recording(path) as recording:
+        offsets = recording.index["offset"].copy()
+        index_bytes = recording.index.nbytes + FOOTER.size
+
+    # no index: every frame is found from the chunk headers
+    path.write_bytes(data[:-index_bytes])
+    with Recording(path) as recording:
+        assert len(recording) == 7
+        assert np.array_equal(recording[5], sims[5].density_field[1:-1, 1:-1])
+
+    # cut inside the chunk of frames 4 and 5, only the complete chunks are read
+    path.write_bytes(data[:offsets[5] + 10])
+    with Recording(path) as recording:
+        assert len(recording) == 4
+        assert np.array_equal(recording[3], sims[3].density_field[1:-1, 1:-1])
+
+
+def test_full_buffers_drop_frames(tmp_path):
+    recorder = Recorder(tmp_path / "run.rec", buffers=2, block=False)
+
+    # encoders wait until released, so both buffers stay in flight
+    release = threading.Event()
+    encode = recorder.encode
+    recorder.encode = lambda *args: release.wait() and encode(*args)
+
+    sims = list(frames(3))
+    assert recorder.record(sims[0])
+    assert recorder.record(sims[1])
+    assert not recorder.record(sims[2])
+    stats = recorder.stats()
+    assert (stats["recorded"], stats["dropped"], stats["in_flight"]) == (2, 1, 2)
+
+    release.set()
+    recorder.close()
+    stats = recorder.stats()
+    assert (stats["written"], stats["in_flight"]) == (2, 0)
+    assert stats["ratio"] > 0
+
+
+@pytest.mark.parametrize("options", [{"density_format": "float64"}, {"velocity_format": "uint8"}, {"buffers": 1}])
+def test_invalid_options(tmp_path, options):
+    with pytest.raises(ValueError):
+        Recorder(tmp_path / "run.rec", **options)
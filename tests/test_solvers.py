@@ -0,0 +1,313 @@
+import numpy as np
+import pytest
+
+from modules import conjugate_gradient, direct, solvers, spectral
+from modules.backends import Backend
+from modules.config import SolverConfig
+from modules.layout import LAYOUTS, aos_view, velocity_shape
+from modules.simulation import Simulation
+
+
+def with_ghosts(field):
+    # copy with the ghost cells of update_bnd
+    field = field.copy()
+    field[0], field[-1] = field[1], field[-2]
+    field[:, 0], field[:, -1] = field[:, 1], field[:, -2]
+    return field
+
+
+def neighbours(field):
+    field = with_ghosts(field)
+    return field[:-2, 1:-1] + field[2:, 1:-1] + field[1:-1, :-2] + field[1:-1, 2:]
+
+
+def pressure_residual(p, div):
+    """rms of div - (4p - sum of neighbours) on the interior"""
+
+    r = div[1:-1, 1:-1] - (4*p[1:-1, 1:-1] - neighbours(p))
+    return np.sqrt(np.mean(r**2))
+
+
+def diffusion_residual(x, x0, a):
+    """rms of x0 - ((1+a)x - a/4*(sum of neighbours)) on the interior"""
+
+    r = x0[1:-1, 1:-1] - ((1+a)*x[1:-1, 1:-1] - a/4*neighbours(x))
+    return np.sqrt(np.mean(r**2))
+
+
+def rms(field):
+    return np.sqrt(np.mean(field[1:-1, 1:-1]**2))
+
+
+def pressure_problem(n=48, seed=0):
+    """Zero pressure and a divergence that sums to zero, with ghost cells"""
+
+    div = np.zeros((n+2, n+2))
+    div[1:-1, 1:-1] = np.random.default_rng(seed).standard_normal((n, n))
+    div[1:-1, 1:-1] -= div[1:-1, 1:-1].mean()
+    return np.zeros_like(div), div
+
+
+def diffusion_problem(n=48, seed=1):
+    field = np.zeros((n+2, n+2))
+    field[1:-1, 1:-1] = np.random.default_rng(seed).random((n, n))
+    return with_ghosts(field)
+
+
+@pytest.mark.parametrize("preconditioner", ["jacobi", "mic"])
+def test_cg_pressure_converges(preconditioner):
+    p, div = pressure_problem()
+    it, res = conjugate_gradient.solve_pressure(p, div, 0.0, 1e-8, 500, preconditioner)
+
+    assert it < 500
+    assert pressure_residual(p, div) < 1e-6*rms(div)
+
+
+@pytest.mark.parametrize("preconditioner", ["jacobi", "mic"])
+def test_cg_diffusion_converges(preconditioner):
+    x0 = diffusion_problem()
+    field = x0.copy()
+    a = 0.5
+    conjugate_gradient.solve_diffusion(field, a, 0.0, 1e-8, 500, preconditioner)
+
+    assert diffusion_residual(field, x0, a) < 1e-6*rms(x0)
+
+
+def test_cg_unknown_preconditioner():
+    p, div = pressure_problem(8)
+    with pytest.raises(ValueError):
+        conjugate_gradient.solve_pressure(p, div, 0.0, 1e-8, 10, "ilu")
+
+
+def red_black_reference(p, div, sweeps, omega):
+    # the same red-black sweeps, one color at a time in numpy
+    p = p.copy()
+    i, j = np.indices(p.shape)
+    for it in range(sweeps):
+        for color in range(2):
+            mask = ((i + j) % 2 == color)[1:-1, 1:-1]
+            relaxed = (1-omega)*p[1:-1, 1:-1] + omega*(neighbours(p) + div[1:-1, 1:-1])/4.0
+            p[1:-1, 1:-1][mask] = relaxed[mask]
+            p = with_ghosts(p)
+    return p
+
+
+@pytest.mark.parametrize("omega", [1.0, 1.5])
+def test_red_black_project_matches_reference(omega):
+    p, div = pressure_problem(17)
+    solved = p.copy()
+    solvers.gauss_siedel_project(solved, div, omega, SolverConfig().n_iter, 0.0, 0.0)
+
+    expected = red_black_reference(p, div, SolverConfig().n_iter, omega)
+    assert np.allclose(solved[1:-1, 1:-1], expected[1:-1, 1:-1], rtol=0, atol=1e-12)
+
+
+def test_over_relaxation_converges_faster():
+    p, div = pressure_problem(32)
+    residuals = []
+    for omega in [1.0, 1.8]:
+        solved = p.copy()
+        solvers.gauss_siedel_project(solved, div, omega, 200, 0.0, 0.0)
+        residuals.append(pressure_residual(solved, div))
+
+    assert residuals[1] < 0.5*residuals[0]
+
+
+@pytest.mark.parametrize("solver", ["jacobi", "gauss"])
+def test_diffusion_solves_backward_euler(solver):
+    x0 = diffusion_problem()
+    field = x0[:, :, np.newaxis].copy()
+    if solver == "gauss":
+        it, res = solvers.gauss_siedel(field, np.zeros_like(field), 0.5, 1.0, 1.0, 500, 0.0, 1e-10)
+    else:
+        it, res = solvers.jacobi(field, np.zeros_like(field), np.zeros_like(field), 0.5, 1.0, 500, 0.0, 1e-10)
+
+    assert it < 500
+    assert diffusion_residual(field[:, :, 0], x0, 0.5) < 1e-6*rms(x0)
+
+
+def test_projection_stops_on_tolerance():
+    p, div = pressure_problem(32)
+    iterations = []
+    for tol_rel in [1e-1, 1e-2]:
+        it, res = solvers.jacobi_project(p.copy(), div, np.zeros_like(p), 5000, 0.0, tol_rel)
+        iterations.append(it)
+
+    assert 1 < iterations[0] < iterations[1] < 5000
+
+    it, res = solvers.jacobi_project(p.copy(), div, np.zeros_like(p), 5000, 1e300, 0.0)
+    assert it == 1
+
+
+def scene(n=32, **settings):
+    sim = Simulation(n, n, n, config=SolverConfig(**settings))
+    sim.add_density(n//2, n//2, 4)
+    sim.add_velocity(n//2, n//2, 4, 1.0, 0.5)
+    return sim
+
+
+def test_step_records_solve_stats():
+    sim = scene()
+    sim.solve_fields(0.1)
+
+    assert set(sim.solve_stats) == {"difuse_step", "difuse_vel_step", "project_1", "project_2"}
+    for it, res in sim.solve_stats.values():
+        assert 1 <= it <= SolverConfig().n_iter
+        assert res >= 0
+
+
+@pytest.mark.parametrize("solver", ["jacobi", "gauss", "cg", "multigrid"])
+def test_workspace_is_reused(solver):
+    config = SolverConfig(
+        solver_gauss=solver == "gauss", solver_cg=solver == "cg", solver_multigrid=solver == "multigrid"
+    )
+    sim, fresh = scene(**vars(config)), scene()
+    sim.solve_fields(0.1)
+    workspace = sim.backend.workspace
+    buffers = {name: id(value) for name, value in vars(workspace).items()}
+    for step in range(2):
+        sim.solve_fields(0.1)
+    for step in range(3):
+        # a new workspace on every call
+        solvers.solve_fields(
+            0.1, fresh.dx, fresh.dy, fresh.width, fresh.height,
+            fresh.density_field, fresh.velocity_field, pressure_field=fresh.pressure_field, config=config
+        )
+
+    assert buffers == {name: id(value) for name, value in vars(workspace).items()}
+    assert np.array_equal(sim.density_field, fresh.density_field)
+    assert np.array_equal(sim.velocity_field, fresh.velocity_field)
+
+
+@pytest.mark.parametrize("sweeps", [1, 2, 3])
+def test_jacobi_project_ends_on_field(sweeps):
+    # ping-pong sweeps leave the result in the field for any count
+    p, div = pressure_problem(16)
+    solved = p.copy()
+    solvers.jacobi_project(solved, div, np.zeros_like(p), sweeps, 0.0, 0.0)
+
+    expected = p
+    for it in range(sweeps):
+        expected = with_ghosts(expected)
+        expected[1:-1, 1:-1] = (neighbours(expected) + div[1:-1, 1:-1])/4.0
+    assert np.allclose(solved[1:-1, 1:-1], expected[1:-1, 1:-1], rtol=0, atol=1e-12)
+
+
+def test_warm_start_lowers_residual():
+    # same number of jacobi sweeps, starting from the last pressure
+    residuals = []
+    for warm_start in [False, True]:
+        sim = Simulation(32, 32, 32)
+        sim.warm_start = warm_start
+        total = 0.0
+        for step in range(20):
+            sim.add_density(24, 16, 3)
+            sim.add_velocity(24, 16, 3, 0.0, -2.0)
+            sim.solve_fields(0.1)
+            if step >= 10:
+                total += sim.solve_stats["project_1"][1] + sim.solve_stats["project_2"][1]
+        residuals.append(total)
+
+    assert residuals[1] < 0.5*residuals[0]
+    assert sim.pressure_field.any()
+
+
+@pytest.mark.parametrize("shape", [(32, 32), (24, 40)])
+def test_spectral_is_exact(shape):
+    div = np.zeros((shape[0]+2, shape[1]+2))
+    div[1:-1, 1:-1] = np.random.default_rng(2).standard_normal(shape)
+    p = np.zeros_like(div)
+    it, res = spectral.solve(p, div)
+
+    assert it == 1
+    assert pressure_residual(p, div) < 1e-10*rms(div)
+    # the divergence is made to sum to zero, pressure keeps a zero mean
+    assert abs(div[1:-1, 1:-1].sum()) < 1e-9
+    assert abs(p[1:-1, 1:-1].mean()) < 1e-12
+
+
+def test_direct_pressure_is_exact():
+    p, div = pressure_problem(24)
+    it, res = direct.solve_pressure(p, div)
+
+    assert it == 1
+    assert pressure_residual(p, div) < 1e-10*rms(div)
+
+
+def test_direct_diffusion_is_exact():
+    x0 = diffusion_problem(24)
+    field = x0.copy()
+    direct.solve_diffusion(field, 0.25, 2.0)
+
+    assert diffusion_residual(field, x0, 0.5) < 1e-10*rms(x0)
+
+
+def test_direct_factorization_is_cached():
+    direct.diffusion_factorization.cache_clear()
+    for step in range(3):
+        direct.solve_diffusion(diffusion_problem(24), 0.25, 2.0)
+    direct.solve_diffusion(diffusion_problem(24), 0.5, 2.0)
+
+    info = direct.diffusion_factorization.cache_info()
+    assert (info.hits, info.misses) == (2, 2)
+
+
+def test_fused_advection_matches_two_passes():
+    sim = scene(fused_advection=True)
+    rng = np.random.default_rng(3)
+    sim.velocity_field[...] = rng.uniform(-3, 3, sim.velocity_field.shape)
+    sim.density_field[...] = rng.random(sim.density_field.shape)
+    density, velocity = sim.density_field.copy(), sim.velocity_field.copy()
+    grid = (0.5, sim.dx, sim.dy, sim.width, sim.height)
+
+    sim.backend.advect_fused(*grid, sim.density_field, sim.velocity_field)
+    # the fallback of backends without a single pass kernel
+    Backend.advect_fused(sim.backend, *grid, density, velocity)
+
+    assert np.array_equal(sim.density_field, density)
+    assert np.array_equal(sim.velocity_field, velocity)
+
+
+@pytest.mark.parametrize("solver", ["jacobi", "gauss", "cg", "multigrid", "spectral"])
+def test_soa_same_fields_as_aos(solver):
+    # fixed iteration counts, both layouts run the same operations
+    fields = []
+    for layout in LAYOUTS:
+        sim = scene(
+            layout=layout, tolerance_abs=0.0, tolerance_rel=0.0, solver_gauss=solver == "gauss",
+            solver_cg=solver == "cg", solver_multigrid=solver == "multigrid", solver_spectral=solver == "spectral"
+        )
+        assert sim.velocity_field.shape == velocity_shape(sim.density_field.shape, layout)
+        for step in range(3):
+            sim.solve_fields(0.1)
+        fields.append((sim.density_field, aos_view(sim.velocity_field)))
+
+    (density, velocity), (soa_density, soa_velocity) = fields
+    assert np.array_equal(density, soa_density)
+    assert np.array_equal(velocity, soa_velocity)
+
+
+def test_unknown_layout():
+    with pytest.raises(ValueError):
+        velocity_shape((10, 10), "aosoa")
+
+
+def test_active_tiles_at_zero_dt():
+    # a step of 0 moves nothing, the tiles come from the density alone
+    sim, full = scene(96, active_tiles=True), scene(96)
+    for s in (sim, full):
+        aos_view(s.velocity_field)[85:90, 85:90] = 50.0
+        s.solve_fields(0.0)
+
+    tiles = sim.backend.tiles
+    density = sim.density_field[1:-1, 1:-1].reshape(6, 16, 6, 16)
+    smoke = np.abs(density).max(axis=(1, 3)) > sim.config.active_threshold
+    assert np.array_equal(tiles.core, smoke)
+    assert tiles.radius == 1
+    assert tiles.mask[smoke].all()
+    assert not tiles.mask[5, 5]
+    assert np.array_equal(sim.density_field, full.density_field)
+
+    # with a step to take, the fast cells are active as well
+    sim.backend.track_active(0.1, sim.dx, sim.dy, sim.density_field, sim.velocity_field)
+    assert tiles.core[5, 5]